@@ -2,15 +2,14 @@ from django.contrib import admin, messages
 from django import forms
 from django.utils.html import format_html
 import json # Added for formatting
-from .models import Attack, Battle, Script, GameConfiguration, AttackUsageStats
-from django.db import transaction # <-- Import transaction
-from django.db.models import Count, Case, When, Value, IntegerField # Added for annotation
+from .models import Attack, Battle, Script, GameConfiguration, AttackUsageStats, BattleStatsOutbox, StatsRecalculationJob
+from .stats_recalculation import queue_recalculation_job
+from django.db.models import Count, Case, F, Q, When, Value, IntegerField # Added for annotation
 from unfold.admin import ModelAdmin
 from django.contrib.admin import SimpleListFilter # Added for custom filter
 # Import the correct widget based on the user-provided library
 from djangoeditorwidgets.widgets import MonacoEditorWidget 
 from django.utils.safestring import mark_safe
-import traceback # For detailed error logging
 from django.db import models
 
 # --- Game Configuration Admin ---
@@ -109,12 +108,14 @@ class BattleLogErrorFilter(SimpleListFilter):
     def queryset(self, request, queryset):
         """Filters the queryset based on the selected option."""
         error_pattern = '"effect_type": "error"' # Simple string pattern
+        # Archived battles keep their error count on the archive row
+        has_errors = Q(last_turn_summary__icontains=error_pattern) | Q(archive__error_count__gt=0)
         if self.value() == 'yes':
             # Filter for battles where the log contains the error pattern
-            return queryset.filter(last_turn_summary__icontains=error_pattern)
+            return queryset.filter(has_errors)
         if self.value() == 'no':
             # Exclude battles where the log contains the error pattern
-            return queryset.exclude(last_turn_summary__icontains=error_pattern)
+            return queryset.exclude(has_errors)
         # Return the full queryset if no filter is selected
         return queryset
 
@@ -134,153 +135,15 @@ class AttackUsageStatsAdmin(ModelAdmin):
         # Handle potential case where attack might be deleted but stats remain
         return obj.attack.name if obj.attack else "[Deleted Attack]"
 
-    @admin.action(description='(SLOW) Recalculate ALL usage stats from LOGS')
+    @admin.action(description='Recalculate ALL usage stats from LOGS (background job)')
     def recalculate_all_stats(self, request, queryset):
-        # Note: queryset is ignored here as we recalculate ALL stats globally
-        try:
-            with transaction.atomic():
-                # 0. Ensure stats objects exist for all attacks BEFORE resetting
-                all_attacks = Attack.objects.all()
-                existing_stat_attack_ids = set(AttackUsageStats.objects.values_list('attack_id', flat=True))
-                missing_stats_to_create = []
-                for attack in all_attacks:
-                    if attack.id not in existing_stat_attack_ids:
-                        # Use default= parameter for get_or_create if you have defaults in model
-                        # Otherwise, create manually or ensure defaults are handled by model's save()
-                        missing_stats_to_create.append(AttackUsageStats(attack=attack)) 
-                
-                if missing_stats_to_create:
-                    AttackUsageStats.objects.bulk_create(missing_stats_to_create, ignore_conflicts=True) # Use ignore_conflicts just in case
-                    print(f"[Admin Action] Created {len(missing_stats_to_create)} missing AttackUsageStats records.")
-
-
-                # 1. Reset existing stats - CORRECTED FIELDS
-                num_reset = AttackUsageStats.objects.update(
-                    times_used=0, 
-                    wins_vs_human=0,
-                    losses_vs_human=0,
-                    wins_vs_bot=0,
-                    losses_vs_bot=0,
-                    total_damage_dealt=0,
-                    total_healing_done=0, # Make sure this field exists on the model
-                    co_used_with_counts={} # Ensure this uses default={} in the model field
-                )
-                print(f"[Admin Action] Reset {num_reset} AttackUsageStats records to zero.")
-
-                # 2. Iterate through finished battles and recalculate from logs
-                processed_battles = 0
-                attacks_found_total = 0
-                wins_contributed_total = 0
-
-                # Prepare a cache for Attack objects to reduce DB lookups by name
-                attack_cache = {attack.name: attack for attack in Attack.objects.all()}
-                print(f"[Admin Action] Cached {len(attack_cache)} Attack objects.")
-
-                # Use iterator for memory efficiency
-                for battle in Battle.objects.filter(status='finished').iterator(chunk_size=500): # Smaller chunk size might be better for log processing
-                    processed_battles += 1
-                    winner_role = battle.get_player_role(battle.winner) if battle.winner else None
-                    is_vs_bot = battle.player2_is_ai_controlled # Determine if it was a bot battle
-                    unique_attacks_used_in_battle = set() # Store Attack objects
-
-                    # --- NEW: Determine loser role ---
-                    loser_role = None
-                    if winner_role == 'player1':
-                        loser_role = 'player2'
-                    elif winner_role == 'player2':
-                        loser_role = 'player1'
-                    # --- END NEW ---
-
-                    if not isinstance(battle.last_turn_summary, list):
-                        print(f"[Admin Action Warning] Battle {battle.id} has invalid log format. Skipping.")
-                        continue
-
-                    # Parse logs for this battle
-                    for log_entry in battle.last_turn_summary:
-                        if isinstance(log_entry, dict) and \
-                           log_entry.get('effect_type') == 'action' and \
-                           isinstance(log_entry.get('effect_details'), dict) and \
-                           'attack_name' in log_entry['effect_details']:
-
-                            attack_name = log_entry['effect_details']['attack_name']
-                            log_source_role = log_entry.get('source') # 'player1' or 'player2'
-
-                            # Find attack using cache first, then DB fallback (case-sensitive)
-                            attack_obj = attack_cache.get(attack_name)
-                            if not attack_obj:
-                                # Fallback DB lookup if not in cache (less efficient)
-                                try:
-                                     # Consider if case-insensitivity is needed: attack_obj = Attack.objects.get(name__iexact=attack_name)
-                                     attack_obj = Attack.objects.get(name=attack_name)
-                                     attack_cache[attack_name] = attack_obj # Add to cache if found
-                                except Attack.DoesNotExist:
-                                    print(f"[Admin Action Warning] Attack '{attack_name}' mentioned in Battle {battle.id} log not found in DB. Skipping.")
-                                    continue
-
-                            # If attack found, process it
-                            if attack_obj:
-                                stats, created = AttackUsageStats.objects.get_or_create(attack=attack_obj)
-                                
-                                # Increment times_used (only once per attack per battle)
-                                if attack_obj not in unique_attacks_used_in_battle:
-                                    stats.times_used += 1
-                                    # REMOVED save here - save once at the end of processing this attack
-                                    unique_attacks_used_in_battle.add(attack_obj)
-                                    attacks_found_total += 1
-
-                                # Check if this winner used this attack in this battle log
-                                if winner_role and log_source_role == winner_role:
-                                    if not hasattr(battle, f'_counted_win_{attack_obj.id}'):
-                                        # --- CORRECTED WIN INCREMENT --- 
-                                        if is_vs_bot:
-                                            stats.wins_vs_bot += 1
-                                        else:
-                                            stats.wins_vs_human += 1
-                                        # stats.wins_contributed += 1 # <- REMOVED OLD LINE
-                                        # REMOVED save here - save once at the end
-                                        setattr(battle, f'_counted_win_{attack_obj.id}', True)
-                                        wins_contributed_total += 1
-                                        
-                                # --- NEW: Check if this LOSER used this attack ---
-                                elif loser_role and log_source_role == loser_role:
-                                    if not hasattr(battle, f'_counted_loss_{attack_obj.id}'):
-                                        if is_vs_bot:
-                                            stats.losses_vs_bot += 1
-                                        else:
-                                            stats.losses_vs_human += 1
-                                        setattr(battle, f'_counted_loss_{attack_obj.id}', True)
-                                        # No need to count total losses separately unless desired for logging
-                                # --- END NEW ---
-
-                                stats.save() # Save the stat object ONCE after all updates for this attack in this battle
-
-                    # Optional: Clean up temporary attributes if needed, though they are instance-specific
-                    # for attack_obj in unique_attacks_used_in_battle:
-                    #    if hasattr(battle, f'_counted_win_{attack_obj.id}'):
-                    #        delattr(battle, f'_counted_win_{attack_obj.id}')
-                    #    if hasattr(battle, f'_counted_loss_{attack_obj.id}'): delattr(battle, f'_counted_loss_{attack_obj.id}')
-
-
-            # 3. Optional Cleanup of orphan stats (stats for deleted attacks)
-            # Note: This permanently deletes stats. Only uncomment if intended.
-            # deleted_stats_count = 0
-            # try:
-            #     orphan_stats = AttackUsageStats.objects.filter(attack__isnull=True)
-            #     deleted_stats_count = orphan_stats.count()
-            #     if deleted_stats_count > 0:
-            #         orphan_stats.delete()
-            #         print(f"[Admin Action] Cleaned up {deleted_stats_count} AttackUsageStats records for deleted attacks.")
-            # except Exception as cleanup_e:
-            #     print(f"[Admin Action Warning] Error during orphan stats cleanup: {cleanup_e}")
-
-
-            self.message_user(request, f"Successfully recalculated stats from logs. Processed {processed_battles} finished battles. Incremented 'times_used' {attacks_found_total} times and 'wins_contributed' {wins_contributed_total} times across relevant attacks. Note: This process can be slow.", messages.SUCCESS)
-            print(f"[Admin Action] Log-based recalculation complete. Processed {processed_battles} battles.")
-
-        except Exception as e:
-            traceback.print_exc() # Print full traceback to server logs
-            self.message_user(request, f"ERROR during log-based recalculation: {e}", messages.ERROR)
-            print(f"[Admin Action Error] Log-based recalculation failed: {e}")
+        # Note: queryset is ignored here as we recalculate ALL stats globally.
+        # The work runs in the stats worker (or `manage.py recalculate_attack_stats`), not in this request.
+        job, created = queue_recalculation_job(requested_by=request.user)
+        if created:
+            self.message_user(request, f"Queued stats recalculation job #{job.pk}. The stats worker will pick it up; progress is shown under Stats recalculation jobs.", messages.SUCCESS)
+        else:
+            self.message_user(request, f"Stats recalculation job #{job.pk} is already {job.status}.", messages.WARNING)
 # --- END Attack Usage Stats Admin ---
 
 # --- Battle Admin Definition (Ensure it's also correct) ---
@@ -295,9 +158,10 @@ class BattleAdmin(ModelAdmin):
         'turn_number', 
         'winner', 
         'error_count', # Added error count
-        'updated_at'
+        'updated_at',
+        'is_archived',
     )
-    list_filter = ('status', 'whose_turn', BattleLogErrorFilter) # Added custom filter
+    list_filter = ('status', 'whose_turn', 'is_archived', BattleLogErrorFilter) # Added custom filter
     search_fields = ('player1__username', 'player2__username')
     readonly_fields = (
         'created_at', 
@@ -327,9 +191,11 @@ class BattleAdmin(ModelAdmin):
         queryset = queryset.annotate(
             _has_errors=Case(
                 When(last_turn_summary__icontains=error_pattern, then=Value(1)),
+                When(archive__error_count__gt=0, then=Value(1)),
                 default=Value(0),
                 output_field=IntegerField()
-            )
+            ),
+            _archived_error_count=F('archive__error_count'), # Avoids loading archive blobs per row
         )
         return queryset
 
@@ -337,6 +203,8 @@ class BattleAdmin(ModelAdmin):
     @admin.display(description='Error Count', ordering='_has_errors')
     def error_count(self, obj):
         """Counts log entries with effect_type 'error' in last_turn_summary."""
+        if obj.is_archived:
+            return getattr(obj, '_archived_error_count', None) or 0
         if isinstance(obj.last_turn_summary, list):
             count = sum(1 for entry in obj.last_turn_summary if isinstance(entry, dict) and entry.get('effect_type') == 'error')
             return count
@@ -347,7 +215,7 @@ class BattleAdmin(ModelAdmin):
         """Formats the last_turn_summary JSON field for display."""
         try:
             # Format the JSON with indentation for readability
-            formatted_json = json.dumps(obj.last_turn_summary, indent=2)
+            formatted_json = json.dumps(obj.get_log(), indent=2) # Reads the archive for archived battles
             # Use format_html to wrap in <pre> tags for preserving whitespace and formatting
             return format_html("<pre>{}</pre>", formatted_json)
         except (TypeError, json.JSONDecodeError):
@@ -455,3 +323,35 @@ class ScriptAdmin(ModelAdmin):
 
 # Register Script model if not already managed elsewhere or via inline
 # admin.site.register(Script) # Can be commented out if only managed via Attack inline
+
+# --- NEW: Battle Stats Outbox Admin ---
+@admin.register(BattleStatsOutbox)
+class BattleStatsOutboxAdmin(ModelAdmin):
+    list_display = ('battle', 'created_at', 'processed_at', 'stats_applied')
+    list_filter = (('processed_at', admin.EmptyFieldListFilter), 'stats_applied')
+    ordering = ('-created_at',)
+    readonly_fields = ('battle', 'created_at', 'processed_at', 'stats_applied')
+
+    def changelist_view(self, request, extra_context=None):
+        # Surface the queue lag on top of the list
+        from .battle_stats import battle_stats_lag
+        lag = battle_stats_lag()
+        self.message_user(request, f"Pending: {lag['pending']} battles, lag: {lag['lag_seconds']}s", messages.INFO)
+        return super().changelist_view(request, extra_context)
+# --- END Battle Stats Outbox Admin ---
+
+# --- NEW: Stats Recalculation Job Admin ---
+@admin.register(StatsRecalculationJob)
+class StatsRecalculationJobAdmin(ModelAdmin):
+    list_display = ('id', 'status', 'shard_progress', 'battles_processed', 'requested_by', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+    readonly_fields = ('status', 'requested_by', 'shard_size', 'created_at', 'started_at', 'finished_at', 'battles_processed', 'error')
+    exclude = ('baseline',)
+
+    @admin.display(description='Shards done')
+    def shard_progress(self, obj):
+        total = obj.shards.count()
+        done = obj.shards.filter(done_at__isnull=False).count()
+        return f"{done}/{total}" if total else "-"
+# --- END Stats Recalculation Job Admin ---
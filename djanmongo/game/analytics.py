@@ -0,0 +1,42 @@
+# djanmongo/game/analytics.py
+
+"""
+Date-range helpers for the analytics endpoints.
+
+The endpoints only read the daily rollup tables (AttackDailyStats, UserDailyStats),
+so a query costs the same no matter how many battles were played in the range.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+
+def parse_date_range(request):
+    """Reads ?from=YYYY-MM-DD&to=YYYY-MM-DD (both inclusive).
+       Defaults to the last ANALYTICS_DEFAULT_DAYS days; ranges are capped at ANALYTICS_MAX_DAYS.
+    """
+    def parse(param):
+        value = request.query_params.get(param)
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ValidationError({param: "Expected a date formatted as YYYY-MM-DD."})
+
+    date_to = parse('to') or timezone.localdate()
+    date_from = parse('from') or date_to - timedelta(days=settings.ANALYTICS_DEFAULT_DAYS - 1)
+    if date_from > date_to:
+        raise ValidationError({'from': "Must not be after 'to'."})
+    if (date_to - date_from).days + 1 > settings.ANALYTICS_MAX_DAYS:
+        raise ValidationError({'from': f"Date ranges are limited to {settings.ANALYTICS_MAX_DAYS} days."})
+    return date_from, date_to
+
+
+def win_rate(wins, losses):
+    """Percentage rounded like the leaderboards, or None without decided battles."""
+    decided = wins + losses
+    return round(wins / decided * 100, 1) if decided else None
@@ -0,0 +1,154 @@
+"""
+Cold archive for finished battles (run by `manage.py archive_battles`).
+
+Finished battles older than BATTLE_ARCHIVE_AFTER_DAYS move their log and per-player
+JSON state into BattleArchive (zlib-compressed) and keep a summary row in Battle with
+`is_archived` set. Readers go through Battle.get_log() / load_archived_state(), or
+battle_logs() for many battles at once, and never need to know where the data lives.
+
+Archiving uses queryset.update(), so Battle.updated_at (the finishing time used by the
+daily rollups and the rating replay) is left untouched. Battles still waiting in the
+stats outbox are not archived until their stats are applied.
+"""
+
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Battle, BattleArchive
+
+ARCHIVED_STATE_FIELDS = (
+    'registered_scripts',
+    'stat_stages_player1', 'stat_stages_player2',
+    'custom_statuses_player1', 'custom_statuses_player2',
+)
+# Values the archived Battle row keeps for those fields (the column defaults)
+EMPTIED_STATE = {
+    'last_turn_summary': [],
+    'registered_scripts': [],
+    'stat_stages_player1': {}, 'stat_stages_player2': {},
+    'custom_statuses_player1': {}, 'custom_statuses_player2': {},
+}
+COMPRESSION_LEVEL = 9 # Written once, read rarely
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+# --- Codec ---
+
+def _check_compression(compression):
+    if compression != 'zlib':
+        raise ValueError(f"Unsupported battle archive compression: {compression}")
+
+
+def encode_log(log):
+    """zlib-compressed JSON lines, one log entry per line."""
+    lines = '\n'.join(json.dumps(entry, separators=(',', ':'), ensure_ascii=False) for entry in log)
+    return zlib.compress(lines.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def iter_log_entries(blob, compression='zlib', start=0):
+    """Yields the entries of an encoded log from index `start` on. Decompresses in
+    chunks, so memory stays flat however long the log is.
+    """
+    _check_compression(compression)
+    decompressor = zlib.decompressobj()
+    data = memoryview(bytes(blob))
+    index = 0
+    pending = b''
+    for offset in range(0, len(data), DECOMPRESS_CHUNK_SIZE):
+        pending += decompressor.decompress(data[offset:offset + DECOMPRESS_CHUNK_SIZE])
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            if index >= start:
+                yield json.loads(line)
+            index += 1
+    pending += decompressor.flush()
+    if pending and index >= start:
+        yield json.loads(pending)
+
+
+def decode_log(blob, compression='zlib'):
+    return list(iter_log_entries(blob, compression))
+
+
+def encode_state(state):
+    return zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decode_state(blob, compression='zlib'):
+    _check_compression(compression)
+    return json.loads(zlib.decompress(bytes(blob)))
+
+
+def turn_start_indices(log):
+    """Index of the first entry of every turn: turn 1 starts at 0, and each
+    'turnchange' entry ("Turn N: ...") starts the next one.
+    """
+    starts = [0]
+    for index, entry in enumerate(log):
+        if isinstance(entry, dict) and entry.get('effect_type') == 'turnchange':
+            starts.append(index)
+    return starts
+
+
+# --- Reading ---
+
+def battle_logs(battles):
+    """{battle_id: log} for the given battles, fetching all archived logs in one query."""
+    logs = {}
+    archived_ids = []
+    for battle in battles:
+        if battle.is_archived:
+            archived_ids.append(battle.pk)
+        else:
+            logs[battle.pk] = battle.last_turn_summary if isinstance(battle.last_turn_summary, list) else None
+    if archived_ids:
+        for archive in BattleArchive.objects.filter(battle_id__in=archived_ids).only('battle_id', 'compression', 'log_blob'):
+            logs[archive.battle_id] = archive.read_log()
+    return logs
+
+
+# --- Archiving ---
+
+def archive_battle(battle_id):
+    """Moves one finished battle to the archive. Returns False if it was no longer eligible."""
+    with transaction.atomic():
+        battle = (
+            Battle.objects.select_for_update()
+            .filter(pk=battle_id, status='finished', is_archived=False)
+            .only('id', 'last_turn_summary', *ARCHIVED_STATE_FIELDS)
+            .first()
+        )
+        if battle is None:
+            return False
+        log = battle.last_turn_summary if isinstance(battle.last_turn_summary, list) else []
+        BattleArchive.objects.create(
+            battle_id=battle.pk,
+            log_blob=encode_log(log),
+            state_blob=encode_state({field: getattr(battle, field) for field in ARCHIVED_STATE_FIELDS}),
+            log_length=len(log),
+            turn_offsets=turn_start_indices(log),
+            error_count=sum(1 for entry in log if isinstance(entry, dict) and entry.get('effect_type') == 'error'),
+        )
+        Battle.objects.filter(pk=battle.pk).update(is_archived=True, **EMPTIED_STATE)
+    return True
+
+
+def archivable_battles(now=None):
+    cutoff = (now or timezone.now()) - timedelta(days=settings.BATTLE_ARCHIVE_AFTER_DAYS)
+    return (
+        Battle.objects.filter(status='finished', is_archived=False, updated_at__lt=cutoff)
+        # Stats are parsed from the log; wait until the outbox has applied them
+        .filter(Q(stats_outbox__isnull=True) | Q(stats_outbox__processed_at__isnull=False))
+    )
+
+
+def archive_finished_battles(batch_size, now=None):
+    """Archives one batch (oldest first, over the (status, updated_at) index). Returns how many were archived."""
+    ids = list(archivable_battles(now).order_by('updated_at').values_list('id', flat=True)[:batch_size])
+    return sum(1 for battle_id in ids if archive_battle(battle_id))
@@ -0,0 +1,183 @@
+"""
+Server-side auto battles: both players are driven by the AI, entirely in memory.
+
+- load_matchup() reads both loadouts (attacks with their scripts) up front. After that,
+  play_auto_battle() needs no database: it runs apply_attack(persist=False) on an unsaved
+  Battle until someone faints or AUTO_BATTLE_MAX_ACTIONS is reached (a draw), so matches
+  can be played in worker processes.
+- persist_auto_battle() writes a finished battle (final state, log, loadouts, attacks
+  used) in one transaction.
+- AutoBattleView (POST battles/auto/) plays a few matches inside the request;
+  `manage.py run_auto_battles` plays many across a process pool.
+- simulate_matchup() is the unsaved "simulate this matchup" run, played with a seeded
+  RNG. Its summary (including the log) is kept in the simulation cache
+  (game.logic.simulation_cache) under a fingerprint of both loadouts, their script
+  versions, both players' stats and the seed, so a cached result is frozen per seed:
+  the same seed replays the same matches, a new seed plays new ones, and editing a
+  script or a stat changes the key. Runs without a seed draw a fresh one and are not
+  cached. The seed covers the Python-side rolls (damage variance, momentum costs, the
+  AI's picks); the global RNG is reseeded for the run and restored afterwards.
+
+Auto battles are flagged AI-controlled on both sides: they are not rated and skip the
+post-battle stats pipeline (no credits, wins or attack stats for a match nobody played).
+"""
+
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from .battle_logic import apply_attack, unsaved_attacks_used
+from .battle_stats import PLAYER_ROLES
+from .logic import get_simulation_cache, loadout_script_versions, simulation_fingerprint
+from .models import Battle
+
+
+class AutoBattleMatchup:
+    """Two players and the loadouts the AI picks from. Picklable (sent to pool workers)."""
+
+    def __init__(self, player1, player2, loadout1, loadout2):
+        self.players = {'player1': player1, 'player2': player2}
+        self.loadouts = {'player1': loadout1, 'player2': loadout2}
+        self.attacks_by_id = {attack.pk: attack for attack in [*loadout1, *loadout2]}
+
+    def new_battle(self):
+        """An unsaved active battle in its starting state (what initialize_battle_state sets)."""
+        player1, player2 = self.players['player1'], self.players['player2']
+        return Battle(
+            player1=player1, player2=player2, status='active',
+            player1_is_ai_controlled=True, player2_is_ai_controlled=True,
+            current_hp_player1=player1.hp, current_hp_player2=player2.hp,
+            current_momentum_player1=settings.BASE_MOMENTUM, current_momentum_player2=settings.BASE_MOMENTUM,
+            stat_stages_player1={}, stat_stages_player2={},
+            custom_statuses_player1={}, custom_statuses_player2={},
+            registered_scripts=[], last_turn_summary=[],
+            turn_number=1, whose_turn='player1',
+        )
+
+
+def load_matchup(player1, player2):
+    """Loads both current loadouts. Raises ValueError if the matchup cannot be played."""
+    if player1.pk == player2.pk:
+        raise ValueError("A player cannot auto battle themselves.")
+    loadouts = []
+    for player in (player1, player2):
+        loadout = list(player.selected_attacks.prefetch_related('scripts').order_by('id'))
+        if not loadout:
+            raise ValueError(f"{player.username} has no attacks selected.")
+        loadouts.append(loadout)
+    return AutoBattleMatchup(player1, player2, *loadouts)
+
+
+def play_auto_battle(matchup, max_actions=None):
+    """Plays one match in memory and returns the finished, unsaved Battle."""
+    max_actions = max_actions or settings.AUTO_BATTLE_MAX_ACTIONS
+    battle = matchup.new_battle()
+    actions = 0
+    while battle.status == 'active':
+        if actions >= max_actions:
+            battle.status = 'finished' # No winner: a draw
+            battle.last_turn_summary.append({
+                "source": "system", "text": f"The battle was called a draw after {actions} actions.", "effect_type": "info",
+            })
+            break
+        role = battle.whose_turn
+        attack = random.choice(matchup.loadouts[role])
+        apply_attack(battle, matchup.players[role], attack, persist=False, attacks_by_id=matchup.attacks_by_id)
+        actions += 1
+    battle.auto_battle_actions = actions
+    return battle
+
+
+def persist_auto_battle(battle, matchup):
+    """Writes a battle returned by play_auto_battle() in one transaction and returns it."""
+    with transaction.atomic():
+        battle.save() # Creates the participant rows; unrated, both sides are AI
+        for role in PLAYER_ROLES:
+            getattr(battle, f'battle_attacks_{role}').set([attack.pk for attack in matchup.loadouts[role]])
+            used = unsaved_attacks_used(battle)[role]
+            if used:
+                getattr(battle, f'{role}_attacks_used').add(*used)
+    battle.__dict__.pop('_unsaved_attacks_used', None)
+    return battle
+
+
+def auto_battle_result(battle):
+    """Short summary of a played match (used by the view and the command)."""
+    winner_role = None
+    if battle.winner_id:
+        winner_role = 'player1' if battle.winner_id == battle.player1_id else 'player2'
+    return {
+        'battle_id': battle.pk,
+        'winner': winner_role,
+        'turns': battle.turn_number,
+        'actions': getattr(battle, 'auto_battle_actions', None),
+        'hp_player1': battle.current_hp_player1,
+        'hp_player2': battle.current_hp_player2,
+    }
+
+
+def summarize_auto_battles(battles):
+    """{'runs', 'wins', 'results'} for played matches, plus the 'log' when there was just one."""
+    results = [auto_battle_result(battle) for battle in battles]
+    wins = {'player1': 0, 'player2': 0, 'draws': 0}
+    for result in results:
+        wins[result['winner'] or 'draws'] += 1
+    summary = {'runs': len(results), 'wins': wins, 'results': results}
+    if len(battles) == 1:
+        summary['log'] = battles[0].last_turn_summary
+    return summary
+
+
+def _base_stats(player):
+    return {'hp': player.hp, 'attack': player.attack, 'defense': player.defense, 'speed': player.speed}
+
+
+def matchup_fingerprint(matchup, runs, max_actions, seed):
+    """Simulation cache key: both loadouts with their script versions (one query), both
+    players' base stats, the number of runs, the draw limit and the RNG seed."""
+    script_versions = loadout_script_versions(matchup.attacks_by_id.keys())
+    opponent_attacks = sorted(matchup.loadouts['player2'], key=lambda a: a.id)
+    return simulation_fingerprint(
+        matchup.loadouts['player1'], _base_stats(matchup.players['player1']),
+        script_versions=script_versions,
+        namespace='auto_battle',
+        extra={
+            'opponent_attacks': [[a.id, a.momentum_cost, script_versions.get(a.id, [])] for a in opponent_attacks],
+            'opponent_stats': _base_stats(matchup.players['player2']),
+            'base_momentum': settings.BASE_MOMENTUM,
+            'runs': runs,
+            'max_actions': max_actions,
+            'seed': seed,
+        },
+    )
+
+
+@contextmanager
+def seeded_random(seed):
+    """Seeds the global RNG (used by the battle logic) for the block, then restores its state."""
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        yield
+    finally:
+        random.setstate(state)
+
+
+def simulate_matchup(matchup, runs, seed=None, max_actions=None):
+    """Plays `runs` unsaved matches with the given seed and returns their summary with the
+    seed. A seeded result comes from the simulation cache when this exact matchup was
+    simulated with that seed before; without a seed a new one is drawn and nothing is cached."""
+    max_actions = max_actions or settings.AUTO_BATTLE_MAX_ACTIONS
+
+    def play():
+        with seeded_random(run_seed):
+            summary = summarize_auto_battles([play_auto_battle(matchup, max_actions) for _ in range(runs)])
+        return {**summary, 'seed': run_seed}
+
+    if seed is None:
+        run_seed = random.randrange(2 ** 32)
+        return play()
+    run_seed = seed
+    return get_simulation_cache().get_or_compute(matchup_fingerprint(matchup, runs, max_actions, seed), play)
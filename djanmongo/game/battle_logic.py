@@ -1,188 +1,109 @@
 import random
 import math
 import uuid
-from .models import Battle, Attack, Script, AttackUsageStats
-from users.models import User # Although we get users via battle object
+from .models import Battle, Attack, Script
+from .battle_stats import PLAYER_ROLES, BattleStatsBatch, enqueue_battle_stats, stats_apply_lock
+from users.models import User, UserBattleSummary # Although we get users via battle object
+from users.pagination import bump_leaderboard_cache_version
 from django.db import transaction # Import transaction for atomic updates
 from django.core.exceptions import ObjectDoesNotExist # For attack lookup
+from django.conf import settings
 
 # --- NEW: Function to Update Stats from Log ---
 @transaction.atomic # Ensure atomicity for stat updates
 def update_attack_stats_from_battle_log(battle: Battle):
     """
-    Parses the battle log (last_turn_summary) of a finished battle
-    and updates the AttackUsageStats accordingly.
-    Also calculates damage dealt per player for updating UserProfile stats.
+    Records the statistics of a finished battle (AttackUsageStats, AttackCoUsage and
+    both players' counters). Parsing and the set-based writes live in game.battle_stats.
+
+    With BATTLE_STATS_ASYNC the battle is only queued in BattleStatsOutbox and applied
+    later, in a batch, by `manage.py process_battle_stats`, keeping the killing blow fast.
+    Otherwise it is applied right away. Calling this twice for a battle is a no-op.
     """
     if battle.status != 'finished':
         print(f"[Stats Update] Battle {battle.id} not finished. Skipping.")
         return
 
-    print(f"[Stats Update] Processing finished Battle {battle.id}...")
-    winner = battle.winner
-    loser = battle.player1 if winner == battle.player2 else battle.player2
-    winner_role = battle.get_player_role(winner) if winner else None
-    loser_role = battle.get_player_role(loser) if loser else None
-    is_vs_bot = battle.player2_is_ai_controlled # Check if p2 was the bot
-
-    # --- Aggregated data from this battle's log ---
-    damage_dealt_by_attack = {} # {attack_id: total_damage}
-    healing_done_by_attack = {} # {attack_id: total_healing}
-    attacks_used_by_player = {'player1': set(), 'player2': set()} # {role: set(attack_id)}
-    # --- NEW: Track damage per player ---
-    damage_dealt_by_player = {'player1': 0, 'player2': 0}
-    # ---------------------------------------------
-
     if not isinstance(battle.last_turn_summary, list):
         print(f"  [Stats Update Warning] Invalid log format for Battle {battle.id}. Cannot update stats.")
         return
 
-    # --- Parse the entire battle log ---
-    for log_entry in battle.last_turn_summary:
-        if not isinstance(log_entry, dict): continue
-
-        effect_type = log_entry.get('effect_type')
-        details = log_entry.get('effect_details')
-        source_role = log_entry.get('source') # player1 or player2
-
-        if not isinstance(details, dict): continue
-
-        attack_id = details.get('source_attack_id')
-        # --- Track which attacks were used by whom (Requires source_role) ---
-        if effect_type == 'action' and source_role in ['player1', 'player2'] and attack_id:
-            attacks_used_by_player[source_role].add(attack_id)
-
-        # Aggregate damage (from logs created by apply_std_damage)
-        if effect_type == 'damage':
-            damage = details.get('damage_dealt')
-            if isinstance(damage, int) and damage > 0:
-                # Attribute damage to attack if source attack ID exists
-                if attack_id:
-                    damage_dealt_by_attack[attack_id] = damage_dealt_by_attack.get(attack_id, 0) + damage
-                # --- NEW: Attribute damage to player if source role exists ---
-                if source_role in ['player1', 'player2']:
-                    damage_dealt_by_player[source_role] += damage
-                # --- END NEW ---
-
-        # Aggregate healing (from logs created by apply_std_hp_change)
-        if effect_type == 'heal':
-            healing = details.get('hp_change')
-            if isinstance(healing, int) and healing > 0:
-                 # Attribute healing to attack if source attack ID exists
-                if attack_id:
-                    healing_done_by_attack[attack_id] = healing_done_by_attack.get(attack_id, 0) + healing
-                # Consider adding healing_done_by_player if needed later
-
-    # --- Update AttackUsageStats based on aggregated data ---
-    all_used_attack_ids = attacks_used_by_player['player1'].union(attacks_used_by_player['player2'])
-
-    # Fetch stats objects in bulk for efficiency if possible, or handle individually
-    stats_objects = {stat.attack_id: stat for stat in AttackUsageStats.objects.filter(attack_id__in=all_used_attack_ids)}
-    created_stats_count = 0
-    updated_stats_count = 0
-
-    for attack_id in all_used_attack_ids:
-        try:
-            # Get existing or create new stats object
-            stats = stats_objects.get(attack_id)
-            if not stats:
-                # Ensure attack exists before creating stats for it
-                attack_instance = Attack.objects.get(pk=attack_id)
-                stats, created = AttackUsageStats.objects.get_or_create(attack=attack_instance)
-                if created: created_stats_count += 1
-                stats_objects[attack_id] = stats # Add to cache
-            else:
-                created = False # Already existed
-
-            # Increment times used
-            stats.times_used += 1
-
-            # Add damage/healing totals
-            stats.total_damage_dealt += damage_dealt_by_attack.get(attack_id, 0)
-            stats.total_healing_done += healing_done_by_attack.get(attack_id, 0)
-
-            # Increment win/loss counts
-            is_winner_attack = winner_role and attack_id in attacks_used_by_player.get(winner_role, set())
-            is_loser_attack = loser_role and attack_id in attacks_used_by_player.get(loser_role, set())
-
-            if is_vs_bot:
-                if is_winner_attack: stats.wins_vs_bot += 1
-                if is_loser_attack: stats.losses_vs_bot += 1
-            else: # vs Human
-                if is_winner_attack: stats.wins_vs_human += 1
-                if is_loser_attack: stats.losses_vs_human += 1
-
-            # Update co-occurrence (simplified example - only counts pairs within this battle)
-            # A more robust implementation might require a separate, more complex aggregation step
-            player_role_using_attack = None
-            if attack_id in attacks_used_by_player['player1']:
-                 player_role_using_attack = 'player1'
-            elif attack_id in attacks_used_by_player['player2']:
-                 player_role_using_attack = 'player2'
-            
-            if player_role_using_attack:
-                co_used_attacks_in_battle = attacks_used_by_player[player_role_using_attack] - {attack_id} # Other attacks used by same player
-
-            if not isinstance(stats.co_used_with_counts, dict): stats.co_used_with_counts = {} # Ensure it's a dict
-
-            for other_attack_id in co_used_attacks_in_battle:
-                other_attack_id_str = str(other_attack_id) # JSON keys must be strings
-                stats.co_used_with_counts[other_attack_id_str] = stats.co_used_with_counts.get(other_attack_id_str, 0) + 1
-
-            stats.save()
-            updated_stats_count +=1
-
-        except Attack.DoesNotExist:
-             print(f"  [Stats Update Warning] Attack ID {attack_id} not found. Cannot update its stats.")
-        except Exception as e:
-             print(f"  [Stats Update Error] Failed processing Attack ID {attack_id}: {e}")
-             # Optionally re-raise or log more details traceback.print_exc()
-
-    print(f"  [Stats Update] Attack stats processed for Battle {battle.id}. Updated {updated_stats_count} stats records ({created_stats_count} created).")
-
-    # --- NEW: Update Player Stats (Integration Point) ---
-    # You need a function, likely on your User or UserProfile model,
-    # that takes the battle result and updates the user's stats.
-    # Example (assuming UserProfile has a method `update_stats_on_battle_end`):
-    
-    p1_damage = damage_dealt_by_player['player1']
-    p2_damage = damage_dealt_by_player['player2']
+    if settings.BATTLE_STATS_ASYNC:
+        if enqueue_battle_stats(battle):
+            print(f"[Stats Update] Battle {battle.id} queued for stats processing.")
+        return
 
-    try:
-        if battle.player1:
-            # Example call - assuming User model has update_stats_on_battle_end
-            battle.player1.update_stats_on_battle_end(
-                is_winner=(winner == battle.player1),
-                is_vs_bot=is_vs_bot,
-                damage_dealt=p1_damage
-            )
-            print(f"  [Stats Update] Updated Player 1 ({battle.player1.username}) stats. Dmg dealt: {p1_damage}")
-        else:
-            print(f"  [Stats Update Warning] Could not update stats for Player 1 ({battle.player1.username if battle.player1 else 'N/A'})")
-
-        if battle.player2:
-            # Example call - assuming User model has update_stats_on_battle_end
-            battle.player2.update_stats_on_battle_end(
-                is_winner=(winner == battle.player2),
-                is_vs_bot=is_vs_bot, # This assumes p2 is the only possible bot
-                damage_dealt=p2_damage
-            )
-            print(f"  [Stats Update] Updated Player 2 ({battle.player2.username}) stats. Dmg dealt: {p2_damage}")
-        else:
-            print(f"  [Stats Update Warning] Could not update stats for Player 2 ({battle.player2.username if battle.player2 else 'N/A'})")
-    except Exception as user_stat_error:
-        print(f"  [Stats Update Error] Failed updating user profile stats: {user_stat_error}")
-        import traceback # Optional: Log full traceback for debugging
-        traceback.print_exc() # Optional: Log full traceback for debugging
-        # Consider how to handle this - log, maybe retry?
-        # Ensure atomicity is handled correctly if this happens within the outer transaction.
-
-    print(f"  [Stats Update] Completed Processing for Battle {battle.id}.")
+    # Synchronous mode: record the battle as already processed and apply it in the same transaction
+    stats_apply_lock()
+    if not enqueue_battle_stats(battle, processed=True):
+        print(f"[Stats Update] Battle {battle.id} already recorded. Skipping.")
+        return
+
+    print(f"[Stats Update] Processing finished Battle {battle.id}...")
+    batch = BattleStatsBatch()
+    batch.add_battles([battle])
+    batch.apply()
+
+    # Keep the in-memory players consistent with their rows (the response shows credits)
+    for role in PLAYER_ROLES:
+        player = getattr(battle, role)
+        if player:
+            player.refresh_from_db(fields=['wins_vs_human', 'losses_vs_human', 'wins_vs_bot', 'losses_vs_bot', 'total_damage_dealt', 'booster_credits'])
+            print(f"  [Stats Update] Updated {role} ({player.username}) stats. Booster credits: {player.booster_credits}")
+
+    # Cached leaderboard pages are stale now; drop them once the updates are committed
+    transaction.on_commit(bump_leaderboard_cache_version)
+
+    print(f"  [Stats Update] Completed Processing for Battle {battle.id} ({len(batch.attack_increments)} attacks).")
     # --- END NEW ---
 
+# --- Forfeits (concede / idle sweeper) ---
+FORFEIT_WINNER_CREDITS = 2
+FORFEIT_LOSER_CREDITS = 1 # The forfeiting player still gets 1 credit
+
+def forfeit_battle(battle: Battle, loser: User, reason: str = None):
+    """
+    Finishes an active battle with `loser` forfeiting (winner: the opponent) and awards
+    the forfeit credits. `loser=None` ends it without a winner (no credits).
+    The caller runs this inside a transaction with the battle row locked and re-checked
+    as active. `reason` is appended to the battle log as a system entry.
+    Forfeits skip the attack stats pipeline (their outbox row is recorded as processed
+    without stats, so a recalculation skips them too) but count in the profile summary:
+    a win and a loss, or a loss for both players when there is no winner.
+    Returns the winner (or None).
+    """
+    winner = None
+    if loser is not None:
+        winner = battle.player2 if loser.pk == battle.player1_id else battle.player1
+
+    battle.status = 'finished'
+    battle.winner = winner
+    if reason:
+        battle.last_turn_summary = list(battle.last_turn_summary or []) + [
+            {"source": "system", "text": reason, "effect_type": "info"}
+        ]
+    battle.save()
+    enqueue_battle_stats(battle, processed=True, stats_applied=False)
+
+    if winner is not None:
+        winner.booster_credits += FORFEIT_WINNER_CREDITS
+        loser.booster_credits += FORFEIT_LOSER_CREDITS
+        winner.save(update_fields=['booster_credits'])
+        loser.save(update_fields=['booster_credits'])
+        print(f"[Battle {battle.id}] Awarded {FORFEIT_WINNER_CREDITS} credits to winner {winner.username}, {FORFEIT_LOSER_CREDITS} credit to {loser.username} (forfeit).")
+    # Recorded for both players even without a winner (a loss for each), as rebuild_all counts it
+    UserBattleSummary.record_battles([battle])
+    return winner
+# --- END Forfeits ---
+
 # --- Main Action Logic --- 
 
-def apply_attack(battle: Battle, attacker: User, attack: Attack):
+def unsaved_attacks_used(battle: Battle):
+    """{role: {attack_id}} recorded by apply_attack(persist=False) and not written yet."""
+    return battle.__dict__.setdefault('_unsaved_attacks_used', {'player1': set(), 'player2': set()})
+
+
+def apply_attack(battle: Battle, attacker: User, attack: Attack, persist: bool = True, attacks_by_id: dict = None):
     """
     Applies a single attack from the attacker in the battle.
     Modifies the battle object directly.
@@ -190,6 +111,11 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
     Handles turn switching based on momentum SPENDING.
     Integrates Lua scripting for custom effects using the new trigger system.
     Updates AttackUsageStats when the battle ends.
+
+    With persist=False nothing is written: the battle only changes in memory and the
+    attacks used are kept on it until save_battle_state() (or the auto-battle runner)
+    writes everything at once. `attacks_by_id` ({id: Attack with scripts prefetched})
+    resolves registered scripts without a query per script.
     """
     # --- Imports from refactored modules ---
     from .logic import (
@@ -280,9 +206,13 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
             reg_id = script_instance.get('registration_id')
             trigger_duration = script_instance.get('trigger_duration')
 
-            script_obj = Script.objects.filter(pk=script_id).first()
             source_attack_id = script_instance.get('source_attack_id')
-            source_attack_obj = Attack.objects.filter(pk=source_attack_id).first() if source_attack_id else None
+            if attacks_by_id is not None and source_attack_id in attacks_by_id:
+                source_attack_obj = attacks_by_id[source_attack_id]
+                script_obj = next((s for s in source_attack_obj.scripts.all() if s.pk == script_id), None)
+            else:
+                script_obj = Script.objects.filter(pk=script_id).first()
+                source_attack_obj = Attack.objects.filter(pk=source_attack_id).first() if source_attack_id else None
 
             if script_obj and script_obj.lua_code:
                 print(f"  Running Script ID {script_id} (RegID: {reg_id[:8]}) - Who: {script_instance['trigger_who']}, When: {script_instance['trigger_when']}, Dur: {trigger_duration}")
@@ -348,8 +278,9 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
         # Finalize and return immediately if battle ended here
         if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
         battle.last_turn_summary.extend(log_entries)
-        battle.save()
-        if battle.status == 'finished': update_attack_stats_from_battle_log(battle)
+        if persist:
+            battle.save()
+            if battle.status == 'finished': update_attack_stats_from_battle_log(battle)
         return log_entries, battle_ended
 
     # ==================================
@@ -359,8 +290,9 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
     if battle_ended: # Check end after phase
         if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
         battle.last_turn_summary.extend(log_entries)
-        battle.save()
-        if battle.status == 'finished': update_attack_stats_from_battle_log(battle)
+        if persist:
+            battle.save()
+            if battle.status == 'finished': update_attack_stats_from_battle_log(battle)
         return log_entries, battle_ended
 
     # ==================================
@@ -420,13 +352,16 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
     print(f"  Current Registered Scripts: {current_registered_scripts}")
     # --- ADDED Debug Save --- 
     battle.registered_scripts = current_registered_scripts # Assign current list to model field
-    battle.save(update_fields=['registered_scripts']) # Save ONLY this field
-    print(f"    [DEBUG SAVE] Saved registered_scripts: {battle.registered_scripts}")
+    if persist:
+        battle.save(update_fields=['registered_scripts']) # Save ONLY this field
+        print(f"    [DEBUG SAVE] Saved registered_scripts: {battle.registered_scripts}")
     # --- End Debug Save ---
 
     # --- Add Attack to Used List (AFTER ON_USE effects) --- 
     if not battle_ended:
-        if attacker_role == 'player1':
+        if not persist:
+            unsaved_attacks_used(battle)[attacker_role].add(attack.pk)
+        elif attacker_role == 'player1':
             battle.player1_attacks_used.add(attack)
         else:
             battle.player2_attacks_used.add(attack)
@@ -437,6 +372,8 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
         if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
         battle.last_turn_summary.extend(log_entries)
         battle.registered_scripts = current_registered_scripts # Save potentially updated list
+        if not persist:
+            return log_entries, battle_ended
         battle.save()
         if battle.status == 'finished': 
             # Move stat update call here, AFTER final save
@@ -461,6 +398,8 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
         if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
         battle.last_turn_summary.extend(log_entries)
         battle.registered_scripts = current_registered_scripts # Save potentially updated list
+        if not persist:
+            return log_entries, battle_ended
         battle.save()
         if battle.status == 'finished': 
             # Move stat update call here, AFTER final save
@@ -542,6 +481,9 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
     print(f"--- DEBUG: Finalizing Turn {battle.turn_number}. Assigning registered scripts before save: {current_registered_scripts} ---")
     battle.registered_scripts = current_registered_scripts
 
+    if not persist:
+        return log_entries, battle_ended
+
     # --- Save Battle State FIRST ---
     try:
         battle.save()
@@ -560,4 +502,78 @@ def apply_attack(battle: Battle, attacker: User, attack: Attack):
     #         import traceback
     #         traceback.print_exc()
 
-    return log_entries, battle_ended 
\ No newline at end of file
+    return log_entries, battle_ended 
+# --- AI turns & deferred saves ---
+
+def run_ai_turns(battle: Battle, persist: bool = True, attacks_by_id: dict = None):
+    """
+    Plays the AI-controlled player's moves for as long as it is their turn (it keeps
+    the turn while it has momentum). Returns whether the battle ended.
+    `persist` and `attacks_by_id` are passed on to apply_attack.
+    """
+    battle_ended = battle.status != 'active'
+    while not battle_ended and battle.status == 'active':
+        current_turn_role = battle.whose_turn
+        # --- Determine if current turn is AI controlled ---
+        is_ai_turn = (
+            (battle.player2_is_ai_controlled and current_turn_role == 'player2')
+            or (battle.player1_is_ai_controlled and current_turn_role == 'player1')
+        )
+        if not is_ai_turn:
+            break # Exit loop if it's a human's turn
+
+        # --- It's an AI Controlled Turn ---
+        current_player = getattr(battle, current_turn_role)
+        bot_attack_list = getattr(battle, f'battle_attacks_{current_turn_role}').all()
+        print(f"[Battle {battle.id}] AI controlling {current_player.username} (Role: {current_turn_role})...")
+
+        if not bot_attack_list:
+            print(f"Warning: AI-controlled player {current_player.username} (Role: {current_turn_role}) in Battle {battle.id} has no attacks. Skipping turn.")
+            battle.whose_turn = 'player1' if current_turn_role == 'player2' else 'player2'
+            battle.turn_number += 1
+            if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
+            battle.last_turn_summary.append({
+                "source": "system",
+                "text": f"{current_player.username} (AI) has no moves and skips the turn.",
+                "effect_type": "info"
+            })
+            if persist: battle.save()
+            break # Exit the loop after skipping
+
+        bot_chosen_attack = random.choice(list(bot_attack_list))
+        print(f"  AI chose attack: {bot_chosen_attack.name} (ID: {bot_chosen_attack.id})")
+        try:
+            _, battle_ended = apply_attack(battle, current_player, bot_chosen_attack, persist=persist, attacks_by_id=attacks_by_id)
+        except ValueError as e:
+            print(f"Error during AI ({current_player.username}) turn in Battle {battle.id}: {e}")
+            if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
+            battle.last_turn_summary.append({
+                "source": "system",
+                "text": f"Error processing AI ({current_player.username}) turn: {e}",
+                "effect_type": "error"
+            })
+            battle.whose_turn = 'player1' if current_turn_role == 'player2' else 'player2'
+            battle.turn_number += 1
+            if persist: battle.save()
+            break # Exit the loop on error
+    return battle_ended
+
+
+def save_battle_state(battle: Battle):
+    """
+    Writes a battle advanced with apply_attack(persist=False): the row, the attacks used
+    and, if it finished, its stats. Call it inside the transaction that locked the battle.
+    """
+    battle.save()
+    for role, attack_ids in unsaved_attacks_used(battle).items():
+        if attack_ids:
+            getattr(battle, f'{role}_attacks_used').add(*attack_ids)
+    battle.__dict__.pop('_unsaved_attacks_used', None)
+    if battle.status == 'finished':
+        try:
+            update_attack_stats_from_battle_log(battle)
+        except Exception as stat_calc_error:
+            print(f"!!! ERROR during post-battle stat calculation for Battle {battle.id}: {stat_calc_error}")
+            import traceback
+            traceback.print_exc()
+# --- END AI turns & deferred saves ---
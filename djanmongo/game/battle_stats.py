@@ -0,0 +1,355 @@
+# djanmongo/game/battle_stats.py
+
+"""
+Post-battle statistics: log parsing, batched set-based increments and the outbox queue.
+
+A finished battle is recorded in BattleStatsOutbox. With BATTLE_STATS_ASYNC the row
+stays pending and `manage.py process_battle_stats` drains many of them per flush,
+folding all their increments into one UPDATE per table. Without it, the battle is
+applied immediately (see battle_logic.update_attack_stats_from_battle_log).
+Either way a battle is applied only in the transaction that marks its row processed,
+so it is never counted twice.
+
+Every transaction that applies attack stats first takes stats_apply_lock() (shared), and
+a stats recalculation takes it exclusively while it snapshots its baseline, so the
+baseline never misses increments that were applied but not yet committed.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, Count, F, Min, Q, Value, When
+from django.utils import timezone
+
+from .archive import battle_logs
+from .models import Attack, AttackCoUsage, AttackDailyStats, AttackUsageStats, Battle, BattleStatsOutbox
+
+PLAYER_ROLES = ('player1', 'player2')
+
+# Only what parsing and attribution need; the log itself is the big column
+BATTLE_STATS_FIELDS = ('id', 'status', 'player1_id', 'player2_id', 'winner_id', 'player2_is_ai_controlled', 'updated_at', 'last_turn_summary', 'is_archived')
+
+
+def _opponent_role(role):
+    return 'player2' if role == 'player1' else 'player1'
+
+
+# --- Battle log parsing (no database access) ---
+
+def battle_log_attack_refs(log_entries):
+    """Collects the attack ids and names referenced by a battle log, so the caller
+       can resolve them all with a single query before calling parse_battle_log.
+    """
+    attack_ids, attack_names = set(), set()
+    for log_entry in log_entries:
+        details = log_entry.get('effect_details') if isinstance(log_entry, dict) else None
+        if not isinstance(details, dict): continue
+        if isinstance(details.get('source_attack_id'), int):
+            attack_ids.add(details['source_attack_id'])
+        if log_entry.get('effect_type') == 'action' and isinstance(details.get('attack_name'), str):
+            attack_names.add(details['attack_name'])
+    return attack_ids, attack_names
+
+
+def parse_battle_log(log_entries, attack_ids_by_name=None, valid_attack_ids=None):
+    """Aggregates a battle log into per-attack and per-player totals.
+
+    Args:
+        log_entries: battle.last_turn_summary.
+        attack_ids_by_name: {name: attack_id}, used for 'action' entries that only carry
+            the attack_name announced by the ON_USE script.
+        valid_attack_ids: if given, ids outside this set (e.g. deleted attacks) are ignored.
+
+    Returns a dict with 'attacks_used_by_player' ({role: set(attack_id)}),
+    'damage_by_attack', 'healing_by_attack' ({attack_id: total}) and
+    'damage_by_player' ({role: total}).
+    """
+    attack_ids_by_name = attack_ids_by_name or {}
+    result = {
+        'attacks_used_by_player': {role: set() for role in PLAYER_ROLES},
+        'damage_by_attack': Counter(),
+        'healing_by_attack': Counter(),
+        'damage_by_player': {role: 0 for role in PLAYER_ROLES},
+    }
+
+    for log_entry in log_entries:
+        if not isinstance(log_entry, dict): continue
+        details = log_entry.get('effect_details')
+        if not isinstance(details, dict): continue
+
+        effect_type = log_entry.get('effect_type')
+        source_role = log_entry.get('source') # player1/player2 for actions, usually 'script' otherwise
+        attack_id = details.get('source_attack_id')
+        if effect_type == 'action' and not attack_id:
+            attack_id = attack_ids_by_name.get(details.get('attack_name'))
+        if valid_attack_ids is not None and attack_id not in valid_attack_ids:
+            attack_id = None
+
+        if effect_type == 'action' and source_role in PLAYER_ROLES and attack_id:
+            result['attacks_used_by_player'][source_role].add(attack_id)
+
+        elif effect_type == 'damage':
+            damage = details.get('damage_dealt')
+            if isinstance(damage, int) and damage > 0:
+                if attack_id:
+                    result['damage_by_attack'][attack_id] += damage
+                # Script-applied damage is logged with source 'script': credit whoever was not hit
+                dealer_role = source_role if source_role in PLAYER_ROLES else None
+                if not dealer_role and details.get('target_role') in PLAYER_ROLES:
+                    dealer_role = _opponent_role(details['target_role'])
+                if dealer_role:
+                    result['damage_by_player'][dealer_role] += damage
+
+        elif effect_type == 'heal':
+            healing = details.get('hp_change')
+            if isinstance(healing, int) and healing > 0 and attack_id:
+                result['healing_by_attack'][attack_id] += healing
+
+    return result
+
+
+# --- Set-based writes ---
+
+def _key_conditions(key_field, key):
+    """Lookup kwargs for one key: key_field is a field name, or a tuple of names for compound keys."""
+    if isinstance(key_field, str):
+        return {key_field: key}
+    return dict(zip(key_field, key))
+
+
+def _case_increments(key_field, increments_by_key):
+    """{field: F(field) + CASE key WHEN ... THEN n ... END} covering every field in increments_by_key."""
+    fields = sorted({field for increments in increments_by_key.values() for field in increments})
+    updates = {}
+    for field in fields:
+        whens = [When(**_key_conditions(key_field, key), then=Value(increments[field]))
+                 for key, increments in increments_by_key.items() if increments.get(field)]
+        if whens:
+            updates[field] = F(field) + Case(*whens, default=Value(0), output_field=BigIntegerField())
+    return updates
+
+
+def upsert_increments(model, key_fields, increments_by_key):
+    """Adds {(key values): {field: n}} to the rows of model identified by key_fields (a unique
+       constraint): one INSERT for missing rows, then one F() + CASE UPDATE for all of them.
+    """
+    if not increments_by_key:
+        return
+    model.objects.bulk_create(
+        [model(**_key_conditions(key_fields, key)) for key in increments_by_key],
+        ignore_conflicts=True,
+    )
+    key_filter = Q()
+    for key in increments_by_key:
+        key_filter |= Q(**_key_conditions(key_fields, key))
+    updates = _case_increments(key_fields, increments_by_key)
+    if updates:
+        model.objects.filter(key_filter).update(**updates)
+
+
+def increment_attack_co_usage(pair_counts):
+    """Adds {(attack_a_id, attack_b_id): n} to AttackCoUsage.
+       Missing rows are inserted with count=0 in one statement, then every count is bumped
+       by a single F() + CASE UPDATE, so concurrent battles never lose updates.
+       Callers pass both directions of each pair.
+    """
+    if not pair_counts:
+        return
+    AttackCoUsage.objects.bulk_create(
+        [AttackCoUsage(attack_a_id=a, attack_b_id=b, count=0) for a, b in pair_counts],
+        ignore_conflicts=True,
+    )
+    pair_filter = Q()
+    whens = []
+    for (a, b), n in pair_counts.items():
+        pair_filter |= Q(attack_a_id=a, attack_b_id=b)
+        whens.append(When(attack_a_id=a, attack_b_id=b, then=Value(n)))
+    AttackCoUsage.objects.filter(pair_filter).update(
+        count=F('count') + Case(*whens, default=Value(0), output_field=BigIntegerField())
+    )
+
+
+class BattleStatsBatch:
+    """Folds any number of finished battles into one set of increments per attack and user.
+
+    apply() then issues: one INSERT for missing AttackUsageStats rows, one UPDATE for all
+    attack rows, the co-usage upsert, one UPDATE for all users, the UserBattleSummary
+    upserts and the daily rollups. Call it inside a transaction.
+    """
+
+    def __init__(self):
+        self.attack_increments = defaultdict(Counter) # {attack_id: Counter(field -> n)}
+        self.user_increments = defaultdict(Counter)   # {user_id: Counter(field -> n)}
+        self.co_usage_pairs = Counter()               # {(attack_a_id, attack_b_id): n}
+        self.summary_increments = defaultdict(Counter) # UserBattleSummary: {user_id: Counter(field -> n)}
+        self.opponent_losses = Counter()              # {(user_id, opponent_id): n}
+        self.attack_daily = defaultdict(Counter)      # AttackDailyStats: {(attack_id, date): Counter(field -> n)}
+        self.user_daily = defaultdict(Counter)        # UserDailyStats: {(user_id, date): Counter(field -> n)}
+        self.battle_count = 0
+
+    def add_battles(self, battles):
+        """Parses and folds in the given finished battles (resolving their attacks in one query)."""
+        battles = [b for b in battles if b.status == 'finished']
+        logs = battle_logs(battles) # Archived battles keep their log in BattleArchive
+        battles = [b for b in battles if isinstance(logs.get(b.pk), list)]
+        referenced_ids, referenced_names = set(), set()
+        for battle in battles:
+            ids, names = battle_log_attack_refs(logs[battle.pk])
+            referenced_ids |= ids
+            referenced_names |= names
+
+        attack_ids_by_name = {}
+        valid_attack_ids = set()
+        if referenced_ids or referenced_names:
+            for attack_id, name in Attack.objects.filter(Q(id__in=referenced_ids) | Q(name__in=referenced_names)).values_list('id', 'name'):
+                valid_attack_ids.add(attack_id)
+                if name in referenced_names:
+                    attack_ids_by_name[name] = attack_id
+
+        for battle in battles:
+            self.add_parsed_battle(battle, parse_battle_log(logs[battle.pk], attack_ids_by_name, valid_attack_ids))
+
+    def add_parsed_battle(self, battle, parsed):
+        from users.models import User, UserBattleSummary, UserDailyStats # Local import: users.models imports game.models
+
+        day = timezone.localdate(battle.updated_at) if battle.updated_at else timezone.localdate()
+        winner_role = None
+        if battle.winner_id:
+            winner_role = 'player1' if battle.winner_id == battle.player1_id else 'player2'
+        loser_role = _opponent_role(winner_role) if winner_role else None
+        is_vs_bot = battle.player2_is_ai_controlled # This assumes p2 is the only possible bot
+        win_field = 'wins_vs_bot' if is_vs_bot else 'wins_vs_human'
+        loss_field = 'losses_vs_bot' if is_vs_bot else 'losses_vs_human'
+
+        attacks_used_by_player = parsed['attacks_used_by_player']
+        winner_attacks = attacks_used_by_player.get(winner_role, set())
+        loser_attacks = attacks_used_by_player.get(loser_role, set())
+        for attack_id in attacks_used_by_player['player1'] | attacks_used_by_player['player2']:
+            increments = self.attack_increments[attack_id]
+            increments['times_used'] += 1 # Once per battle, even if both players used it
+            if attack_id in winner_attacks: increments[win_field] += 1
+            if attack_id in loser_attacks: increments[loss_field] += 1
+            increments['total_damage_dealt'] += parsed['damage_by_attack'].get(attack_id, 0)
+            increments['total_healing_done'] += parsed['healing_by_attack'].get(attack_id, 0)
+
+            daily = self.attack_daily[(attack_id, day)]
+            daily['uses'] += 1
+            if attack_id in winner_attacks: daily['wins'] += 1
+            if attack_id in loser_attacks: daily['losses'] += 1
+            daily['damage_dealt'] += parsed['damage_by_attack'].get(attack_id, 0)
+            daily['healing_done'] += parsed['healing_by_attack'].get(attack_id, 0)
+
+        # Co-usage: every ordered pair of distinct attacks used by the same player in this battle
+        for role_attack_ids in attacks_used_by_player.values():
+            self.co_usage_pairs.update((a, b) for a in role_attack_ids for b in role_attack_ids if a != b)
+
+        for role in PLAYER_ROLES:
+            user_id = getattr(battle, f'{role}_id')
+            if user_id:
+                self.user_increments[user_id].update(User.battle_end_increments(
+                    is_winner=(winner_role == role),
+                    is_vs_bot=is_vs_bot,
+                    damage_dealt=parsed['damage_by_player'][role],
+                ))
+
+        summary_increments, opponent_losses = UserBattleSummary.battle_increments(battle)
+        for user_id, increments in summary_increments.items():
+            self.summary_increments[user_id].update(increments)
+        self.opponent_losses.update(opponent_losses)
+        for key, increments in UserDailyStats.battle_increments(battle).items():
+            self.user_daily[key].update(increments)
+
+        self.battle_count += 1
+
+    def apply(self):
+        from users.models import User, UserBattleSummary, UserDailyStats # Local import: users.models imports game.models
+
+        if self.attack_increments:
+            # Missing stats rows are created in one statement; existing ones are left alone
+            AttackUsageStats.objects.bulk_create(
+                [AttackUsageStats(attack_id=attack_id) for attack_id in self.attack_increments],
+                ignore_conflicts=True,
+            )
+            AttackUsageStats.objects.filter(attack_id__in=self.attack_increments.keys()).update(
+                **_case_increments('attack_id', self.attack_increments)
+            )
+        increment_attack_co_usage(self.co_usage_pairs)
+        if self.user_increments:
+            User.objects.filter(pk__in=self.user_increments.keys()).update(
+                **_case_increments('pk', self.user_increments)
+            )
+        UserBattleSummary.apply_increments(self.summary_increments, self.opponent_losses)
+        upsert_increments(AttackDailyStats, ('attack_id', 'date'), self.attack_daily)
+        upsert_increments(UserDailyStats, ('user_id', 'date'), self.user_daily)
+
+
+# --- Outbox queue ---
+
+STATS_APPLY_LOCK_KEY = 7305001 # Arbitrary, unique to attack stats
+
+
+def stats_apply_lock(exclusive=False):
+    """Transaction-level advisory lock around applying attack stats. Appliers take it shared
+       (they run concurrently), the recalculation baseline takes it exclusively.
+       Call it inside the transaction, before the first write. Only PostgreSQL has advisory
+       locks; elsewhere (SQLite in development) this is a no-op.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    function = 'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {function}(%s)", [STATS_APPLY_LOCK_KEY])
+
+
+def enqueue_battle_stats(battle, processed=False, stats_applied=True):
+    """Records a finished battle in the outbox. Returns False if it was already recorded
+       (queued or processed), in which case its stats must not be applied again.
+       stats_applied=False (with processed=True) records a battle that gets no attack stats.
+    """
+    _, created = BattleStatsOutbox.objects.get_or_create(
+        battle_id=battle.id,
+        defaults={'processed_at': timezone.now() if processed else None, 'stats_applied': stats_applied},
+    )
+    return created
+
+
+def flush_battle_stats_outbox(batch_size=500):
+    """Applies up to batch_size pending battles in one transaction. Returns how many were applied.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can drain
+    the queue concurrently without ever picking the same battle.
+    """
+    from users.pagination import bump_leaderboard_cache_version
+
+    with transaction.atomic():
+        stats_apply_lock()
+        entries = list(
+            BattleStatsOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('created_at')
+            .only('id', 'battle_id')[:batch_size]
+        )
+        if not entries:
+            return 0
+
+        batch = BattleStatsBatch()
+        batch.add_battles(Battle.objects.filter(pk__in=[e.battle_id for e in entries]).only(*BATTLE_STATS_FIELDS))
+        batch.apply()
+        BattleStatsOutbox.objects.filter(pk__in=[e.pk for e in entries]).update(processed_at=timezone.now())
+        # Cached leaderboard pages are stale now; drop them once the updates are committed
+        transaction.on_commit(bump_leaderboard_cache_version)
+
+    print(f"[Battle Stats] Applied {batch.battle_count} battles ({len(entries)} outbox rows, "
+          f"{len(batch.attack_increments)} attacks, {len(batch.user_increments)} users).")
+    return len(entries)
+
+
+def battle_stats_lag():
+    """Queue health: {'pending': rows waiting, 'lag_seconds': age of the oldest pending row (0 if none)}."""
+    summary = BattleStatsOutbox.objects.filter(processed_at__isnull=True).aggregate(oldest=Min('created_at'), pending=Count('id'))
+    oldest = summary['oldest']
+    return {
+        'pending': summary['pending'],
+        'lag_seconds': round((timezone.now() - oldest).total_seconds(), 1) if oldest else 0.0,
+    }
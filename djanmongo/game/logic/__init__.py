@@ -3,4 +3,5 @@
 # Make functions and constants easily importable from the logic package
 from .constants import *  # Import constants like MIN/MAX_STAT_STAGE
 from .calculations import * # Import calculation functions like calculate_momentum_gain_range
-from .lua_integration import execute_lua_script, LUA_AVAILABLE # Import Lua specifics 
\ No newline at end of file
+from .lua_integration import execute_lua_script, LUA_AVAILABLE # Import Lua specifics
+from .simulation_cache import get_simulation_cache, simulation_fingerprint, loadout_script_versions # Simulation result cache
@@ -5,6 +5,7 @@ import logging # <-- Import logging
 from typing import TYPE_CHECKING # <-- Import TYPE_CHECKING
 from .constants import MIN_STAT_STAGE, MAX_STAT_STAGE, DAMAGE_RANDOM_FACTOR_MIN, DAMAGE_RANDOM_FACTOR_MAX
 from .calculations import get_modified_stat, clamp
+from request_timing import timed_section # Lua time in Server-Timing (no-op unless REQUEST_TIMING_ENABLED)
 
 # --- Type Hinting --- 
 if TYPE_CHECKING:
@@ -475,6 +476,7 @@ def get_momentum(context, role):
 
 # --- Update Lua Execution Function --- 
 
+@timed_section('lua')
 def execute_lua_script(script_content, battle, current_player, opponent, current_player_role, opponent_role, source_attack: 'Attack' = None, script_instance: dict = None):
     """
     Executes a Lua script within a prepared environment.
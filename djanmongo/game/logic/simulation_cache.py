@@ -0,0 +1,205 @@
+# djanmongo/game/logic/simulation_cache.py
+
+"""
+Content-addressed cache for battle simulation results.
+
+Bot searches, previews and balance runs keep simulating the same situations
+(same stats, same loadout, same stages). Results are stored under a stable
+hash of everything that can influence the outcome, so a changed input simply
+produces a different key and stale entries age out on their own.
+
+Two tiers:
+- an in-process LRU (bounded by SIMULATION_CACHE_MAX_ENTRIES), and
+- an optional SQLite file shared by all workers on the host
+  (SIMULATION_CACHE_DISK_PATH, disabled when unset).
+
+Cached values must be JSON-serializable. Random simulations must put their RNG seed in
+the key (see auto_battle.simulate_matchup): a cached result is frozen for that seed and
+only a new seed produces new matches.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# How many disk inserts between two pruning passes of the SQLite tier
+DISK_PRUNE_INTERVAL = 256
+
+
+# --- Fingerprinting ---
+
+def loadout_script_versions(attack_ids) -> dict:
+    """Returns {attack_id: [[script_id, updated_at_iso], ...]} for the given attacks in one query.
+       Including Script.updated_at in the fingerprint invalidates cached results whenever
+       a script of the loadout is edited.
+    """
+    from game.models import Script  # Local import: logic package stays model-agnostic at import time
+
+    versions = {}
+    rows = Script.objects.filter(attack_id__in=list(attack_ids)).values_list('attack_id', 'id', 'updated_at').order_by('attack_id', 'id')
+    for attack_id, script_id, updated_at in rows:
+        versions.setdefault(attack_id, []).append([script_id, updated_at.isoformat() if updated_at else None])
+    return versions
+
+
+def _stat_vector(base_stats: dict) -> list:
+    return [base_stats.get(name, 0) for name in ('hp', 'attack', 'defense', 'speed')]
+
+
+def _stage_vector(stages: dict | None) -> list:
+    return sorted((stages or {}).items())
+
+
+def simulation_fingerprint(attacks, base_stats: dict, stages: dict = None, opponent_stages: dict = None,
+                           script_versions: dict = None, namespace: str = 'sim', extra: dict = None) -> str:
+    """Builds the stable cache key for a simulation.
+
+    Args:
+        attacks: Attack instances of the loadout (order does not matter).
+        base_stats: {'hp', 'attack', 'defense', 'speed'} of the acting player.
+        stages / opponent_stages: current stat stage dicts.
+        script_versions: output of loadout_script_versions(); fetched when omitted.
+        namespace: separates different kinds of simulations sharing the cache.
+        extra: any further JSON-serializable input (opponent stats, seed, ...).
+    """
+    attacks = sorted(attacks, key=lambda a: a.id)
+    if script_versions is None:
+        script_versions = loadout_script_versions([a.id for a in attacks])
+
+    payload = {
+        'ns': namespace,
+        'attacks': [[a.id, a.momentum_cost, script_versions.get(a.id, [])] for a in attacks],
+        'stats': _stat_vector(base_stats),
+        'stages': _stage_vector(stages),
+        'opponent_stages': _stage_vector(opponent_stages),
+        'extra': extra or {},
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+# --- Cache ---
+
+class SimulationCache:
+    """Per-process LRU in front of an optional shared SQLite tier."""
+
+    def __init__(self, max_entries: int = 2048, disk_path: str = None, disk_max_entries: int = 100000):
+        self.max_entries = max(1, max_entries)
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_inserts = 0
+        if disk_path:
+            self._open_disk()
+
+    def _open_disk(self):
+        # One connection guarded by our lock; WAL lets several worker processes share the file.
+        self._disk = sqlite3.connect(self.disk_path, timeout=5, check_same_thread=False)
+        self._disk.execute('PRAGMA journal_mode=WAL')
+        self._disk.execute(
+            'CREATE TABLE IF NOT EXISTS simulation_results ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._disk.execute('CREATE INDEX IF NOT EXISTS simulation_results_accessed ON simulation_results (accessed_at)')
+        self._disk.commit()
+
+    def _remember(self, key, value):
+        """Stores in the LRU tier and evicts the least recently used entries. Caller holds the lock."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            if self._disk is not None:
+                try:
+                    row = self._disk.execute('SELECT value FROM simulation_results WHERE key = ?', (key,)).fetchone()
+                    if row is not None:
+                        self._disk.execute('UPDATE simulation_results SET accessed_at = ? WHERE key = ?', (time.time(), key))
+                        self._disk.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, value)
+                        self.hits += 1
+                        return value
+                except sqlite3.Error as e:
+                    print(f"[Simulation Cache Warning] Disk tier read failed: {e}")
+
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._remember(key, value)
+            if self._disk is None:
+                return
+            try:
+                self._disk.execute(
+                    'INSERT OR REPLACE INTO simulation_results (key, value, accessed_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), time.time())
+                )
+                self._disk_inserts += 1
+                if self._disk_inserts % DISK_PRUNE_INTERVAL == 0:
+                    self._prune_disk()
+                self._disk.commit()
+            except sqlite3.Error as e:
+                print(f"[Simulation Cache Warning] Disk tier write failed: {e}")
+
+    def _prune_disk(self):
+        """Drops the least recently accessed rows beyond disk_max_entries. Caller holds the lock."""
+        (count,) = self._disk.execute('SELECT COUNT(*) FROM simulation_results').fetchone()
+        overflow = count - self.disk_max_entries
+        if overflow > 0:
+            self._disk.execute(
+                'DELETE FROM simulation_results WHERE key IN ('
+                ' SELECT key FROM simulation_results ORDER BY accessed_at ASC LIMIT ?)',
+                (overflow,)
+            )
+
+    def get_or_compute(self, key: str, compute):
+        """Returns the cached value for key, calling compute() and storing its result on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute('DELETE FROM simulation_results')
+                self._disk.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_simulation_cache() -> SimulationCache:
+    """Returns the process-wide cache configured from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SimulationCache(
+                    max_entries=getattr(settings, 'SIMULATION_CACHE_MAX_ENTRIES', 2048),
+                    disk_path=getattr(settings, 'SIMULATION_CACHE_DISK_PATH', None),
+                    disk_max_entries=getattr(settings, 'SIMULATION_CACHE_DISK_MAX_ENTRIES', 100000),
+                )
+    return _cache
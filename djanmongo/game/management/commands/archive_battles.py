@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.archive import archivable_battles, archive_finished_battles
+from game.models import BattleArchive
+
+
+class Command(BaseCommand):
+    help = "Moves finished battles older than BATTLE_ARCHIVE_AFTER_DAYS into the compressed battle archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.BATTLE_ARCHIVE_BATCH_SIZE, help="Battles archived per batch.")
+        parser.add_argument('--limit', type=int, help="Stop after about this many battles (default: all eligible).")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the eligible battles.")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f"{archivable_battles().count()} battles are eligible for archiving.")
+            return
+
+        batch_size = max(1, options['batch_size'])
+        total = 0
+        while options['limit'] is None or total < options['limit']:
+            archived = archive_finished_battles(batch_size)
+            total += archived
+            if archived:
+                self.stdout.write(f"  Archived {total} battles...")
+            if archived < batch_size:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} battles ({BattleArchive.objects.count()} archived in total)."))
@@ -0,0 +1,59 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from game.battle_stats import BATTLE_STATS_FIELDS, BattleStatsBatch
+from game.models import AttackDailyStats, Battle
+from users.models import UserDailyStats
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily rollups (AttackDailyStats, UserDailyStats) from finished battles, streamed in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Battles loaded and parsed per chunk.")
+        parser.add_argument('--include-today', action='store_true',
+                            help="Also rebuild today. By default today is left to the incremental updates, which keep running meanwhile.")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        battles = Battle.objects.filter(status='finished', player1_is_ai_controlled=False) # Auto battles have no stats
+        if not options['include_today']:
+            start_of_today = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+            battles = battles.filter(updated_at__lt=start_of_today)
+
+        # Only the daily counters of the batch are used; partial chunks keep memory flat
+        batch = BattleStatsBatch()
+        chunk = []
+        for battle in battles.only(*BATTLE_STATS_FIELDS).order_by('id').iterator(chunk_size=chunk_size):
+            chunk.append(battle)
+            if len(chunk) >= chunk_size:
+                batch.add_battles(chunk)
+                chunk = []
+                self.stdout.write(f"  Parsed {batch.battle_count} battles...")
+        if chunk:
+            batch.add_battles(chunk)
+
+        with transaction.atomic():
+            stale_attacks = AttackDailyStats.objects.all()
+            stale_users = UserDailyStats.objects.all()
+            if not options['include_today']:
+                stale_attacks = stale_attacks.filter(date__lt=timezone.localdate())
+                stale_users = stale_users.filter(date__lt=timezone.localdate())
+            stale_attacks.delete()
+            stale_users.delete()
+            AttackDailyStats.objects.bulk_create([
+                AttackDailyStats(attack_id=attack_id, date=day, **counts)
+                for (attack_id, day), counts in batch.attack_daily.items()
+            ], batch_size=1000)
+            UserDailyStats.objects.bulk_create([
+                UserDailyStats(user_id=user_id, date=day, **counts)
+                for (user_id, day), counts in batch.user_daily.items()
+            ], batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt daily rollups from {batch.battle_count} battles: "
+            f"{len(batch.attack_daily)} attack-days, {len(batch.user_daily)} user-days."
+        ))
@@ -0,0 +1,45 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from game.matchmaking import queue_from_settings
+
+
+class Command(BaseCommand):
+    help = "Measures in-memory pairing throughput of the matchmaking queue on synthetic players."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=5000, help="Waiting players in the queue.")
+        parser.add_argument('--max-skill', type=int, default=100, help="Skills are drawn uniformly from 1..max-skill.")
+        parser.add_argument('--max-wait', type=float, default=60, help="Join times are spread over this many past seconds.")
+        parser.add_argument('--runs', type=int, default=5, help="Runs on fresh queues (best one is reported).")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        players = [
+            (user_id, rng.randint(1, options['max_skill']), now - timedelta(seconds=rng.uniform(0, options['max_wait'])))
+            for user_id in range(1, options['players'] + 1)
+        ]
+        # sync() expects join order, as run_matchmaking reads the tickets
+        players.sort(key=lambda player: (player[2], player[0]))
+
+        best = None
+        for _ in range(max(1, options['runs'])):
+            queue = queue_from_settings()
+            started = time.perf_counter()
+            queue.sync(players)
+            synced = time.perf_counter()
+            pairs = queue.pair(now)
+            finished = time.perf_counter()
+            if best is None or finished - started < best[0]:
+                best = (finished - started, synced - started, finished - synced, len(pairs), len(queue))
+
+        total, sync_time, pair_time, pair_count, left = best
+        self.stdout.write(f"{len(players)} players, skills 1..{options['max_skill']}, waits up to {options['max_wait']}s")
+        self.stdout.write(f"sync {sync_time * 1000:.1f} ms, pair {pair_time * 1000:.1f} ms -> {pair_count} pairs, {left} left waiting")
+        self.stdout.write(self.style.SUCCESS(f"{len(players) / total:,.0f} players/s ({pair_count / pair_time if pair_time else 0:,.0f} pairs/s in pair())"))
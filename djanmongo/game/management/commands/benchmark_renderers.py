@@ -0,0 +1,107 @@
+import io
+import random
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from game.renderers import MessagePackParser, MessagePackRenderer, ORJSONParser, ORJSONRenderer, msgpack, orjson
+
+
+def synthetic_battle_payload(turns, seed=0):
+    """A BattleSerializer-shaped payload whose log holds `turns` turns (the full log, i.e. ?log_from=0)."""
+    rng = random.Random(seed)
+    log = []
+    hp = {'player1': 400, 'player2': 400}
+    for turn in range(1, turns + 1):
+        actor = 'player1' if turn % 2 else 'player2'
+        target = 'player2' if actor == 'player1' else 'player1'
+        attack_id = rng.randint(1, 60)
+        damage = rng.randint(5, 60)
+        hp[target] = max(0, hp[target] - damage)
+        log.append({'effect_type': 'action', 'source': actor, 'text': f"Player used Attack {attack_id}!",
+                    'details': {'attack_name': f"Attack {attack_id}", 'emoji': '⚡'}})
+        log.append({'effect_type': 'damage', 'source': 'script', 'text': f"It dealt {damage} damage!",
+                    'source_attack_id': attack_id, 'target_role': target, 'details': {'amount': damage}})
+        if rng.random() < 0.3:
+            log.append({'effect_type': 'stat_change', 'source': 'script', 'text': "Defense fell!",
+                        'source_attack_id': attack_id, 'target_role': target, 'details': {'stat': 'defense', 'stages': -1}})
+        log.append({'effect_type': 'info', 'source': 'system', 'text': f"Turn {turn} ended.", 'details': {}})
+    attacks = [
+        {'id': i, 'name': f"Attack {i}", 'description': "Deals damage and sometimes lowers defense.",
+         'emoji': '⚡', 'momentum_cost': 20 + i, 'is_favorite': False,
+         'calculated_min_cost': 18 + i, 'calculated_max_cost': 24 + i}
+        for i in range(1, 7)
+    ]
+    return {
+        'id': 1,
+        'player1': {'id': 1, 'username': 'alice', 'card_version': 1760000000000000},
+        'player2': {'id': 2, 'username': 'bob', 'card_version': 1760000000000001},
+        'status': 'active', 'winner': None,
+        'current_hp_player1': hp['player1'], 'current_hp_player2': hp['player2'],
+        'stat_stages_player1': {'attack': 0, 'defense': -2, 'speed': 1},
+        'stat_stages_player2': {'attack': 1, 'defense': 0, 'speed': 0},
+        'custom_statuses_player1': {'burned': 2}, 'custom_statuses_player2': {},
+        'detailed_registered_scripts': [],
+        'current_momentum_player1': 35, 'current_momentum_player2': 10, 'whose_turn': 'player1',
+        'my_selected_attacks': attacks,
+        'player2_is_ai_controlled': False,
+        'updated_at': '2025-10-19T12:00:00.000000Z',
+        'log': log, 'log_offset': 0, 'log_length': len(log),
+    }
+
+
+def battle_payload_from_db(battle_id):
+    """The real BattleSerializer output for a stored battle, with the full log."""
+    from game.serializers import BattleSerializer
+    from game.views import battle_queryset_for_serializer
+
+    battle = battle_queryset_for_serializer().filter(pk=battle_id).first()
+    if battle is None:
+        raise CommandError(f"Battle {battle_id} not found.")
+    request = Request(APIRequestFactory().get(f'/api/game/battles/{battle_id}/', {'log_from': 0}))
+    request.user = battle.player1
+    return BattleSerializer(battle, context={'request': request}).data
+
+
+class Command(BaseCommand):
+    help = "Compares render/parse time and payload size of the game API renderers on a long battle payload."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=200, help="Turns in the synthetic battle log.")
+        parser.add_argument('--battle', type=int, help="Benchmark a stored battle instead of a synthetic one.")
+        parser.add_argument('--iterations', type=int, default=200, help="Timed iterations per run (best of 5 runs).")
+
+    def handle(self, *args, **options):
+        if options['battle']:
+            payload = battle_payload_from_db(options['battle'])
+            label = f"battle {options['battle']}"
+        else:
+            payload = synthetic_battle_payload(options['turns'])
+            label = f"synthetic {options['turns']}-turn battle"
+        iterations = max(1, options['iterations'])
+
+        candidates = [('DRF JSONRenderer', JSONRenderer(), JSONParser())]
+        if orjson is not None:
+            candidates.append(('orjson', ORJSONRenderer(), ORJSONParser()))
+        else:
+            self.stdout.write("orjson is not installed; ORJSONRenderer would fall back to DRF's encoder.")
+        if msgpack is not None:
+            candidates.append(('MessagePack', MessagePackRenderer(), MessagePackParser()))
+        else:
+            self.stdout.write("msgpack is not installed; skipping MessagePack.")
+
+        self.stdout.write(f"{label}: {len(payload.get('log', []))} log entries, {iterations} iterations")
+        self.stdout.write(f"{'renderer':<18} {'bytes':>8} {'render µs':>10} {'parse µs':>10}")
+        baseline = None
+        for name, renderer, parser in candidates:
+            body = renderer.render(payload, renderer.media_type, {})
+            render_us = min(timeit.repeat(lambda: renderer.render(payload, renderer.media_type, {}), number=iterations, repeat=5)) / iterations * 1e6
+            parse_us = min(timeit.repeat(lambda: parser.parse(io.BytesIO(body), parser.media_type, {}), number=iterations, repeat=5)) / iterations * 1e6
+            if parser.parse(io.BytesIO(body), parser.media_type, {}) != JSONParser().parse(io.BytesIO(JSONRenderer().render(payload)), None, {}):
+                raise CommandError(f"{name} does not round-trip the payload.")
+            baseline = baseline or render_us
+            self.stdout.write(f"{name:<18} {len(body):>8} {render_us:>10.1f} {parse_us:>10.1f}   ({baseline / render_us:.1f}x render)")
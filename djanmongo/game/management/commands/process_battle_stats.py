@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.battle_stats import battle_stats_lag, flush_battle_stats_outbox
+from game.models import StatsRecalculationJob
+from game.stats_recalculation import run_recalculation_job
+
+
+class Command(BaseCommand):
+    help = "Applies queued post-battle statistics (BattleStatsOutbox) in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep draining the queue until interrupted. Also runs stats recalculations queued from the admin.")
+        parser.add_argument('--batch-size', type=int, default=settings.BATTLE_STATS_BATCH_SIZE, help="Battles applied per transaction.")
+        parser.add_argument('--interval', type=float, default=settings.BATTLE_STATS_POLL_INTERVAL, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--status', action='store_true', help="Only print the queue size and lag.")
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.print_lag()
+            return
+
+        batch_size = max(1, options['batch_size'])
+        if not options['loop']:
+            total = 0
+            while True:
+                applied = flush_battle_stats_outbox(batch_size)
+                total += applied
+                if applied < batch_size:
+                    break
+            self.stdout.write(self.style.SUCCESS(f"Applied stats for {total} battles."))
+            self.print_lag()
+            return
+
+        self.stdout.write(f"Processing battle stats (batch size {batch_size}, poll interval {options['interval']}s). Ctrl+C to stop.")
+        try:
+            while True:
+                try:
+                    applied = flush_battle_stats_outbox(batch_size)
+                except Exception as e:
+                    # Nothing was committed for this batch; it stays pending and is retried
+                    self.stderr.write(f"[Battle Stats Error] Flush failed: {e}")
+                    applied = 0
+                if applied:
+                    self.print_lag()
+                if applied < batch_size:
+                    self.run_queued_recalculation()
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
+
+    def run_queued_recalculation(self):
+        """Runs the oldest recalculation job queued from the admin, if any (blocks the queue meanwhile)."""
+        job = StatsRecalculationJob.objects.filter(status='queued').order_by('created_at').first()
+        if not job:
+            return
+        try:
+            run_recalculation_job(job, workers=settings.STATS_RECALCULATION_WORKERS, report=self.stdout.write)
+        except Exception as e:
+            self.stderr.write(f"[Stats Recalculation Error] Job {job.pk} failed: {e}. Resume with: manage.py recalculate_attack_stats --job {job.pk}")
+
+    def print_lag(self):
+        lag = battle_stats_lag()
+        self.stdout.write(f"[Battle Stats] Pending: {lag['pending']}, lag: {lag['lag_seconds']}s")
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from game.models import StatsRecalculationJob
+from game.stats_recalculation import ACTIVE_JOB_STATUSES, queue_recalculation_job, run_recalculation_job
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds AttackUsageStats and AttackCoUsage from the logs of the finished battles whose stats were applied "
+            "(same set as the live pipeline: no forfeits or auto battles), sharded, parallel and resumable.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.STATS_RECALCULATION_WORKERS, help="Worker processes aggregating shards.")
+        parser.add_argument('--job', type=int, help="Run or resume this job id (e.g. a failed one).")
+        parser.add_argument('--queued-only', action='store_true', help="Only run a job queued from the admin; do nothing if there is none.")
+
+    def handle(self, *args, **options):
+        if options['job']:
+            job = StatsRecalculationJob.objects.filter(pk=options['job']).first()
+            if not job:
+                raise CommandError(f"Job {options['job']} does not exist.")
+            if job.status == 'done':
+                raise CommandError(f"Job {job.pk} is already done.")
+        elif options['queued_only']:
+            job = StatsRecalculationJob.objects.filter(status='queued').order_by('created_at').first()
+            if not job:
+                return
+        else:
+            # Resume an unfinished job if there is one, otherwise start a new one
+            job = StatsRecalculationJob.objects.filter(status__in=ACTIVE_JOB_STATUSES + ('failed',)).order_by('created_at').first()
+            if not job:
+                job, _ = queue_recalculation_job()
+
+        run_recalculation_job(job, workers=max(1, options['workers']), report=self.stdout.write)
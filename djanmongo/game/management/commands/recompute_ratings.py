@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from game.models import Battle
+from game.rating import rate
+from users.models import DEFAULT_RATING, User
+
+WRITE_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Recomputes every Elo rating by replaying the finished-battle history in order, in one streaming pass."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Battles fetched per round trip while streaming.")
+        parser.add_argument('--dry-run', action='store_true', help="Compute and report, but do not write ratings.")
+
+    def handle(self, *args, **options):
+        # Only the per-player state is kept: memory grows with players, not battles
+        ratings = {} # user_id -> [rating, rated_battles]
+        battles = (
+            Battle.objects.filter(status='finished', winner__isnull=False, player1_is_ai_controlled=False, player2_is_ai_controlled=False)
+            .order_by('updated_at', 'id') # updated_at of a finished battle is its finishing time
+            .values_list('player1_id', 'player2_id', 'winner_id')
+            .iterator(chunk_size=max(1, options['chunk_size']))
+        )
+        replayed = 0
+        for player1_id, player2_id, winner_id in battles:
+            loser_id = player2_id if winner_id == player1_id else player1_id
+            winner = ratings.setdefault(winner_id, [DEFAULT_RATING, 0])
+            loser = ratings.setdefault(loser_id, [DEFAULT_RATING, 0])
+            winner[0], loser[0] = rate(winner[0], winner[1], loser[0], loser[1])
+            winner[1] += 1
+            loser[1] += 1
+            replayed += 1
+
+        self.stdout.write(f"Replayed {replayed} rated battles for {len(ratings)} players.")
+        if options['dry_run']:
+            top = sorted(ratings.items(), key=lambda item: -item[1][0])[:10]
+            for user_id, (rating, rated_battles) in top:
+                self.stdout.write(f"  user {user_id}: {rating:.0f} ({rated_battles} battles)")
+            return
+
+        with transaction.atomic():
+            # Players without rated battles go back to the default
+            User.objects.update(rating=DEFAULT_RATING, rated_battles=0)
+            rows = [User(pk=user_id, rating=rating, rated_battles=rated_battles) for user_id, (rating, rated_battles) in ratings.items()]
+            User.objects.bulk_update(rows, ['rating', 'rated_battles'], batch_size=WRITE_BATCH_SIZE)
+        self.stdout.write(self.style.SUCCESS(f"Wrote ratings for {len(ratings)} players (K={settings.RATING_K}, provisional K={settings.RATING_K_PROVISIONAL})."))
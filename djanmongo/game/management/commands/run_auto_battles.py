@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from game.auto_battle import auto_battle_result, load_matchup, persist_auto_battle, play_auto_battle
+from users.models import User
+
+
+def _init_worker(verbose):
+    django.setup() # No-op when forked; needed with the spawn/forkserver start methods
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w') # apply_attack logs every phase with print()
+
+
+class Command(BaseCommand):
+    help = "Plays AI-vs-AI battles between two players' current loadouts, in parallel worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('player1', help="Username of player 1 (moves first).")
+        parser.add_argument('player2', help="Username of player 2.")
+        parser.add_argument('--matches', type=int, default=100, help="Number of matches to play.")
+        parser.add_argument('--workers', type=int, default=settings.AUTO_BATTLE_WORKERS, help="Worker processes (0: play in this process).")
+        parser.add_argument('--max-actions', type=int, default=settings.AUTO_BATTLE_MAX_ACTIONS, help="Actions before a match is called a draw.")
+        parser.add_argument('--persist', action='store_true', help="Save every finished match (one transaction each).")
+        parser.add_argument('--verbose', action='store_true', help="Keep the per-action battle logging of the workers.")
+
+    def handle(self, *args, **options):
+        try:
+            player1 = User.objects.get(username=options['player1'])
+            player2 = User.objects.get(username=options['player2'])
+            matchup = load_matchup(player1, player2)
+        except (User.DoesNotExist, ValueError) as e:
+            raise CommandError(str(e))
+
+        matches = max(1, options['matches'])
+        workers = max(0, options['workers'])
+        started = time.perf_counter()
+        outcomes = Counter()
+        total_actions = 0
+        for battle in self._play(matchup, matches, workers, options):
+            if options['persist']:
+                persist_auto_battle(battle, matchup)
+            result = auto_battle_result(battle)
+            outcomes[result['winner'] or 'draw'] += 1
+            total_actions += result['actions']
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{player1.username}: {outcomes['player1']} wins, {player2.username}: {outcomes['player2']} wins, "
+            f"{outcomes['draw']} draws. Avg {total_actions / matches:.1f} actions per match."
+        )
+        saved = " (saved)" if options['persist'] else ""
+        self.stdout.write(self.style.SUCCESS(f"Played {matches} matches{saved} in {elapsed:.2f}s ({matches / elapsed:.1f}/s, {workers or 1} process(es))."))
+
+    def _play(self, matchup, matches, workers, options):
+        """Yields the finished (unsaved) battles; persisting stays in this process."""
+        if workers == 0:
+            for _ in range(matches):
+                yield play_auto_battle(matchup, options['max_actions'])
+            return
+        # Forked workers must not inherit (and later close) this process's DB connections
+        connections.close_all()
+        chunksize = max(1, matches // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options['verbose'],)) as pool:
+            yield from pool.map(play_auto_battle, repeat(matchup, matches), repeat(options['max_actions'], matches), chunksize=chunksize)
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.matchmaking import queue_from_settings, run_matchmaking_tick
+
+
+class Command(BaseCommand):
+    help = "Pairs players waiting in the matchmaking queue and starts their battles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep pairing until interrupted.")
+        parser.add_argument('--interval', type=float, default=settings.MATCHMAKING_INTERVAL, help="Seconds between pairing passes with --loop.")
+
+    def handle(self, *args, **options):
+        queue = queue_from_settings() # Kept across ticks; re-synced from the tickets table each pass
+        if not options['loop']:
+            started = run_matchmaking_tick(queue)
+            self.stdout.write(self.style.SUCCESS(f"Started {started} battles ({len(queue)} players still waiting)."))
+            return
+
+        self.stdout.write(f"Matchmaking every {options['interval']}s. Ctrl+C to stop.")
+        try:
+            while True:
+                try:
+                    run_matchmaking_tick(queue)
+                except Exception as e:
+                    # Claims are per pair and transactional; unclaimed players are re-read next pass
+                    self.stderr.write(f"[Matchmaking Error] Pairing pass failed: {e}")
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
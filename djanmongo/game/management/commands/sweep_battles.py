@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.sweeper import sweep
+
+
+class Command(BaseCommand):
+    help = "Deletes expired pending challenges and forfeits idle active battles (run from cron, or with --loop)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping until interrupted.")
+        parser.add_argument('--batch-size', type=int, default=settings.SWEEPER_BATCH_SIZE, help="Battles handled per batch.")
+        parser.add_argument('--interval', type=float, default=settings.SWEEPER_INTERVAL, help="Seconds between sweeps with --loop.")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        if not options['loop']:
+            self.run_sweep(batch_size, quiet=False)
+            return
+
+        self.stdout.write(f"Sweeping battles every {options['interval']}s (batch size {batch_size}). Ctrl+C to stop.")
+        try:
+            while True:
+                try:
+                    self.run_sweep(batch_size, quiet=True)
+                except Exception as e:
+                    # Each battle is finished in its own transaction; whatever failed is picked up next sweep
+                    self.stderr.write(f"[Sweeper Error] Sweep failed: {e}")
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
+
+    def run_sweep(self, batch_size, quiet):
+        expired, forfeited = sweep(batch_size)
+        if expired or forfeited or not quiet:
+            self.stdout.write(self.style.SUCCESS(f"Expired {expired} pending challenges, forfeited {forfeited} idle battles."))
@@ -0,0 +1,161 @@
+"""
+Matchmaking: pairs queued players by skill (level) within a widening window.
+
+- Players join through MatchmakingView, which writes a MatchmakingTicket. The table is
+  shared by every worker and is the source of truth.
+- `manage.py run_matchmaking` keeps a MatchmakingQueue in memory, refreshes it from the
+  waiting tickets on every tick, pairs players in memory and then claims each pair with
+  row locks, so two pairing processes can never put a player in two battles.
+- A player's window is MATCHMAKING_BASE_BAND levels, widened by
+  MATCHMAKING_BAND_WIDEN_PER_SECOND per second waited, up to MATCHMAKING_MAX_BAND.
+
+`manage.py benchmark_matchmaking` measures the in-memory pairing on synthetic queues.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Battle, BattleParticipant, MatchmakingTicket
+
+
+class MatchmakingQueue:
+    """Waiting players bucketed by skill, each bucket in join order.
+
+    pair() walks players oldest first and gives each the closest-skill partner inside
+    its window (ties: the longest waiting one), so nobody starves behind newer arrivals.
+    """
+
+    def __init__(self, base_band, widen_per_second, max_band):
+        self.base_band = base_band
+        self.widen_per_second = widen_per_second
+        self.max_band = max_band
+        self._entries = {}  # user_id -> (skill, joined_at)
+        self._buckets = {}  # skill -> {user_id: joined_at}, insertion (= join) order
+        self._skills = []   # sorted skills with a non-empty bucket
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def add(self, user_id, skill, joined_at):
+        if user_id in self._entries:
+            self.remove(user_id)
+        self._entries[user_id] = (skill, joined_at)
+        bucket = self._buckets.get(skill)
+        if bucket is None:
+            bucket = self._buckets[skill] = {}
+            insort(self._skills, skill)
+        bucket[user_id] = joined_at
+
+    def remove(self, user_id):
+        skill, _ = self._entries.pop(user_id)
+        bucket = self._buckets[skill]
+        del bucket[user_id]
+        if not bucket:
+            del self._buckets[skill]
+            del self._skills[bisect_left(self._skills, skill)]
+
+    def sync(self, waiting):
+        """Mirrors the waiting tickets: [(user_id, skill, joined_at)]. Unknown players are
+        added, players no longer waiting (matched elsewhere, left, expired) are dropped.
+        `waiting` must be in join order: buckets keep insertion order for the tie-break.
+        """
+        current = {}
+        for user_id, skill, joined_at in waiting:
+            current[user_id] = (skill, joined_at)
+            if self._entries.get(user_id) != (skill, joined_at):
+                self.add(user_id, skill, joined_at)
+        for user_id in [uid for uid in self._entries if uid not in current]:
+            self.remove(user_id)
+
+    def band(self, joined_at, now):
+        waited = max(0.0, (now - joined_at).total_seconds())
+        return min(self.max_band, self.base_band + int(waited * self.widen_per_second))
+
+    def _closest(self, user_id, skill, band):
+        lo = bisect_left(self._skills, skill - band)
+        hi = bisect_right(self._skills, skill + band)
+        # Nearest skills first; equal distance prefers the lower skill (stable order)
+        for candidate_skill in sorted(self._skills[lo:hi], key=lambda s: abs(s - skill)):
+            for candidate in self._buckets[candidate_skill]:
+                if candidate != user_id:
+                    return candidate
+        return None
+
+    def pair(self, now):
+        """Removes and returns [(older_user_id, newer_user_id)] for every pair found."""
+        pairs = []
+        for user_id, (skill, joined_at) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if user_id not in self._entries:
+                continue # Already taken as someone's partner
+            opponent = self._closest(user_id, skill, self.band(joined_at, now))
+            if opponent is not None:
+                self.remove(user_id)
+                self.remove(opponent)
+                pairs.append((user_id, opponent))
+        return pairs
+
+
+def queue_from_settings():
+    return MatchmakingQueue(
+        base_band=settings.MATCHMAKING_BASE_BAND,
+        widen_per_second=settings.MATCHMAKING_BAND_WIDEN_PER_SECOND,
+        max_band=settings.MATCHMAKING_MAX_BAND,
+    )
+
+
+def expire_stale_tickets(now=None):
+    cutoff = (now or timezone.now()) - timedelta(minutes=settings.MATCHMAKING_TICKET_TTL_MINUTES)
+    return MatchmakingTicket.objects.filter(status='waiting', joined_at__lt=cutoff).update(status='cancelled')
+
+
+def start_matched_battle(user_a_id, user_b_id, now=None):
+    """Claims both tickets and starts their battle. Returns the Battle, or None when
+    either ticket was taken, cancelled, or its player got into a battle meanwhile.
+    """
+    with transaction.atomic():
+        tickets = list(
+            MatchmakingTicket.objects.select_for_update(skip_locked=True)
+            .filter(user_id__in=[user_a_id, user_b_id], status='waiting')
+            .select_related('user')
+            .order_by('joined_at') # The longer-waiting player is player1 and moves first
+        )
+        if len(tickets) != 2:
+            return None
+        busy = set(
+            BattleParticipant.objects.filter(user_id__in=[user_a_id, user_b_id], status='active')
+            .values_list('user_id', flat=True)
+        )
+        if busy:
+            MatchmakingTicket.objects.filter(user_id__in=busy).update(status='cancelled')
+            return None
+
+        battle = Battle.objects.create(player1=tickets[0].user, player2=tickets[1].user, status='active')
+        battle.initialize_battle_state() # Copies both current loadouts and saves
+        MatchmakingTicket.objects.filter(pk__in=[t.pk for t in tickets]).update(
+            status='matched', battle=battle, matched_at=now or timezone.now(),
+        )
+    print(f"[Matchmaking] Battle {battle.id}: {tickets[0].user.username} (skill {tickets[0].skill}) vs {tickets[1].user.username} (skill {tickets[1].skill}).")
+    return battle
+
+
+def run_matchmaking_tick(queue, now=None):
+    """One pairing pass: expire, refresh from the table, pair, start battles.
+    Returns the number of battles started.
+    """
+    now = now or timezone.now()
+    expire_stale_tickets(now)
+    # Join order, so each skill bucket lists its players longest-waiting first (pair() tie-break)
+    queue.sync(MatchmakingTicket.objects.filter(status='waiting').order_by('joined_at', 'user_id').values_list('user_id', 'skill', 'joined_at'))
+    started = 0
+    for user_a_id, user_b_id in queue.pair(now):
+        # A pair that could not be claimed is simply re-read on the next tick
+        if start_matched_battle(user_a_id, user_b_id, now):
+            started += 1
+    return started
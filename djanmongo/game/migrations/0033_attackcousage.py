@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def co_used_json_to_rows(apps, schema_editor):
+    """Converts AttackUsageStats.co_used_with_counts ({"<attack_id>": count}) into AttackCoUsage rows."""
+    Attack = apps.get_model('game', 'Attack')
+    AttackUsageStats = apps.get_model('game', 'AttackUsageStats')
+    AttackCoUsage = apps.get_model('game', 'AttackCoUsage')
+
+    existing_attack_ids = set(Attack.objects.values_list('id', flat=True))
+    batch = []
+    for attack_id, counts in AttackUsageStats.objects.values_list('attack_id', 'co_used_with_counts').iterator(chunk_size=500):
+        if not isinstance(counts, dict):
+            continue
+        for other_id_str, count in counts.items():
+            try:
+                other_id = int(other_id_str)
+            except (TypeError, ValueError):
+                continue
+            if other_id == attack_id or other_id not in existing_attack_ids or not isinstance(count, int) or count <= 0:
+                continue
+            batch.append(AttackCoUsage(attack_a_id=attack_id, attack_b_id=other_id, count=count))
+        if len(batch) >= 2000:
+            AttackCoUsage.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        AttackCoUsage.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def co_used_rows_to_json(apps, schema_editor):
+    AttackUsageStats = apps.get_model('game', 'AttackUsageStats')
+    AttackCoUsage = apps.get_model('game', 'AttackCoUsage')
+
+    counts_by_attack = {}
+    for attack_a_id, attack_b_id, count in AttackCoUsage.objects.values_list('attack_a_id', 'attack_b_id', 'count').iterator():
+        counts_by_attack.setdefault(attack_a_id, {})[str(attack_b_id)] = count
+    for stats in AttackUsageStats.objects.filter(attack_id__in=counts_by_attack.keys()):
+        stats.co_used_with_counts = counts_by_attack[stats.attack_id]
+        stats.save(update_fields=['co_used_with_counts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0032_attack_is_favorite'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='battle',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('active', 'Active'), ('finished', 'Finished'), ('declined', 'Declined')], db_index=True, default='pending', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='AttackCoUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('attack_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_usage', to='game.attack')),
+                ('attack_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game.attack')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['attack_a', '-count'], name='attack_co_usage_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('attack_a', 'attack_b'), name='unique_attack_co_usage_pair')],
+            },
+        ),
+        migrations.RunPython(co_used_json_to_rows, co_used_rows_to_json),
+        migrations.RemoveField(
+            model_name='attackusagestats',
+            name='co_used_with_counts',
+        ),
+    ]
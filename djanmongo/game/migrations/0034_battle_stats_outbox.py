@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0033_attackcousage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleStatsOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('battle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats_outbox', to='game.battle')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'created_at'], name='battle_stats_outbox_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0034_battle_stats_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsRecalculationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('shard_size', models.PositiveIntegerField(default=2000, help_text='Battle id range covered by each shard.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, help_text='Battles whose stats were applied after this are kept from the live counters.', null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('baseline', models.JSONField(blank=True, default=dict)),
+                ('battles_processed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatsRecalculationShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_id', models.PositiveIntegerField()),
+                ('end_id', models.PositiveIntegerField()),
+                ('partial', models.JSONField(blank=True, null=True)),
+                ('battles_processed', models.PositiveIntegerField(default=0)),
+                ('done_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='game.statsrecalculationjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'start_id'), name='unique_recalculation_shard')],
+            },
+        ),
+    ]
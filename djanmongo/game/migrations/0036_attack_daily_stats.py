@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0035_stats_recalculation_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttackDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('uses', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('damage_dealt', models.BigIntegerField(default=0)),
+                ('healing_done', models.BigIntegerField(default=0)),
+                ('attack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='game.attack')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='attack_daily_stats_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('attack', 'date'), name='unique_attack_daily_stats')],
+            },
+        ),
+    ]
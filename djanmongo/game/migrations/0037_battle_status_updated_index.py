@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0036_attack_daily_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='battle',
+            index=models.Index(fields=['status', 'updated_at'], name='battle_status_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_participants(apps, schema_editor):
+    """Two BattleParticipant rows per existing battle, in chunks."""
+    Battle = apps.get_model('game', 'Battle')
+    BattleParticipant = apps.get_model('game', 'BattleParticipant')
+    rows = []
+    created = 0
+    for battle_id, player1_id, player2_id, status in Battle.objects.order_by('id').values_list('id', 'player1_id', 'player2_id', 'status').iterator(chunk_size=1000):
+        rows.append(BattleParticipant(battle_id=battle_id, user_id=player1_id, opponent_id=player2_id, role='player1', status=status))
+        rows.append(BattleParticipant(battle_id=battle_id, user_id=player2_id, opponent_id=player1_id, role='player2', status=status))
+        if len(rows) >= 2000:
+            BattleParticipant.objects.bulk_create(rows)
+            created += len(rows)
+            rows = []
+    BattleParticipant.objects.bulk_create(rows)
+    created += len(rows)
+    if created:
+        print(f"\n  [Migration] Created {created} battle participant rows.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0037_battle_status_updated_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('player1', 'Player 1'), ('player2', 'Player 2')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('active', 'Active'), ('finished', 'Finished'), ('declined', 'Declined')], max_length=10)),
+                ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='game.battle')),
+                ('opponent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='battle_participations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'status'], name='battle_participant_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('battle', 'role'), name='unique_battle_participant_role')],
+            },
+        ),
+        migrations.RunPython(backfill_participants, migrations.RunPython.noop),
+    ]
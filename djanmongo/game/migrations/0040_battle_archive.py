@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0039_matchmaking_ticket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleArchive',
+            fields=[
+                ('battle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='game.battle')),
+                ('compression', models.CharField(default='zlib', max_length=10)),
+                ('log_blob', models.BinaryField()),
+                ('state_blob', models.BinaryField()),
+                ('log_length', models.PositiveIntegerField(default=0)),
+                ('turn_offsets', models.JSONField(default=list)),
+                ('error_count', models.PositiveIntegerField(default=0, help_text="Log entries with effect_type 'error' (for the admin list).")),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='battle',
+            name='is_archived',
+            field=models.BooleanField(default=False, help_text='Log and state moved to BattleArchive (see game/archive.py).'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0040_battle_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='battle',
+            name='player1_is_ai_controlled',
+            field=models.BooleanField(default=False, help_text='True if player 1 is being controlled by AI in this battle (auto battles).'),
+        ),
+    ]
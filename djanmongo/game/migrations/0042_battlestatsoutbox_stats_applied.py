@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:41
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def record_past_forfeits(apps, schema_editor):
+    """Outbox rows (processed, no stats) for finished battles that ended with both players
+    standing and were never recorded: forfeits from before forfeits were recorded."""
+    Battle = apps.get_model('game', 'Battle')
+    BattleStatsOutbox = apps.get_model('game', 'BattleStatsOutbox')
+    now = timezone.now()
+    rows = []
+    created = 0
+    forfeits = Battle.objects.filter(
+        status='finished', player1_is_ai_controlled=False, stats_outbox__isnull=True,
+        current_hp_player1__gt=0, current_hp_player2__gt=0,
+    )
+    for battle_id in forfeits.order_by('id').values_list('id', flat=True).iterator(chunk_size=1000):
+        rows.append(BattleStatsOutbox(battle_id=battle_id, processed_at=now, stats_applied=False))
+        if len(rows) >= 1000:
+            BattleStatsOutbox.objects.bulk_create(rows)
+            created += len(rows)
+            rows = []
+    BattleStatsOutbox.objects.bulk_create(rows)
+    created += len(rows)
+    if created:
+        print(f"\n  [Migration] Recorded {created} past forfeits in the stats outbox.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0041_battle_player1_is_ai_controlled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='battlestatsoutbox',
+            name='stats_applied',
+            field=models.BooleanField(default=True, help_text='False for battles recorded without attack stats (forfeits).'),
+        ),
+        migrations.RunPython(record_past_forfeits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def record_pre_outbox_battles(apps, schema_editor):
+    """Processed outbox rows (stats applied) for battles finished before the outbox existed,
+    whose stats the old code applied at the killing blow. Forfeits were recorded by 0042,
+    so afterwards every finished battle has a row saying whether its stats were applied."""
+    Battle = apps.get_model('game', 'Battle')
+    BattleStatsOutbox = apps.get_model('game', 'BattleStatsOutbox')
+    now = timezone.now()
+    rows = []
+    created = 0
+    battles = Battle.objects.filter(status='finished', player1_is_ai_controlled=False, stats_outbox__isnull=True)
+    for battle_id in battles.order_by('id').values_list('id', flat=True).iterator(chunk_size=1000):
+        rows.append(BattleStatsOutbox(battle_id=battle_id, processed_at=now, stats_applied=True))
+        if len(rows) >= 1000:
+            BattleStatsOutbox.objects.bulk_create(rows)
+            created += len(rows)
+            rows = []
+    BattleStatsOutbox.objects.bulk_create(rows)
+    created += len(rows)
+    if created:
+        print(f"\n  [Migration] Recorded {created} battles finished before the stats outbox.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0042_battlestatsoutbox_stats_applied'),
+    ]
+
+    operations = [
+        migrations.RunPython(record_pre_outbox_battles, migrations.RunPython.noop),
+    ]
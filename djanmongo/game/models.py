@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 import json # For stat stages
 import random # For initial turn
@@ -144,15 +144,65 @@ class AttackUsageStats(models.Model):
     total_damage_dealt = models.BigIntegerField(default=0, help_text="Sum of all direct damage dealt by this attack across all uses.")
     total_healing_done = models.BigIntegerField(default=0, help_text="Sum of all direct healing done by this attack across all uses.")
 
-    # Stores counts of other attacks used in the same battles by the same player
-    # Format: {"<attack_id>": <count>, "<attack_id>": <count>, ...}
-    co_used_with_counts = models.JSONField(default=dict, help_text="Counts of other attacks used alongside this one.")
+    # Co-usage counts live in AttackCoUsage (one row per attack pair)
     # --- END NEW STAT FIELDS ---
 
     def __str__(self):
         return f"Stats for {self.attack.name}"
 # --- END Attack Usage Stats Model ---
 
+# --- NEW: Attack Co-Usage Model ---
+class AttackCoUsage(models.Model):
+    """How often attack_b was used by the same player in the same battle as attack_a.
+
+    Stored in both directions (a->b and b->a) so the top co-used attacks of any
+    attack are a single range scan on (attack_a, -count).
+    """
+    attack_a = models.ForeignKey(Attack, on_delete=models.CASCADE, related_name='co_usage')
+    attack_b = models.ForeignKey(Attack, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['attack_a', 'attack_b'], name='unique_attack_co_usage_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['attack_a', '-count'], name='attack_co_usage_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.attack_a_id} + {self.attack_b_id}: {self.count}"
+# --- END Attack Co-Usage Model ---
+
+# --- NEW: Daily Attack Rollup ---
+class AttackDailyStats(models.Model):
+    """Per-attack totals for one day (the local date the battle finished).
+
+    Filled incrementally by the stats pipeline (game.battle_stats.BattleStatsBatch);
+    `manage.py backfill_daily_rollups` rebuilds past days from the battle logs.
+    Analytics endpoints read date ranges from here instead of scanning battles.
+    """
+    attack = models.ForeignKey(Attack, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    uses = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    damage_dealt = models.BigIntegerField(default=0)
+    healing_done = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves per-attack date ranges
+            models.UniqueConstraint(fields=['attack', 'date'], name='unique_attack_daily_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='attack_daily_stats_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Attack {self.attack_id} on {self.date}: {self.uses} uses"
+# --- END Daily Attack Rollup ---
+
 class Battle(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -189,6 +239,8 @@ class Battle(models.Model):
     
     # NEW: Flag if player2 is AI-controlled for this specific battle
     player2_is_ai_controlled = models.BooleanField(default=False, help_text="True if player 2 is being controlled by AI in this battle.")
+    # Auto battles (game.auto_battle) are played out by the server on both sides
+    player1_is_ai_controlled = models.BooleanField(default=False, help_text="True if player 1 is being controlled by AI in this battle (auto battles).")
     
     # ADDED BACK: Store attacks selected specifically for this battle
     battle_attacks_player1 = models.ManyToManyField(
@@ -221,6 +273,15 @@ class Battle(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Cold archive: the log and the per-player state live (compressed) in BattleArchive
+    is_archived = models.BooleanField(default=False, help_text="Log and state moved to BattleArchive (see game/archive.py).")
+
+    class Meta:
+        indexes = [
+            # Sweeper queues (game/sweeper.py): WHERE status = ... AND updated_at < cutoff ORDER BY updated_at
+            models.Index(fields=['status', 'updated_at'], name='battle_status_updated_idx'),
+        ]
+
     def initialize_battle_state(self):
         """Sets initial state based on players' current profiles WHEN battle becomes active."""
         # Ensure this is only called when status is being set to active
@@ -265,6 +326,61 @@ class Battle(models.Model):
         # The calling view might save again, but saving here ensures consistency
         self.save() 
 
+    # --- Archive access (see BattleArchive) ---
+    def get_log(self):
+        """The battle log, from the row or, once archived, from the compressed archive."""
+        if self.is_archived:
+            return self.archive.read_log()
+        return self.last_turn_summary if isinstance(self.last_turn_summary, list) else []
+
+    def load_archived_state(self):
+        """Puts the archived log and per-player state back on this instance (in memory only),
+        so code reading the fields directly sees the battle as it finished."""
+        if not self.is_archived:
+            return
+        for field, value in self.archive.read_state().items():
+            setattr(self, field, value)
+        self.last_turn_summary = self.archive.read_log()
+    # --- END Archive access ---
+
+    # --- Participant sync (see BattleParticipant) ---
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._participant_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Saves the battle; creating it or changing its status also writes its
+        BattleParticipant rows, and finishing it updates the players' ratings,
+        all in the same transaction."""
+        creating = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        status_changed = (
+            not creating
+            and 'status' not in self.get_deferred_fields()
+            and (update_fields is None or 'status' in update_fields)
+            and self.status != getattr(self, '_participant_status', None)
+        )
+        if not (creating or status_changed):
+            super().save(*args, **kwargs)
+            return
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if creating:
+                BattleParticipant.objects.bulk_create([
+                    BattleParticipant(battle=self, user_id=self.player1_id, opponent_id=self.player2_id, role='player1', status=self.status),
+                    BattleParticipant(battle=self, user_id=self.player2_id, opponent_id=self.player1_id, role='player2', status=self.status),
+                ])
+            else:
+                BattleParticipant.objects.filter(battle=self).update(status=self.status)
+            if self.status == 'finished':
+                from .rating import apply_battle_rating # Avoid circular import (rating uses the user model)
+                apply_battle_rating(self)
+        self._participant_status = self.status
+    # --- END Participant sync ---
+
     def get_player_role(self, user):
         """Returns 'player1' or 'player2' if the user is in this battle, else None."""
         if user == self.player1:
@@ -278,6 +394,67 @@ class Battle(models.Model):
     #     from .battle_logic import resolve_battle_turn # Avoid circular import
     #     resolve_battle_turn(self)
 
+# --- NEW: Battle Archive ---
+class BattleArchive(models.Model):
+    """Compressed log and per-player state of an archived (old, finished) battle.
+
+    The Battle row stays as a summary (players, winner, final HP, timestamps) with
+    `is_archived` set and its JSON state emptied. The log is stored as zlib-compressed
+    JSON lines, one entry per line, so it can be decoded as a stream; `turn_offsets[n]`
+    is the index of the first entry of turn n + 1.
+    """
+    battle = models.OneToOneField(Battle, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    compression = models.CharField(max_length=10, default='zlib')
+    log_blob = models.BinaryField()
+    state_blob = models.BinaryField()
+    log_length = models.PositiveIntegerField(default=0)
+    turn_offsets = models.JSONField(default=list)
+    error_count = models.PositiveIntegerField(default=0, help_text="Log entries with effect_type 'error' (for the admin list).")
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def read_log(self):
+        from .archive import decode_log # Avoid circular import
+        return decode_log(self.log_blob, self.compression)
+
+    def iter_log(self, start=0):
+        """Yields log entries from index `start` on, decompressing incrementally."""
+        from .archive import iter_log_entries
+        return iter_log_entries(self.log_blob, self.compression, start)
+
+    def read_state(self):
+        from .archive import decode_state
+        return decode_state(self.state_blob, self.compression)
+
+    def __str__(self):
+        return f"Archive of Battle {self.battle_id} ({self.log_length} log entries)"
+# --- END Battle Archive ---
+
+# --- NEW: Battle Participants ---
+class BattleParticipant(models.Model):
+    """One row per player of a battle, mirroring the battle's status.
+
+    "Battles of user X with status S" is a range scan on (user, status) here instead of
+    an OR over Battle.player1/player2. Rows are written by Battle.save() (on create and
+    on every status change); code must not change Battle.status with queryset.update().
+    """
+    battle = models.ForeignKey(Battle, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='battle_participations', db_index=False) # Covered by the (user, status) index
+    opponent = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    role = models.CharField(max_length=10, choices=Battle.TURN_CHOICES)
+    status = models.CharField(max_length=10, choices=Battle.STATUS_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['battle', 'role'], name='unique_battle_participant_role'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status'], name='battle_participant_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} as {self.role} in Battle {self.battle_id} ({self.status})"
+# --- END Battle Participants ---
+
 # --- Through Models for Battle Attacks --- 
 class BattlePlayer1AttackSelection(models.Model):
     battle = models.ForeignKey(Battle, on_delete=models.CASCADE)
@@ -290,4 +467,107 @@ class BattlePlayer2AttackSelection(models.Model):
     battle = models.ForeignKey(Battle, on_delete=models.CASCADE)
     attack = models.ForeignKey(Attack, on_delete=models.CASCADE)
     class Meta:
-        unique_together = ('battle', 'attack')
\ No newline at end of file
+        unique_together = ('battle', 'attack')
+# --- NEW: Battle Stats Outbox ---
+class BattleStatsOutbox(models.Model):
+    """A finished battle waiting for its statistics to be applied.
+
+    Rows are written when a battle finishes (BATTLE_STATS_ASYNC) and drained in
+    batches by `manage.py process_battle_stats`. One row per battle, and a row is
+    only marked processed in the same transaction that applies its increments,
+    so a battle is never counted twice. Forfeits are recorded as processed with
+    stats_applied=False: they finish the battle without any attack stats.
+    """
+    battle = models.OneToOneField(Battle, on_delete=models.CASCADE, related_name='stats_outbox')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    stats_applied = models.BooleanField(default=True, help_text="False for battles recorded without attack stats (forfeits).")
+
+    class Meta:
+        indexes = [
+            # Pending rows in arrival order: WHERE processed_at IS NULL ORDER BY created_at
+            models.Index(fields=['processed_at', 'created_at'], name='battle_stats_outbox_queue_idx'),
+        ]
+
+    def __str__(self):
+        state = 'processed' if self.processed_at else 'pending'
+        return f"Stats for Battle {self.battle_id} ({state})"
+# --- END Battle Stats Outbox ---
+
+# --- NEW: Attack Stats Recalculation Jobs ---
+class StatsRecalculationJob(models.Model):
+    """A full rebuild of AttackUsageStats/AttackCoUsage from battle logs.
+
+    Queued from the admin and run by `manage.py recalculate_attack_stats` (the stats
+    worker picks queued jobs up). Progress is checkpointed per shard, so an
+    interrupted job resumes where it stopped.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    shard_size = models.PositiveIntegerField(default=2000, help_text="Battle id range covered by each shard.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, help_text="Battles whose stats were applied after this are kept from the live counters.")
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Live counters when the job started: {'attacks': {id: {field: n}}, 'co_usage': {"a:b": n}}
+    baseline = models.JSONField(default=dict, blank=True)
+    battles_processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Stats recalculation #{self.pk} ({self.status})"
+
+
+class StatsRecalculationShard(models.Model):
+    """Battles with start_id <= id < end_id of a job; `partial` holds their aggregate once done."""
+    job = models.ForeignKey(StatsRecalculationJob, on_delete=models.CASCADE, related_name='shards')
+    start_id = models.PositiveIntegerField()
+    end_id = models.PositiveIntegerField()
+    partial = models.JSONField(null=True, blank=True)
+    battles_processed = models.PositiveIntegerField(default=0)
+    done_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'start_id'], name='unique_recalculation_shard'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.job_id} battles [{self.start_id}, {self.end_id})"
+# --- END Attack Stats Recalculation Jobs ---
+
+# --- NEW: Matchmaking ---
+class MatchmakingTicket(models.Model):
+    """A player's place in the matchmaking queue (see game/matchmaking.py).
+
+    The table is the source of truth shared by all workers; each pairing process
+    mirrors the waiting tickets in memory and claims pairs with row locks.
+    """
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('matched', 'Matched'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='matchmaking_ticket')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    skill = models.IntegerField(help_text="Pairing key at join time (the player's level).")
+    joined_at = models.DateTimeField()
+    matched_at = models.DateTimeField(null=True, blank=True)
+    battle = models.ForeignKey(Battle, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            # Pairing loop: WHERE status = 'waiting' (and the expiry scan by joined_at)
+            models.Index(fields=['status', 'joined_at'], name='matchmaking_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Matchmaking ticket of user {self.user_id} ({self.status})"
+# --- END Matchmaking ---
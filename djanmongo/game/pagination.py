@@ -0,0 +1,6 @@
+from users.pagination import KeysetPagination
+
+
+class AttackLeaderboardPagination(KeysetPagination):
+    """Attack leaderboard: most used first; the attack id (primary key) breaks ties."""
+    ordering = ('-times_used', 'attack_id')
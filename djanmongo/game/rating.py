@@ -0,0 +1,73 @@
+"""
+Elo skill rating (User.rating / User.rated_battles).
+
+A battle is rated when a human beat a human: finished, with a winner, and neither
+player AI-controlled. Ratings move in the transaction that finishes the battle
+(Battle.save calls apply_battle_rating), and `manage.py recompute_ratings` rebuilds
+them from the finished-battle history with the same rate() function.
+
+New players use RATING_K_PROVISIONAL for their first RATING_PROVISIONAL_BATTLES
+rated battles, RATING_K afterwards.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+
+def is_rated(battle):
+    return battle.status == 'finished' and battle.winner_id is not None and not battle.player2_is_ai_controlled and not battle.player1_is_ai_controlled
+
+
+def k_factor(rated_battles):
+    if rated_battles < settings.RATING_PROVISIONAL_BATTLES:
+        return settings.RATING_K_PROVISIONAL
+    return settings.RATING_K
+
+
+def expected_score(rating, opponent_rating):
+    return 1.0 / (1.0 + 10 ** ((opponent_rating - rating) / 400.0))
+
+
+def rate(winner_rating, winner_battles, loser_rating, loser_battles):
+    """New (winner_rating, loser_rating) after one rated battle."""
+    expected = expected_score(winner_rating, loser_rating)
+    return (
+        winner_rating + k_factor(winner_battles) * (1.0 - expected),
+        loser_rating - k_factor(loser_battles) * (1.0 - expected),
+    )
+
+
+def apply_battle_rating(battle):
+    """Updates both players' ratings for a battle that just finished. Must run inside the
+    transaction that saves the finished battle; the player rows are locked (in pk order,
+    so concurrent finishes cannot deadlock) and re-read before rating.
+    """
+    if not is_rated(battle):
+        return
+    User = get_user_model()
+    loser_id = battle.player2_id if battle.winner_id == battle.player1_id else battle.player1_id
+    current = {
+        user_id: (rating, rated_battles)
+        for user_id, rating, rated_battles in User.objects.select_for_update()
+        .filter(pk__in=[battle.winner_id, loser_id]).order_by('pk')
+        .values_list('pk', 'rating', 'rated_battles')
+    }
+    if len(current) != 2:
+        return
+    (winner_rating, winner_battles), (loser_rating, loser_battles) = current[battle.winner_id], current[loser_id]
+    new_winner_rating, new_loser_rating = rate(winner_rating, winner_battles, loser_rating, loser_battles)
+
+    # update() keeps updated_at (player card versions) untouched
+    User.objects.filter(pk=battle.winner_id).update(rating=new_winner_rating, rated_battles=winner_battles + 1)
+    User.objects.filter(pk=loser_id).update(rating=new_loser_rating, rated_battles=loser_battles + 1)
+
+    # Keep loaded player objects consistent with their rows
+    for field in ('player1', 'player2'):
+        if not battle._meta.get_field(field).is_cached(battle):
+            continue # Not loaded: nothing to refresh, and no query just for that
+        player = getattr(battle, field)
+        if player.pk == battle.winner_id:
+            player.rating, player.rated_battles = new_winner_rating, winner_battles + 1
+        else:
+            player.rating, player.rated_battles = new_loser_rating, loser_battles + 1
+    print(f"[Battle {battle.id}] Ratings: winner {winner_rating:.0f} -> {new_winner_rating:.0f}, loser {loser_rating:.0f} -> {new_loser_rating:.0f}.")
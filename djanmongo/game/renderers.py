@@ -0,0 +1,91 @@
+"""
+Fast renderers/parsers for the game API (opt-in per view via GAME_RENDERER_CLASSES / GAME_PARSER_CLASSES).
+
+- ORJSONRenderer / ORJSONParser: same `application/json` wire format as DRF's, encoded
+  with orjson. Without orjson installed they behave exactly like DRF's JSON classes.
+- MessagePackRenderer / MessagePackParser: `application/msgpack`, chosen by clients with
+  `Accept: application/msgpack` (and `Content-Type` for requests). Only offered when
+  msgpack is installed.
+
+Compare them with `manage.py benchmark_renderers`.
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, FormParser, JSONParser, MultiPartParser
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _encoder_default():
+    # Same fallbacks as DRF's JSON encoder (dates, decimals, UUIDs, lazy strings, querysets...)
+    return encoders.JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer encoded with orjson (falls back to the stock renderer without it)."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        options = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_encoder_default(), option=options)
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser decoded with orjson (falls back to the stock parser without it)."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        default = _encoder_default()
+        return msgpack.packb(data, default=default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
+
+
+# JSON first: it stays the default for clients sending `Accept: */*` (or nothing).
+# The browsable API and form parsers are kept as in DRF's defaults.
+GAME_RENDERER_CLASSES = [ORJSONRenderer]
+GAME_PARSER_CLASSES = [ORJSONParser]
+if msgpack is not None:
+    GAME_RENDERER_CLASSES.append(MessagePackRenderer)
+    GAME_PARSER_CLASSES.append(MessagePackParser)
+GAME_RENDERER_CLASSES.append(BrowsableAPIRenderer)
+GAME_PARSER_CLASSES += [FormParser, MultiPartParser]
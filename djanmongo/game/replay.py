@@ -0,0 +1,99 @@
+"""
+NDJSON battle replays (served by BattleReplayView).
+
+The first line describes the battle, every following line is one log entry:
+
+    {"type": "battle", "id": 7, "player1": {...}, "player2": {...}, "winner": {...}, "status": "finished",
+     "turns": 12, "log_length": 80, "from_turn": 5, "from_index": 31}
+    {"type": "event", "index": 31, "turn": 5, "entry": {"source": "system", "effect_type": "turnchange", ...}}
+
+`?from_turn=N` seeks with the turn offsets (stored on the archive, computed for live
+battles), so earlier entries are skipped without being encoded or sent. Archived logs
+are decompressed chunk by chunk while the response streams.
+
+Live battles are not streamed from the database: their log is one JSON column, read
+whole into memory (the turn offsets need every entry anyway) and only the encoding is
+lazy. Their size is checked in the database first (see with_live_log_size) and logs over
+BATTLE_REPLAY_MAX_LIVE_LOG_BYTES are refused until the battle is archived.
+"""
+
+import json
+from bisect import bisect_right
+from itertools import islice
+
+from django.db.models import TextField
+from django.db.models.functions import Cast, Length
+
+from .archive import turn_start_indices
+from .models import Battle, BattleArchive
+from .renderers import orjson
+from .serializers import battle_player_ref
+
+LINES_PER_CHUNK = 100 # Log entries per chunk written to the response
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def with_live_log_size(queryset):
+    """Annotates `live_log_bytes`, the size of the live log column, computed by the database."""
+    return queryset.annotate(live_log_bytes=Length(Cast('last_turn_summary', TextField())))
+
+
+class BattleLogSource:
+    """Log length, turn offsets and an entry iterator for a live or archived battle.
+    Archived logs are read incrementally; a live log is loaded whole.
+    """
+
+    def __init__(self, battle):
+        if battle.is_archived:
+            archive = BattleArchive.objects.only('battle_id', 'compression', 'log_blob', 'log_length', 'turn_offsets').get(battle_id=battle.pk)
+            self.length = archive.log_length
+            self.turn_offsets = archive.turn_offsets or [0]
+            self._iter = archive.iter_log
+        else:
+            # The live log is one JSON column, loaded whole (the caller checked its size); entries are encoded lazily
+            log = Battle.objects.filter(pk=battle.pk).values_list('last_turn_summary', flat=True).first()
+            log = log if isinstance(log, list) else []
+            self.length = len(log)
+            self.turn_offsets = turn_start_indices(log)
+            self._iter = lambda start: islice(log, start, None)
+
+    def start_index(self, from_turn):
+        if from_turn <= len(self.turn_offsets):
+            return self.turn_offsets[from_turn - 1]
+        return self.length
+
+    def entries(self, start):
+        return self._iter(start)
+
+
+def replay_lines(battle, source, from_turn=1):
+    """Yields the NDJSON replay of a battle in chunks of LINES_PER_CHUNK entries."""
+    start = source.start_index(from_turn)
+    header = {
+        'type': 'battle',
+        'id': battle.pk,
+        'player1': battle_player_ref(battle.player1),
+        'player2': battle_player_ref(battle.player2),
+        'winner': battle_player_ref(battle.winner),
+        'status': battle.status,
+        'turns': len(source.turn_offsets),
+        'log_length': source.length,
+        'from_turn': from_turn,
+        'from_index': start,
+    }
+    yield _dumps(header) + b'\n'
+
+    chunk = []
+    for index, entry in enumerate(source.entries(start), start):
+        turn = bisect_right(source.turn_offsets, index)
+        chunk.append(_dumps({'type': 'event', 'index': index, 'turn': turn, 'entry': entry}))
+        if len(chunk) >= LINES_PER_CHUNK:
+            yield b'\n'.join(chunk) + b'\n'
+            chunk = []
+    if chunk:
+        yield b'\n'.join(chunk) + b'\n'
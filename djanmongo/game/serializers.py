@@ -1,8 +1,11 @@
+import copy
 from rest_framework import serializers
-from .models import Attack, Battle, AttackUsageStats, Script
-from users.serializers import UserSerializer, BasicUserSerializer
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Attack, Battle, AttackUsageStats, AttackCoUsage, Script, MatchmakingTicket
+from users.serializers import BasicUserSerializer
 from .logic import calculate_momentum_cost_range
-import collections # For sorting co-used attacks
 
 class AttackSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,10 +27,37 @@ class BattleRespondSerializer(serializers.Serializer):
 class BattleActionSerializer(serializers.Serializer):
     attack_id = serializers.IntegerField(required=True)
 
+class AutoBattleRequestSerializer(serializers.Serializer):
+    opponent_id = serializers.IntegerField(required=True)
+    runs = serializers.IntegerField(required=False, default=1, min_value=1, help_text="Matches to play (at most AUTO_BATTLE_MAX_RUNS).")
+    persist = serializers.BooleanField(required=False, default=False, help_text="Save the played matches. Otherwise they are only simulated.")
+    seed = serializers.IntegerField(required=False, default=None, min_value=0, max_value=2 ** 32 - 1,
+                                    help_text="RNG seed of a simulation; the same seed returns the same (cached) matches.")
+
+    def validate_runs(self, value):
+        if value > settings.AUTO_BATTLE_MAX_RUNS:
+            raise serializers.ValidationError(f"At most {settings.AUTO_BATTLE_MAX_RUNS} runs per request.")
+        return value
+
+def battle_player_ref(user):
+    """Minimal player reference for battle payloads; the full card comes from PlayerCardView."""
+    if user is None:
+        return None
+    return {'id': user.id, 'username': user.username, 'card_version': user.card_version}
+
 class BattleSerializer(serializers.ModelSerializer):
-    player1 = UserSerializer(read_only=True)
-    player2 = UserSerializer(read_only=True)
-    winner = BasicUserSerializer(read_only=True)
+    """Lean battle state, sized for polling.
+
+    Players are references ({id, username, card_version}); clients fetch the (cacheable)
+    player card from /api/users/<id>/card/?v=<card_version> and only refetch it when the
+    version changes. The battle log is sent as a window: `log` holds the entries from
+    `log_offset` on, `log_length` is the full length. Pass `?log_from=<n>` to get the
+    entries from n (clients send the length they already have); without it, the last
+    BATTLE_STATE_LOG_TAIL entries are sent.
+    """
+    player1 = serializers.SerializerMethodField()
+    player2 = serializers.SerializerMethodField()
+    winner = serializers.SerializerMethodField()
     
     my_selected_attacks = serializers.SerializerMethodField()
     detailed_registered_scripts = serializers.SerializerMethodField()
@@ -39,14 +69,44 @@ class BattleSerializer(serializers.ModelSerializer):
             'current_hp_player1', 'current_hp_player2',
             'stat_stages_player1', 'stat_stages_player2',
             'custom_statuses_player1', 'custom_statuses_player2',
-            'last_turn_summary',
             'detailed_registered_scripts',
             'current_momentum_player1', 'current_momentum_player2', 'whose_turn',
             'my_selected_attacks',
-            'player2_is_ai_controlled',
+            'player1_is_ai_controlled', 'player2_is_ai_controlled',
             'updated_at'
         )
         read_only_fields = fields
+
+    def get_player1(self, battle_instance):
+        return battle_player_ref(battle_instance.player1)
+
+    def get_player2(self, battle_instance):
+        return battle_player_ref(battle_instance.player2)
+
+    def get_winner(self, battle_instance):
+        return battle_player_ref(battle_instance.winner)
+
+    def _log_from(self):
+        if self.context.get('log_from') is not None:
+            return self.context['log_from']
+        request = self.context.get('request')
+        raw = request.query_params.get('log_from') if request is not None and hasattr(request, 'query_params') else None
+        try:
+            return max(0, int(raw)) if raw is not None else None
+        except ValueError:
+            return None
+
+    def to_representation(self, battle_instance):
+        battle_instance.load_archived_state() # No-op unless the battle was archived
+        data = super().to_representation(battle_instance)
+        log = battle_instance.last_turn_summary if isinstance(battle_instance.last_turn_summary, list) else []
+        log_from = self._log_from()
+        if log_from is None or log_from > len(log):
+            log_from = max(0, len(log) - settings.BATTLE_STATE_LOG_TAIL)
+        data['log'] = log[log_from:]
+        data['log_offset'] = log_from
+        data['log_length'] = len(log)
+        return data
         
     def get_my_selected_attacks(self, battle_instance):
         """ 
@@ -139,6 +199,57 @@ class BattleSerializer(serializers.ModelSerializer):
                 
         return augmented_scripts
 
+# --- Battle deltas (BattleMultiActionView) ---
+# BattleSerializer keys and the Battle fields they are computed from
+BATTLE_DELTA_SOURCES = {
+    'status': ('status',),
+    'winner': ('winner_id',),
+    'current_hp_player1': ('current_hp_player1',),
+    'current_hp_player2': ('current_hp_player2',),
+    'stat_stages_player1': ('stat_stages_player1',),
+    'stat_stages_player2': ('stat_stages_player2',),
+    'custom_statuses_player1': ('custom_statuses_player1',),
+    'custom_statuses_player2': ('custom_statuses_player2',),
+    'detailed_registered_scripts': ('registered_scripts',),
+    'current_momentum_player1': ('current_momentum_player1',),
+    'current_momentum_player2': ('current_momentum_player2',),
+    'whose_turn': ('whose_turn',),
+    'my_selected_attacks': ('whose_turn', 'stat_stages_player1', 'stat_stages_player2'), # Cost ranges
+}
+BATTLE_DELTA_ALWAYS = ('id', 'updated_at', 'log', 'log_offset', 'log_length')
+
+def battle_delta_snapshot(battle):
+    """Copies the fields BattleDeltaSerializer compares against (JSON fields are mutated in place)."""
+    fields = {field for sources in BATTLE_DELTA_SOURCES.values() for field in sources}
+    return {field: copy.deepcopy(getattr(battle, field)) for field in fields}
+
+class BattleDeltaSerializer(BattleSerializer):
+    """BattleSerializer output reduced to what changed since context['snapshot'] (from
+    battle_delta_snapshot()). The log window starts at context['log_from'], so `log`
+    holds just the new entries.
+    """
+    def to_representation(self, battle_instance):
+        data = super().to_representation(battle_instance)
+        snapshot = self.context['snapshot']
+        changed = {
+            key for key, sources in BATTLE_DELTA_SOURCES.items()
+            if any(snapshot[field] != getattr(battle_instance, field) for field in sources)
+        }
+        return {key: value for key, value in data.items() if key in changed or key in BATTLE_DELTA_ALWAYS}
+
+class BattleMultiActionSerializer(serializers.Serializer):
+    attack_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        help_text="Attacks to use in order, while it stays your turn (at most BATTLE_MAX_CHAINED_ACTIONS)."
+    )
+
+    def validate_attack_ids(self, value):
+        if len(value) > settings.BATTLE_MAX_CHAINED_ACTIONS:
+            raise serializers.ValidationError(f"At most {settings.BATTLE_MAX_CHAINED_ACTIONS} actions per request.")
+        return value
+# --- END Battle deltas ---
+
 class BattleListSerializer(serializers.ModelSerializer):
     """Simplified serializer for listing battles/requests."""
     player1 = BasicUserSerializer(read_only=True)
@@ -148,6 +259,13 @@ class BattleListSerializer(serializers.ModelSerializer):
         model = Battle
         fields = ('id', 'player1', 'player2', 'status', 'created_at')
 
+class MatchmakingTicketSerializer(serializers.ModelSerializer):
+    """The requester's matchmaking state; `battle` is set once matched."""
+    class Meta:
+        model = MatchmakingTicket
+        fields = ('status', 'skill', 'joined_at', 'matched_at', 'battle')
+        read_only_fields = fields
+
 # --- Attack Generation Serializer ---
 class GenerateAttackRequestSerializer(serializers.Serializer):
     concept = serializers.CharField(max_length=50, required=True, help_text="Short concept (max 50 chars) to guide attack generation.")
@@ -206,8 +324,6 @@ class AttackLeaderboardSerializer(serializers.ModelSerializer):
             'win_rate_vs_bot',
             'damage_per_use',
             'top_co_used_attacks',
-            # Exclude raw co-used counts unless needed directly
-            # 'co_used_with_counts',
         )
         read_only_fields = fields # Make all fields read-only
 
@@ -231,31 +347,36 @@ class AttackLeaderboardSerializer(serializers.ModelSerializer):
         # Ensure division by zero is handled, though times_used should be > 0 if damage exists
         return round(obj.total_damage_dealt / obj.times_used) if obj.times_used > 0 else 0
 
-    def get_top_co_used_attacks(self, obj):
-        if not isinstance(obj.co_used_with_counts, dict) or not obj.co_used_with_counts:
-            return []
+    @staticmethod
+    def build_co_used_attack_lookup(stats_rows, limit=3):
+        """Fetches {attack_id: [{'id', 'name', 'emoji'}, ...]} with the top `limit` co-used attacks
+           of every row in one query (ranked per attack over the (attack_a, -count) index).
+           Views pass the result as context['co_used_attack_lookup'].
+        """
+        attack_ids = [row.attack_id for row in stats_rows]
+        if not attack_ids:
+            return {}
+        top_rows = (
+            AttackCoUsage.objects
+            .filter(attack_a_id__in=attack_ids, count__gt=0)
+            .annotate(rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('attack_a_id')],
+                order_by=[F('count').desc(), F('attack_b_id').asc()],
+            ))
+            .filter(rank__lte=limit)
+            .order_by('attack_a_id', 'rank')
+            .values_list('attack_a_id', 'attack_b_id', 'attack_b__name', 'attack_b__emoji')
+        )
+        lookup = {}
+        for attack_a_id, attack_b_id, name, emoji in top_rows:
+            lookup.setdefault(attack_a_id, []).append({'id': attack_b_id, 'name': name, 'emoji': emoji})
+        return lookup
 
-        # Sort co-used attacks by count descending
-        sorted_counts = sorted(obj.co_used_with_counts.items(), key=lambda item: item[1], reverse=True)
-
-        # Get top 3 attack IDs
-        top_ids = [int(attack_id_str) for attack_id_str, count in sorted_counts[:3]]
-
-        # Fetch basic details for these top attacks (reduces extra DB hits per row)
-        # This relies on having fetched these attacks somewhere accessible,
-        # maybe via a context passed to the serializer or a prefetched list.
-        # Simple approach (less efficient): Fetch here
-        top_attacks_qs = Attack.objects.filter(id__in=top_ids).values('id', 'name', 'emoji')
-        top_attacks_dict = {a['id']: a for a in top_attacks_qs}
-
-        # Return basic info, ordered by original count
-        result = []
-        for attack_id in top_ids:
-            attack_info = top_attacks_dict.get(attack_id)
-            if attack_info:
-                result.append({
-                    'id': attack_info['id'],
-                    'name': attack_info['name'],
-                    'emoji': attack_info['emoji']
-                })
-        return result
+    def get_top_co_used_attacks(self, obj):
+        top_attacks_lookup = self.context.get('co_used_attack_lookup')
+        if top_attacks_lookup is None:
+            # Serialized outside a view that prepared the lookup: fall back to a query for this row
+            top_attacks_lookup = self.build_co_used_attack_lookup([obj])
+        # Already ordered by count descending
+        return top_attacks_lookup.get(obj.attack_id, [])
@@ -0,0 +1,233 @@
+# djanmongo/game/stats_recalculation.py
+
+"""
+Rebuilds AttackUsageStats and AttackCoUsage from the logs of every finished battle.
+
+A StatsRecalculationJob splits the battle table into id-range shards. Shards are
+aggregated independently (in a multiprocessing pool when several workers are
+requested) and each one checkpoints its partial aggregate in its row, so a job that
+dies half way resumes with the remaining shards only. The partials are merged in
+memory and written with bulk_update.
+
+The live counters keep moving while a job runs. The job therefore only recomputes
+battles whose stats had been applied before it started, remembers the counters it
+saw at that moment (`baseline`), and writes `live + recomputed - baseline`. Battles
+applied in the meantime are kept, not lost or counted twice. The baseline is taken under
+the exclusive stats_apply_lock(), so no flush can be half way (counters updated and
+processed_at stamped, but not committed) while it is read. Only battles whose outbox
+row says their stats were applied are recomputed: forfeits (recorded without stats) and
+battles never recorded are skipped, as the live path skips them. Migrations 0042/0043
+recorded the battles that finished before the outbox existed.
+"""
+
+import multiprocessing
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .battle_stats import BATTLE_STATS_FIELDS, BattleStatsBatch, stats_apply_lock
+from .models import (Attack, AttackCoUsage, AttackUsageStats, Battle,
+                     StatsRecalculationJob, StatsRecalculationShard)
+
+ATTACK_STAT_FIELDS = (
+    'times_used', 'wins_vs_human', 'losses_vs_human', 'wins_vs_bot', 'losses_vs_bot',
+    'total_damage_dealt', 'total_healing_done',
+)
+ACTIVE_JOB_STATUSES = ('queued', 'running')
+BATTLE_CHUNK_SIZE = 200 # Battles parsed per attack-resolution query
+WRITE_BATCH_SIZE = 500
+
+
+def _pair_key(a, b):
+    return f"{a}:{b}"
+
+
+def queue_recalculation_job(requested_by=None):
+    """Returns the queued/running job, or queues a new one. Returns (job, created)."""
+    with transaction.atomic():
+        job = StatsRecalculationJob.objects.select_for_update().filter(status__in=ACTIVE_JOB_STATUSES).order_by('created_at').first()
+        if job:
+            return job, False
+        job = StatsRecalculationJob.objects.create(
+            requested_by=requested_by,
+            shard_size=settings.STATS_RECALCULATION_SHARD_SIZE,
+        )
+        return job, True
+
+
+# --- Phase 1: snapshot and sharding ---
+
+def start_job(job):
+    """Takes the baseline and creates the shards. Does nothing for a job that already started (resume)."""
+    if job.started_at:
+        return
+    with transaction.atomic():
+        # Waits for in-flight stats transactions and holds new ones off until the job row is saved
+        stats_apply_lock(exclusive=True)
+        baseline = {
+            'attacks': {
+                str(row['attack_id']): {field: row[field] for field in ATTACK_STAT_FIELDS}
+                for row in AttackUsageStats.objects.values('attack_id', *ATTACK_STAT_FIELDS).iterator()
+            },
+            'co_usage': {
+                _pair_key(a, b): count
+                for a, b, count in AttackCoUsage.objects.values_list('attack_a_id', 'attack_b_id', 'count').iterator()
+            },
+        }
+        # Taken after the baseline: anything applied before this instant is part of it
+        job.started_at = timezone.now()
+        job.baseline = baseline
+        job.status = 'running'
+        job.save(update_fields=['started_at', 'baseline', 'status'])
+
+        first_id = Battle.objects.filter(status='finished').order_by('id').values_list('id', flat=True).first()
+        last_id = Battle.objects.filter(status='finished').order_by('-id').values_list('id', flat=True).first()
+        if first_id is None:
+            return
+        shard_size = max(1, job.shard_size)
+        StatsRecalculationShard.objects.bulk_create([
+            StatsRecalculationShard(job=job, start_id=start_id, end_id=min(start_id + shard_size, last_id + 1))
+            for start_id in range(first_id, last_id + 1, shard_size)
+        ])
+
+
+# --- Phase 2: shard aggregation (runs in pool workers) ---
+
+def compute_shard(shard_id):
+    """Aggregates one shard and checkpoints the result. Top-level so the pool can pickle it.
+       Returns (shard_id, battles_processed).
+    """
+    shard = StatsRecalculationShard.objects.select_related('job').get(pk=shard_id)
+    if shard.done_at:
+        return shard.pk, shard.battles_processed
+
+    battles = (
+        Battle.objects
+        .filter(status='finished', player1_is_ai_controlled=False, id__gte=shard.start_id, id__lt=shard.end_id)
+        # Exactly the battles the live path applied before the baseline; later ones stay in
+        # the live counters. Battles without an outbox row (never applied) are left out.
+        .filter(stats_outbox__stats_applied=True, stats_outbox__processed_at__lt=shard.job.started_at)
+        .only(*BATTLE_STATS_FIELDS)
+        .order_by('id')
+    )
+    batch = BattleStatsBatch()
+    chunk = []
+    for battle in battles.iterator(chunk_size=BATTLE_CHUNK_SIZE):
+        chunk.append(battle)
+        if len(chunk) >= BATTLE_CHUNK_SIZE:
+            batch.add_battles(chunk)
+            chunk = []
+    if chunk:
+        batch.add_battles(chunk)
+
+    shard.partial = {
+        'attacks': {str(attack_id): dict(increments) for attack_id, increments in batch.attack_increments.items()},
+        'co_usage': {_pair_key(a, b): n for (a, b), n in batch.co_usage_pairs.items()},
+    }
+    shard.battles_processed = batch.battle_count
+    shard.done_at = timezone.now()
+    shard.save(update_fields=['partial', 'battles_processed', 'done_at'])
+    return shard.pk, shard.battles_processed
+
+
+def _compute_shards(shard_ids, workers, report):
+    if workers <= 1 or len(shard_ids) <= 1:
+        for shard_id in shard_ids:
+            report(*compute_shard(shard_id))
+        return
+    # Forked children must not share the parent's database connections
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(processes=min(workers, len(shard_ids))) as pool:
+        for shard_id, battles_processed in pool.imap_unordered(compute_shard, shard_ids):
+            report(shard_id, battles_processed)
+
+
+# --- Phase 3: merge and write ---
+
+def _merge_partials(job):
+    attack_totals, co_usage_totals, battles_processed = {}, {}, 0
+    for partial, shard_battles in job.shards.filter(done_at__isnull=False).values_list('partial', 'battles_processed').iterator():
+        battles_processed += shard_battles
+        for attack_id, increments in (partial or {}).get('attacks', {}).items():
+            totals = attack_totals.setdefault(int(attack_id), dict.fromkeys(ATTACK_STAT_FIELDS, 0))
+            for field, n in increments.items():
+                totals[field] = totals.get(field, 0) + n
+        for pair, n in (partial or {}).get('co_usage', {}).items():
+            co_usage_totals[pair] = co_usage_totals.get(pair, 0) + n
+    return attack_totals, co_usage_totals, battles_processed
+
+
+@transaction.atomic
+def finalize_job(job):
+    """Merges every shard partial and writes live + recomputed - baseline with bulk_update."""
+    from users.pagination import bump_leaderboard_cache_version
+
+    attack_totals, co_usage_totals, battles_processed = _merge_partials(job)
+    baseline_attacks = job.baseline.get('attacks', {})
+    baseline_co_usage = job.baseline.get('co_usage', {})
+    existing_attack_ids = set(Attack.objects.values_list('id', flat=True))
+
+    # --- Attack usage stats ---
+    AttackUsageStats.objects.bulk_create(
+        [AttackUsageStats(attack_id=attack_id) for attack_id in attack_totals if attack_id in existing_attack_ids],
+        ignore_conflicts=True,
+    )
+    changed_stats = []
+    for stats in AttackUsageStats.objects.only('attack_id').iterator():
+        totals = attack_totals.get(stats.attack_id, {})
+        base = baseline_attacks.get(str(stats.attack_id), {})
+        changed = False
+        for field in ATTACK_STAT_FIELDS:
+            delta = totals.get(field, 0) - base.get(field, 0)
+            setattr(stats, field, F(field) + delta)
+            changed = changed or delta != 0
+        if changed:
+            changed_stats.append(stats)
+    AttackUsageStats.objects.bulk_update(changed_stats, ATTACK_STAT_FIELDS, batch_size=WRITE_BATCH_SIZE)
+
+    # --- Co-usage ---
+    missing_pairs = []
+    for pair in co_usage_totals:
+        a, b = (int(x) for x in pair.split(':'))
+        if a in existing_attack_ids and b in existing_attack_ids:
+            missing_pairs.append(AttackCoUsage(attack_a_id=a, attack_b_id=b, count=0))
+    AttackCoUsage.objects.bulk_create(missing_pairs, ignore_conflicts=True)
+    changed_pairs = []
+    for row in AttackCoUsage.objects.only('id', 'attack_a_id', 'attack_b_id').iterator():
+        pair = _pair_key(row.attack_a_id, row.attack_b_id)
+        delta = co_usage_totals.get(pair, 0) - baseline_co_usage.get(pair, 0)
+        if delta:
+            row.count = F('count') + delta
+            changed_pairs.append(row)
+    AttackCoUsage.objects.bulk_update(changed_pairs, ['count'], batch_size=WRITE_BATCH_SIZE)
+
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.battles_processed = battles_processed
+    job.baseline = {} # Not needed any more; can be large
+    job.error = ''
+    job.save(update_fields=['status', 'finished_at', 'battles_processed', 'baseline', 'error'])
+    transaction.on_commit(bump_leaderboard_cache_version)
+    return len(changed_stats), len(changed_pairs)
+
+
+def run_recalculation_job(job, workers=1, report=print):
+    """Runs (or resumes) a job to completion. Marks it failed and re-raises on error."""
+    try:
+        start_job(job)
+        pending_ids = list(job.shards.filter(done_at__isnull=True).order_by('start_id').values_list('id', flat=True))
+        total_shards = job.shards.count()
+        report(f"[Stats Recalculation] Job {job.pk}: {total_shards - len(pending_ids)}/{total_shards} shards already done, {len(pending_ids)} to go ({workers} workers).")
+
+        def report_shard(shard_id, battles_processed):
+            report(f"  [Stats Recalculation] Shard {shard_id} done: {battles_processed} battles.")
+
+        _compute_shards(pending_ids, workers, report_shard)
+        stats_written, pairs_written = finalize_job(job)
+        report(f"[Stats Recalculation] Job {job.pk} done: {job.battles_processed} battles, "
+               f"{stats_written} stats rows and {pairs_written} co-usage rows updated.")
+    except Exception as e:
+        StatsRecalculationJob.objects.filter(pk=job.pk).update(status='failed', error=str(e))
+        raise
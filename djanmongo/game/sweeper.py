@@ -0,0 +1,86 @@
+"""
+Housekeeping for abandoned battles (run by `manage.py sweep_battles`).
+
+- Pending challenges older than PENDING_BATTLE_EXPIRY_MINUTES are deleted, whoever
+  they were sent to.
+- Active battles without any move for IDLE_BATTLE_FORFEIT_MINUTES are finished: the
+  player whose turn it is forfeits (see battle_logic.forfeit_battle).
+
+Both walk the (status, updated_at) index oldest first, in batches of at most
+`batch_size` battles, so a sweep never holds long locks or loads unbounded rows.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .battle_logic import forfeit_battle
+from .models import Battle
+
+
+def pending_expiry_cutoff(now=None):
+    """Pending challenges last updated before this are expired (also hidden from reads)."""
+    return (now or timezone.now()) - timedelta(minutes=settings.PENDING_BATTLE_EXPIRY_MINUTES)
+
+
+def expire_pending_battles(batch_size, now=None):
+    """Deletes one batch of expired pending challenges. Returns how many were deleted."""
+    cutoff = pending_expiry_cutoff(now)
+    ids = list(
+        Battle.objects.filter(status='pending', updated_at__lt=cutoff)
+        .order_by('updated_at')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+    # Re-check the status: a challenge accepted since the select must survive
+    _, deleted_per_model = Battle.objects.filter(id__in=ids, status='pending', updated_at__lt=cutoff).delete()
+    return deleted_per_model.get(Battle._meta.label, 0)
+
+
+def forfeit_idle_battles(batch_size, now=None):
+    """Finishes one batch of idle active battles. Returns how many were finished."""
+    cutoff = (now or timezone.now()) - timedelta(minutes=settings.IDLE_BATTLE_FORFEIT_MINUTES)
+    ids = list(
+        Battle.objects.filter(status='active', updated_at__lt=cutoff)
+        .order_by('updated_at')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    finished = 0
+    for battle_id in ids:
+        with transaction.atomic():
+            # skip_locked: a battle someone is acting on right now is not idle
+            battle = (
+                Battle.objects.select_for_update(skip_locked=True)
+                .filter(pk=battle_id, status='active', updated_at__lt=cutoff)
+                .select_related('player1', 'player2')
+                .first()
+            )
+            if battle is None:
+                continue
+            loser = getattr(battle, battle.whose_turn) if battle.whose_turn else None
+            if loser is not None:
+                reason = f"{loser.username} forfeited after {settings.IDLE_BATTLE_FORFEIT_MINUTES} minutes of inactivity."
+            else:
+                reason = "Battle abandoned after inactivity."
+            forfeit_battle(battle, loser, reason=reason)
+            finished += 1
+    return finished
+
+
+def sweep(batch_size, now=None):
+    """Drains both queues batch by batch. Returns (expired_pending, forfeited_active)."""
+    expired = forfeited = 0
+    while True:
+        count = expire_pending_battles(batch_size, now)
+        expired += count
+        if count < batch_size:
+            break
+    while True:
+        count = forfeit_idle_battles(batch_size, now)
+        forfeited += count
+        if count < batch_size:
+            break
+    return expired, forfeited
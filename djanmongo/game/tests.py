@@ -0,0 +1,529 @@
+import io
+import json
+import random
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from users.models import DEFAULT_RATING, User, UserBattleSummary
+
+from . import archive
+from .auto_battle import load_matchup, matchup_fingerprint, persist_auto_battle, play_auto_battle
+from .battle_logic import apply_attack, forfeit_battle, update_attack_stats_from_battle_log
+from .battle_stats import battle_stats_lag, flush_battle_stats_outbox
+from .logic import get_simulation_cache
+from .models import Attack, AttackCoUsage, AttackUsageStats, Battle, BattleParticipant, BattleStatsOutbox, Script
+from .stats_recalculation import ATTACK_STAT_FIELDS, queue_recalculation_job, run_recalculation_job
+
+
+def create_attack(name, creator=None, momentum_cost=20, power=40):
+    attack = Attack.objects.create(name=name, momentum_cost=momentum_cost, creator=creator)
+    # Announces the attack like generated scripts do; the stats parser attributes damage by that name
+    lua_code = f"log(get_player_name(ME_ROLE) .. ' used {name}!', 'action', ME_ROLE, {{attack_name='{name}'}})\napply_std_damage({power})"
+    Script.objects.create(name=f"{name} script", attack=attack, trigger_when='ON_USE', lua_code=lua_code)
+    return attack
+
+
+class BattleEndpointQueryCountTests(APITestCase):
+    """Pins the query count of the battle endpoints: it must not grow with the loadouts or the number of battles."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.attacks = [create_attack(f"Attack {i}", creator=cls.alice) for i in range(4)]
+        for user in (cls.alice, cls.bob):
+            user.attacks.set(cls.attacks)
+            user.selected_attacks.set(cls.attacks)
+
+        cls.battle = Battle.objects.create(player1=cls.alice, player2=cls.bob, status='active')
+        cls.battle.battle_attacks_player1.set(cls.attacks)
+        cls.battle.battle_attacks_player2.set(cls.attacks)
+        cls.battle.initialize_battle_state()
+
+        for i in range(3):
+            challenger = User.objects.create_user(f'challenger{i}', password='x')
+            Battle.objects.create(player1=challenger, player2=cls.alice, status='pending')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.alice)
+
+    def test_battle_detail(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/game/battles/{self.battle.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_active_battle(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/game/battles/active/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_battles(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/game/battles/requests/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+
+class AttackLeaderboardQueryCountTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        creator = User.objects.create_user('creator', password='x')
+        attacks = [create_attack(f"Attack {i}", creator=creator) for i in range(5)]
+        for i, attack in enumerate(attacks):
+            AttackUsageStats.objects.create(attack=attack, times_used=10 + i, wins_vs_human=i)
+        for a, b in zip(attacks, attacks[1:]):
+            AttackCoUsage.objects.create(attack_a=a, attack_b=b, count=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_attack_leaderboard(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/game/leaderboard/attacks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_attack_leaderboard_cached_page(self):
+        self.client.get('/api/game/leaderboard/attacks/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/game/leaderboard/attacks/')
+        self.assertEqual(response.status_code, 200)
+
+
+class BattleReplayTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.battle = Battle.objects.create(player1=cls.alice, player2=cls.bob, status='finished', winner=cls.alice, last_turn_summary=[
+            {"source": "system", "text": "Turn 1", "effect_type": "turnchange"},
+            {"source": "player1", "text": "alice attacks", "effect_type": "action"},
+            {"source": "system", "text": "Turn 2", "effect_type": "turnchange"},
+        ])
+
+    def setUp(self):
+        self.client.force_authenticate(self.alice)
+
+    def replay_lines(self, **params):
+        response = self.client.get(f'/api/game/battles/{self.battle.pk}/replay/', params)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_live_replay(self):
+        header, *events = self.replay_lines()
+        self.assertEqual(header['log_length'], 3)
+        self.assertEqual([event['index'] for event in events], [0, 1, 2])
+
+    @override_settings(BATTLE_REPLAY_MAX_LIVE_LOG_BYTES=10)
+    def test_oversized_live_log_is_refused(self):
+        response = self.client.get(f'/api/game/battles/{self.battle.pk}/replay/')
+        self.assertEqual(response.status_code, 413)
+
+    def test_archived_replay_matches_live(self):
+        live = self.replay_lines(from_turn=2)
+        self.assertTrue(archive.archive_battle(self.battle.pk))
+        self.assertEqual(self.replay_lines(from_turn=2), live)
+
+
+class BattleArchiveTests(TestCase):
+    """Archived battles read back exactly as they finished."""
+
+    log = [
+        {"source": "system", "text": "Battle started!", "effect_type": "info"},
+        {"source": "player1", "text": "alice uses Écrasement ⚡", "effect_type": "action", "attack_name": "Écrasement"},
+        {"source": "system", "text": "Turn 2: It is now bob's turn!", "effect_type": "turnchange"},
+        {"source": "player2", "text": "bob fails", "effect_type": "error", "details": {"nested": [1, None]}},
+    ]
+
+    def test_codec_round_trip(self):
+        blob = archive.encode_log(self.log)
+        self.assertEqual(archive.decode_log(blob), self.log)
+        self.assertEqual(list(archive.iter_log_entries(blob, start=2)), self.log[2:])
+        self.assertEqual(archive.decode_log(archive.encode_log([])), [])
+        # Entries split across decompression chunks must still come out whole
+        with mock.patch.object(archive, 'DECOMPRESS_CHUNK_SIZE', 7):
+            self.assertEqual(list(archive.iter_log_entries(blob, start=1)), self.log[1:])
+
+    def test_archived_battle_reads_back(self):
+        alice = User.objects.create_user('alice', password='x')
+        bob = User.objects.create_user('bob', password='x')
+        battle = Battle.objects.create(player1=alice, player2=bob, status='finished', winner=alice, last_turn_summary=self.log)
+        Battle.objects.filter(pk=battle.pk).update(stat_stages_player1={'attack': 2}, custom_statuses_player2={'burn': {'turns': 1}})
+        self.assertTrue(archive.archive_battle(battle.pk))
+        self.assertFalse(archive.archive_battle(battle.pk)) # Already archived
+
+        battle = Battle.objects.get(pk=battle.pk)
+        self.assertTrue(battle.is_archived)
+        self.assertEqual(battle.last_turn_summary, [])
+        self.assertEqual(battle.archive.turn_offsets, [0, 2])
+        self.assertEqual(battle.archive.error_count, 1)
+        self.assertEqual(battle.get_log(), self.log)
+        battle.load_archived_state()
+        self.assertEqual(battle.stat_stages_player1, {'attack': 2})
+        self.assertEqual(battle.custom_statuses_player2, {'burn': {'turns': 1}})
+        self.assertEqual(battle.last_turn_summary, self.log)
+
+
+class BattleActionQueryCountTests(APITestCase):
+    """Pins the query count of the action endpoints (their timing_budget is these plus a small margin)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.attack = create_attack("Strike")
+        cls.cheap = [create_attack(f"Jab {i}", momentum_cost=1, power=5) for i in range(3)]
+        for user in (cls.alice, cls.bob):
+            user.attacks.set([cls.attack, *cls.cheap])
+            user.selected_attacks.set([cls.attack, *cls.cheap])
+
+    def setUp(self):
+        # Momentum costs and damage are rolled; a fixed seed keeps the number of moves per request fixed
+        random.seed(0)
+        self.client.force_authenticate(self.alice)
+
+    def start_battle(self, ai=False, **state):
+        battle = Battle.objects.create(player1=self.alice, player2=self.bob, status='active', player2_is_ai_controlled=ai)
+        battle.initialize_battle_state()
+        if state:
+            Battle.objects.filter(pk=battle.pk).update(**state)
+        return battle
+
+    def act(self, battle, attack):
+        return self.client.post(f'/api/game/battles/{battle.pk}/action/', {'attack_id': attack.pk}, format='json')
+
+    def act_chain(self, battle, attacks):
+        return self.client.post(f'/api/game/battles/{battle.pk}/actions/', {'attack_ids': [a.pk for a in attacks]}, format='json')
+
+    def test_action(self):
+        battle = self.start_battle()
+        with self.assertNumQueries(8):
+            response = self.act(battle, self.attack)
+        self.assertEqual(response.status_code, 200)
+
+    def test_action_against_ai(self):
+        self.bob.selected_attacks.set([self.attack]) # One move, so the AI's pick is deterministic
+        battle = self.start_battle(ai=True)
+        with self.assertNumQueries(18):
+            response = self.act(battle, self.attack)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['battle_state']['whose_turn'], 'player1')
+
+    def test_action_finished_by_ai(self):
+        self.bob.selected_attacks.set([self.attack])
+        battle = self.start_battle(ai=True, current_hp_player1=1)
+        with self.assertNumQueries(37):
+            response = self.act(battle, self.attack)
+        self.assertEqual(response.json()['message'], "Battle finished!")
+
+    def test_budget_covers_session_middleware(self):
+        # With a real session the middleware adds its own queries; still within timing_budget
+        self.client.force_authenticate(None)
+        self.client.force_login(self.alice)
+        self.bob.selected_attacks.set([self.attack])
+        battle = self.start_battle(ai=True, current_hp_player1=1)
+        response = self.act(battle, self.attack)
+        self.assertEqual(response.status_code, 200)
+
+    def test_finishing_action(self):
+        battle = self.start_battle(current_hp_player2=1)
+        with self.assertNumQueries(35):
+            response = self.act(battle, self.attack)
+        self.assertEqual(response.json()['message'], "Battle finished!")
+
+    def test_action_chain(self):
+        battle = self.start_battle(current_momentum_player1=30)
+        with self.assertNumQueries(9):
+            response = self.act_chain(battle, self.cheap * 3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['applied']), 9)
+
+    def test_finishing_action_chain(self):
+        battle = self.start_battle(current_momentum_player1=30, current_hp_player2=1)
+        with self.assertNumQueries(36):
+            response = self.act_chain(battle, self.cheap)
+        self.assertEqual(response.json()['message'], "Battle finished!")
+
+
+class BattleMultiActionTests(APITestCase):
+    """The chain is applied in memory and written once, or not at all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.attack = create_attack("Strike")
+        cls.cheap = [create_attack(f"Jab {i}", momentum_cost=1, power=5) for i in range(3)]
+        for user in (cls.alice, cls.bob):
+            user.attacks.set([cls.attack, *cls.cheap])
+            user.selected_attacks.set([cls.attack, *cls.cheap])
+
+    def setUp(self):
+        random.seed(0)
+        self.client.force_authenticate(self.alice)
+        self.battle = Battle.objects.create(player1=self.alice, player2=self.bob, status='active')
+        self.battle.initialize_battle_state()
+
+    def act_chain(self, attacks):
+        return self.client.post(f'/api/game/battles/{self.battle.pk}/actions/', {'attack_ids': [a.pk for a in attacks]}, format='json')
+
+    def battle_row(self):
+        return Battle.objects.filter(pk=self.battle.pk).values(
+            'whose_turn', 'current_hp_player1', 'current_hp_player2', 'current_momentum_player1', 'current_momentum_player2', 'last_turn_summary'
+        ).get()
+
+    def test_chain_stops_when_the_turn_passes(self):
+        # No momentum to spend: the first attack overflows and hands the turn over
+        chain = [self.attack, *self.cheap[:2]]
+        log_from = len(self.battle_row()['last_turn_summary'])
+        response = self.act_chain(chain)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['applied'], [self.attack.pk])
+        self.assertEqual(body['skipped'], [attack.pk for attack in self.cheap[:2]])
+
+        row = self.battle_row()
+        self.assertEqual(row['whose_turn'], 'player2')
+        delta = body['delta']
+        self.assertEqual(delta['whose_turn'], 'player2')
+        self.assertEqual(delta['current_hp_player2'], row['current_hp_player2'])
+        self.assertNotIn('current_hp_player1', delta) # Unchanged, so left out
+        self.assertEqual(delta['log'], row['last_turn_summary'][log_from:])
+
+    def test_invalid_ids_leave_the_battle_unchanged(self):
+        before = self.battle_row()
+        response = self.client.post(f'/api/game/battles/{self.battle.pk}/actions/', {'attack_ids': [self.cheap[0].pk, 0]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.battle_row(), before)
+
+    def test_failure_mid_chain_rolls_back(self):
+        Battle.objects.filter(pk=self.battle.pk).update(current_momentum_player1=30)
+        before = self.battle_row()
+        calls = []
+
+        def fail_on_second_call(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("Script failed")
+            return apply_attack(*args, **kwargs)
+
+        self.client.raise_request_exception = False
+        with mock.patch('game.views.apply_attack', side_effect=fail_on_second_call):
+            response = self.act_chain(self.cheap)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.battle_row(), before)
+        self.assertFalse(BattleStatsOutbox.objects.filter(battle=self.battle).exists())
+
+
+class AutoBattleSimulationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x', allow_bot_challenges=True)
+        attacks = [create_attack(f"Attack {i}") for i in range(3)]
+        for user in (cls.alice, cls.bob):
+            user.attacks.set(attacks)
+            user.selected_attacks.set(attacks)
+
+    def setUp(self):
+        get_simulation_cache().clear()
+        self.client.force_authenticate(self.alice)
+
+    def simulate(self, **params):
+        response = self.client.post('/api/game/battles/auto/', {'opponent_id': self.bob.pk, 'runs': 2, **params}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_seed_replays_the_same_matches(self):
+        first = self.simulate(seed=7)
+        self.assertEqual(first['seed'], 7)
+        self.assertEqual(self.simulate(seed=7), first) # From the cache
+        get_simulation_cache().clear()
+        self.assertEqual(self.simulate(seed=7), first) # Replayed from the seed
+
+    def test_unseeded_simulation_is_not_cached(self):
+        result = self.simulate()
+        self.assertIn('seed', result)
+        self.assertFalse(Battle.objects.exists())
+        self.assertEqual(get_simulation_cache().get(matchup_fingerprint(load_matchup(self.alice, self.bob), 2, settings.AUTO_BATTLE_MAX_ACTIONS, result['seed'])), None)
+
+    def test_persisted_auto_battles_stay_out_of_profile_totals(self):
+        random.seed(0)
+        matchup = load_matchup(self.alice, self.bob)
+        battles = [persist_auto_battle(play_auto_battle(matchup), matchup) for _ in range(3)]
+        self.assertTrue(any(battle.winner_id for battle in battles))
+        UserBattleSummary.rebuild_all()
+        for user in (self.alice, self.bob):
+            user.refresh_from_db()
+            self.assertEqual((user.get_total_wins(), user.get_total_losses(), user.get_total_rounds_played()), (0, 0, 0))
+            self.assertIsNone(user.get_nemesis())
+            self.assertEqual(user.rating, DEFAULT_RATING)
+        self.assertFalse(UserBattleSummary.objects.filter(rounds_played__gt=0).exists())
+
+
+def play_battle(player1, player2, attack, **fields):
+    """Plays a battle to the end with the same attack on both sides (stats applied at the end)."""
+    battle = Battle.objects.create(player1=player1, player2=player2, status='active', **fields)
+    battle.battle_attacks_player1.set([attack])
+    battle.battle_attacks_player2.set([attack])
+    battle.initialize_battle_state()
+    for _ in range(200):
+        if battle.status != 'active':
+            break
+        apply_attack(battle, getattr(battle, battle.whose_turn), attack)
+    return battle
+
+
+class StatsRecalculationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.attack = create_attack("Strike")
+        for _ in range(3):
+            play_battle(cls.alice, cls.bob, cls.attack)
+
+    def snapshot(self):
+        return (
+            list(AttackUsageStats.objects.order_by('attack_id').values_list('attack_id', *ATTACK_STAT_FIELDS)),
+            sorted(AttackCoUsage.objects.values_list('attack_a_id', 'attack_b_id', 'count')),
+        )
+
+    def test_recalculation_matches_live_stats(self):
+        # A forfeit and a battle never recorded in the outbox: neither was applied live
+        forfeited = Battle.objects.create(player1=self.alice, player2=self.bob, status='active')
+        forfeited.battle_attacks_player1.set([self.attack])
+        forfeited.initialize_battle_state()
+        apply_attack(forfeited, self.alice, self.attack)
+        with transaction.atomic():
+            forfeit_battle(forfeited, self.bob, reason="bob conceded")
+        played = Battle.objects.filter(status='finished', winner__isnull=False).first()
+        Battle.objects.create(player1=self.alice, player2=self.bob, status='finished', winner=played.winner,
+                              last_turn_summary=played.last_turn_summary)
+
+        live = self.snapshot()
+        AttackUsageStats.objects.update(times_used=0, total_damage_dealt=0) # Drift the recalculation must repair
+        job, _ = queue_recalculation_job()
+        run_recalculation_job(job, workers=1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.battles_processed, 3)
+        self.assertEqual(self.snapshot(), live)
+
+
+class BattleStatsOutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.attack = create_attack("Strike")
+
+    def setUp(self):
+        random.seed(0)
+
+    def times_used(self):
+        return AttackUsageStats.objects.filter(attack=self.attack).values_list('times_used', flat=True).first() or 0
+
+    @override_settings(BATTLE_STATS_ASYNC=True)
+    def test_queued_battle_is_applied_once(self):
+        battle = play_battle(self.alice, self.bob, self.attack)
+        update_attack_stats_from_battle_log(battle) # A retried finish must not queue it again
+        self.assertEqual(BattleStatsOutbox.objects.filter(battle=battle, processed_at__isnull=True).count(), 1)
+        self.assertEqual(self.times_used(), 0)
+
+        self.assertEqual(flush_battle_stats_outbox(), 1)
+        self.assertEqual(flush_battle_stats_outbox(), 0)
+        self.assertEqual(self.times_used(), 1)
+        self.assertEqual(battle_stats_lag()['pending'], 0)
+
+    def test_synchronous_battle_is_applied_once(self):
+        battle = play_battle(self.alice, self.bob, self.attack)
+        update_attack_stats_from_battle_log(battle)
+        self.assertEqual(flush_battle_stats_outbox(), 0)
+        self.assertEqual(self.times_used(), 1)
+        self.assertIsNotNone(BattleStatsOutbox.objects.get(battle=battle).processed_at)
+
+
+class BattleParticipantTests(APITestCase):
+    """Battle.save() keeps one participant row per player in step with the battle's status."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+
+    def participants(self, battle):
+        return list(battle.participants.order_by('role').values_list('role', 'user_id', 'opponent_id', 'status'))
+
+    def test_rows_follow_status_changes(self):
+        battle = Battle.objects.create(player1=self.alice, player2=self.bob, status='pending')
+        self.assertEqual(self.participants(battle), [
+            ('player1', self.alice.pk, self.bob.pk, 'pending'),
+            ('player2', self.bob.pk, self.alice.pk, 'pending'),
+        ])
+        for new_status in ('active', 'finished'):
+            battle.status = new_status
+            battle.save()
+            self.assertEqual({row[3] for row in self.participants(battle)}, {new_status})
+
+    def test_declined_request(self):
+        battle = Battle.objects.create(player1=self.alice, player2=self.bob, status='pending')
+        self.client.force_authenticate(self.bob)
+        response = self.client.post(f'/api/game/battles/{battle.pk}/respond/', {'action': 'decline'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row[3] for row in self.participants(battle)}, {'declined'})
+        self.assertFalse(BattleParticipant.objects.filter(user=self.bob, status='pending').exists())
+
+
+class RatingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+        cls.carol = User.objects.create_user('carol', password='x')
+
+    def finish(self, player1, player2, winner, **fields):
+        battle = Battle.objects.create(player1=player1, player2=player2, status='active', **fields)
+        battle.status = 'finished'
+        battle.winner = winner
+        battle.save()
+
+    def ratings(self):
+        return list(User.objects.order_by('pk').values_list('username', 'rating', 'rated_battles'))
+
+    def test_rated_battle_moves_both_ratings(self):
+        self.finish(self.alice, self.bob, self.alice)
+        k = settings.RATING_K_PROVISIONAL
+        self.assertEqual(self.ratings()[:2], [('alice', DEFAULT_RATING + k / 2, 1), ('bob', DEFAULT_RATING - k / 2, 1)])
+
+    def test_unrated_battles(self):
+        self.finish(self.alice, self.bob, self.alice, player2_is_ai_controlled=True)
+        self.finish(self.alice, self.bob, None)
+        self.assertEqual({(rating, n) for _, rating, n in self.ratings()}, {(DEFAULT_RATING, 0)})
+
+    def test_recompute_matches_live_ratings(self):
+        self.finish(self.alice, self.bob, self.alice)
+        self.finish(self.bob, self.carol, self.bob)
+        self.finish(self.carol, self.alice, self.carol)
+        self.finish(self.alice, self.bob, self.bob, player2_is_ai_controlled=True)
+        live = self.ratings()
+        User.objects.update(rating=0, rated_battles=0)
+        call_command('recompute_ratings', stdout=io.StringIO())
+        for (name, rating, n), (live_name, live_rating, live_n) in zip(self.ratings(), live):
+            self.assertEqual((name, n), (live_name, live_n))
+            self.assertAlmostEqual(rating, live_rating)
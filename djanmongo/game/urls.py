@@ -12,8 +12,12 @@ urlpatterns = [
     path('battles/<int:pk>/cancel/', views.CancelBattleView.as_view(), name='battle_cancel'),
     path('battles/<int:pk>/', views.BattleDetailView.as_view(), name='battle_detail'),
     path('battles/<int:pk>/action/', views.BattleActionView.as_view(), name='battle_action'),
+    path('battles/<int:pk>/actions/', views.BattleMultiActionView.as_view(), name='battle_multi_action'), # Momentum chains, one write
     path('battles/<int:pk>/concede/', views.ConcedeBattleView.as_view(), name='battle_concede'),
+    path('battles/<int:pk>/replay/', views.BattleReplayView.as_view(), name='battle_replay'),
+    path('battles/auto/', views.AutoBattleView.as_view(), name='battle_auto'), # AI vs AI, played in memory
     path('battles/active/', views.ActiveBattleView.as_view(), name='active_battle'), # Get user's current active battle
+    path('matchmaking/', views.MatchmakingView.as_view(), name='matchmaking'),
     # NEW: Attack Generation Endpoint
     path('attacks/generate/', views.GenerateAttacksView.as_view(), name='attack_generate'),
     path('attacks/my-attacks/', views.MyAttacksListView.as_view(), name='my_attacks_list'),
@@ -22,4 +26,7 @@ urlpatterns = [
     path('leaderboard/attacks/', views.AttackLeaderboardView.as_view(), name='attack_leaderboard'),
     path('attacks/<int:pk>/favorite/', views.AttackFavoriteToggleView.as_view(), name='attack-favorite-toggle'),
     path('config/', views.GameConfigurationView.as_view(), name='game_config'),
+    # Analytics (daily rollups)
+    path('analytics/attacks/', views.AttackTrendsView.as_view(), name='analytics_attacks'),
+    path('analytics/attacks/<int:pk>/', views.AttackDailyStatsView.as_view(), name='analytics_attack_daily'),
 ]
\ No newline at end of file
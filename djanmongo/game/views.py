@@ -1,26 +1,37 @@
 from rest_framework import generics, permissions, status, views
 from rest_framework.response import Response
+from rest_framework.throttling import AnonRateThrottle
 from django.shortcuts import get_object_or_404
-from django.db.models import Q # For OR queries
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models import prefetch_related_objects
 import json # For parsing potential JSON output from LLM
 import bleach # For sanitizing text output from LLM
-import random # For generating random data
 from django.conf import settings # <-- Add settings import
 import google.generativeai as genai # <-- Add genai import
 from rest_framework import serializers # <--- ADD THIS IMPORT
-# --- Add imports for time calculations --- 
 from django.utils import timezone
-from datetime import timedelta 
-# ---------------------------------------
+from functools import partial
 
-from .models import Attack, Battle, Script, AttackUsageStats, GameConfiguration # <-- Add GameConfiguration
+from .models import Attack, Battle, BattleParticipant, MatchmakingTicket, Script, AttackUsageStats, AttackDailyStats, GameConfiguration # <-- Add GameConfiguration
+from .analytics import parse_date_range, win_rate
 from users.models import User
+from users.pagination import CachedLeaderboardPageMixin
+from users.conditional import conditional_response, latest, version_etag
+from .pagination import AttackLeaderboardPagination
 from .serializers import (
     AttackSerializer, BattleInitiateSerializer, BattleRespondSerializer,
     BattleActionSerializer, BattleSerializer, BattleListSerializer,
-    GenerateAttackRequestSerializer, AttackLeaderboardSerializer, AttackFavoriteUpdateSerializer # Added AttackFavoriteUpdateSerializer
+    GenerateAttackRequestSerializer, AttackLeaderboardSerializer, AttackFavoriteUpdateSerializer, # Added AttackFavoriteUpdateSerializer
+    MatchmakingTicketSerializer, AutoBattleRequestSerializer,
+    BattleMultiActionSerializer, BattleDeltaSerializer, battle_delta_snapshot,
 )
-from .battle_logic import apply_attack # Import the new logic function
+from .battle_logic import apply_attack, forfeit_battle, run_ai_turns, save_battle_state # Import the new logic function
+from .renderers import GAME_PARSER_CLASSES, GAME_RENDERER_CLASSES
+from .sweeper import pending_expiry_cutoff
+from .replay import BattleLogSource, replay_lines, with_live_log_size
+from .auto_battle import load_matchup, persist_auto_battle, play_auto_battle, simulate_matchup, summarize_auto_battles
 # Import new helper functions
 from .attack_generation import (
     construct_generation_prompt,
@@ -28,6 +39,39 @@ from .attack_generation import (
     process_and_save_generated_attacks
 )
 
+# --- Query shaping for BattleSerializer ---
+# Every relation BattleSerializer reads, so that serializing a battle costs a fixed
+# number of queries regardless of loadout size. Player cards are not nested any more
+# (see PlayerCardView), so only the battle's own loadouts are prefetched.
+BATTLE_SERIALIZER_SELECT_RELATED = ('player1', 'player2', 'winner')
+BATTLE_SERIALIZER_PREFETCH_RELATED = ('battle_attacks_player1', 'battle_attacks_player2')
+
+def battle_queryset_for_serializer():
+    """Battle queryset with BattleSerializer's relations selected/prefetched."""
+    return Battle.objects.select_related(*BATTLE_SERIALIZER_SELECT_RELATED).prefetch_related(*BATTLE_SERIALIZER_PREFETCH_RELATED)
+
+def prefetch_battle_for_serializer(battle):
+    """Same as battle_queryset_for_serializer() for an already loaded (possibly modified) instance."""
+    prefetch_related_objects([battle], *BATTLE_SERIALIZER_PREFETCH_RELATED)
+    return battle
+
+# Version columns of everything a BattleSerializer payload shows: the battle row and the
+# players' cards (username/card_version). Read with one values() query before serializing.
+BATTLE_STATE_VERSION_FIELDS = ('updated_at', 'player1__updated_at', 'player2__updated_at')
+
+def battle_state_version(request, row, *extra):
+    """(etag, last_modified) of a battle state for the requesting user.
+    The payload is per-user (my_selected_attacks uses the requester's stats) and depends on
+    the query string (?log_from=), so both are part of the ETag.
+    """
+    user = request.user
+    etag = version_etag(
+        'battle', *extra, *(row[field] for field in BATTLE_STATE_VERSION_FIELDS),
+        user.pk, user.updated_at, request.GET.urlencode(),
+    )
+    return etag, latest(*(row[field] for field in BATTLE_STATE_VERSION_FIELDS), user.updated_at)
+# --- END Query shaping ---
+
 # --- NEW: Game Configuration Serializer ---
 class GameConfigurationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -69,6 +113,8 @@ class AttackListView(generics.ListAPIView):
 
 class InitiateBattleView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
 
     def post(self, request, *args, **kwargs):
         serializer = BattleInitiateSerializer(data=request.data)
@@ -90,22 +136,22 @@ class InitiateBattleView(views.APIView):
                 return Response({"error": f"{player2.username} does not allow being fought as a bot."}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check if an active or pending battle already exists between these users
-            existing_battle = Battle.objects.filter(
-                (Q(player1=player1, player2=player2) | Q(player1=player2, player2=player1)),
-                status__in=['pending', 'active']
-            ).first()
+            # (expired challenges no longer count, even before the sweeper deletes them)
+            existing_battle_id = BattleParticipant.objects.filter(user=player1, opponent=player2).filter(
+                Q(status='active') | Q(status='pending', battle__updated_at__gte=pending_expiry_cutoff())
+            ).order_by('battle_id').values_list('battle_id', flat=True).first()
 
-            if existing_battle:
+            if existing_battle_id:
                  # If fighting as bot is requested, maybe allow starting even if pending exists?
                  # For now, keep the strict check: no existing pending/active battles.
-                 return Response({"error": "An active or pending battle already exists with this user.", "battle_id": existing_battle.id}, status=status.HTTP_400_BAD_REQUEST)
+                 return Response({"error": "An active or pending battle already exists with this user.", "battle_id": existing_battle_id}, status=status.HTTP_400_BAD_REQUEST)
 
             # --- MODIFIED BATTLE CHECK ---
             # Check if player1 is in an active HUMAN vs HUMAN battle
-            player1_in_human_battle = Battle.objects.filter(
-                (Q(player1=player1) | Q(player2=player1)),
+            player1_in_human_battle = BattleParticipant.objects.filter(
+                user=player1,
                 status='active',
-                player2_is_ai_controlled=False # Check if it's NOT an AI battle
+                battle__player2_is_ai_controlled=False # Check if it's NOT an AI battle
             ).exists()
             if player1_in_human_battle:
                 return Response({"error": "You are currently in an active battle against a human."}, status=status.HTTP_400_BAD_REQUEST)
@@ -115,10 +161,10 @@ class InitiateBattleView(views.APIView):
             # This check assumes player2 is human; if player2 is a bot, this check is likely unnecessary
             # or should check if the *bot instance* is somehow capacity-limited.
             # For simplicity, let's check player2 regardless, assuming a human player could be selected as opponent.
-            player2_in_human_battle = Battle.objects.filter(
-                (Q(player1=player2) | Q(player2=player2)),
+            player2_in_human_battle = BattleParticipant.objects.filter(
+                user=player2,
                 status='active',
-                player2_is_ai_controlled=False
+                battle__player2_is_ai_controlled=False
             ).exists()
             if player2_in_human_battle:
                  return Response({"error": "Opponent is currently in an active battle against a human."}, status=status.HTTP_400_BAD_REQUEST)
@@ -136,7 +182,7 @@ class InitiateBattleView(views.APIView):
                 )
                 battle.initialize_battle_state() # This also saves the battle
                 # Use the full BattleSerializer for the response as the battle is active
-                battle_serializer = BattleSerializer(battle, context={'request': request})
+                battle_serializer = BattleSerializer(prefetch_battle_for_serializer(battle), context={'request': request})
                 return Response({
                     "message": f"Battle with {player2.username} (as BOT) started immediately!",
                     "battle": battle_serializer.data # Return full battle state
@@ -155,32 +201,39 @@ class InitiateBattleView(views.APIView):
 
 
 class PendingBattlesView(generics.ListAPIView):
-    """Lists battles waiting for the logged-in user's response."""
+    """Lists battles waiting for the logged-in user's response.
+    Supports conditional GET: the ETag covers the pending battles and their challengers' cards.
+    """
     serializer_class = BattleListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        rows = list(
+            self.get_queryset()
+            .select_related(None)
+            .values_list('id', 'updated_at', 'player1__updated_at')
+        )
+        etag = version_etag('pending', user.pk, user.updated_at, rows)
+        last_modified = latest(user.updated_at, *(ts for row in rows for ts in row[1:]))
+        return conditional_response(request, etag, last_modified, partial(super().get, request, *args, **kwargs))
 
     def get_queryset(self):
         user = self.request.user
-
-        # --- Auto-delete old pending battles --- 
-        time_threshold = timezone.now() - timedelta(minutes=10)
-        expired_battles = Battle.objects.filter(
-            player2=user, 
-            status='pending',
-            created_at__lt=time_threshold
+        # Pure read: expired challenges are hidden here and deleted by `manage.py sweep_battles`
+        return (
+            Battle.objects.filter(player2=user, status='pending', updated_at__gte=pending_expiry_cutoff())
+            .select_related('player1', 'player2')
+            .order_by('-created_at')
         )
-        count = expired_battles.count()
-        if count > 0:
-            expired_battles.delete()
-            print(f"[User: {user.username}] Deleted {count} expired pending battle requests older than 10 minutes.")
-        # --- End auto-delete --- 
-
-        # Return remaining pending battles for this user
-        return Battle.objects.filter(player2=user, status='pending').order_by('-created_at')
 
 
 class RespondBattleView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
 
     def post(self, request, pk, *args, **kwargs):
         battle = get_object_or_404(Battle, pk=pk)
@@ -192,22 +245,24 @@ class RespondBattleView(views.APIView):
 
         if battle.status != 'pending':
             return Response({"error": "This battle request is no longer pending."}, status=status.HTTP_400_BAD_REQUEST)
+        if battle.updated_at < pending_expiry_cutoff():
+            return Response({"error": "This battle request has expired."}, status=status.HTTP_400_BAD_REQUEST)
 
         if serializer.is_valid():
             action = serializer.validated_data['action']
             if action == 'accept':
                  # Check if player1 is now in another active battle
-                if Battle.objects.filter(Q(player1=battle.player1) | Q(player2=battle.player1), status='active').exists():
+                if BattleParticipant.objects.filter(user=battle.player1_id, status='active').exists():
                     battle.status = 'declined' # Auto-decline if initiator started another battle
                     battle.save()
                     return Response({"error": "The challenger is already in another battle. Request declined."}, status=status.HTTP_400_BAD_REQUEST)
                 # Check if player2 (acceptor) is now in another active battle
-                if Battle.objects.filter(Q(player1=user) | Q(player2=user), status='active').exclude(pk=battle.pk).exists():
+                if BattleParticipant.objects.filter(user=user, status='active').exclude(battle=battle).exists():
                      return Response({"error": "You are already in an active battle."}, status=status.HTTP_400_BAD_REQUEST)
 
                 battle.status = 'active'
                 battle.initialize_battle_state() # Sets initial turn/momentum now
-                battle_data = BattleSerializer(battle).data
+                battle_data = BattleSerializer(prefetch_battle_for_serializer(battle), context={'request': request}).data
                 # TODO: Potentially send a notification to player1 (e.g., via WebSockets)
                 return Response({"message": "Battle accepted!", "battle": battle_data}, status=status.HTTP_200_OK)
             else: # action == 'decline'
@@ -219,14 +274,30 @@ class RespondBattleView(views.APIView):
 
 
 class BattleDetailView(generics.RetrieveAPIView):
-    """Gets the current state of a specific battle."""
+    """Gets the current state of a specific battle.
+    Supports conditional GET; see battle_state_version().
+    """
     serializer_class = BattleSerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        row = (
+            Battle.objects.filter(pk=kwargs.get('pk'), participants__user=user)
+            .values(*BATTLE_STATE_VERSION_FIELDS)
+            .first()
+        )
+        if row is None:
+            return super().get(request, *args, **kwargs) # Regular 404
+        etag, last_modified = battle_state_version(request, row)
+        return conditional_response(request, etag, last_modified, partial(super().get, request, *args, **kwargs))
 
     def get_queryset(self):
         user = self.request.user
         # Allow user to see details only if they are player1 or player2
-        return Battle.objects.filter(Q(player1=user) | Q(player2=user))
+        return battle_queryset_for_serializer().filter(participants__user=user)
         
     # Add this method to pass context
     def get_serializer_context(self):
@@ -236,28 +307,46 @@ class BattleDetailView(generics.RetrieveAPIView):
 
 
 class ActiveBattleView(views.APIView):
-    """Gets the user's current active battle, if any."""
+    """Gets the user's current active battle, if any.
+    Supports conditional GET; see battle_state_version().
+    """
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
 
     def get(self, request, *args, **kwargs):
         user = request.user
-        active_battle = Battle.objects.filter(
-            (Q(player1=user) | Q(player2=user)),
-            status='active'
-        ).first()
+        row = (
+            # Driven by the participant (user, status) index
+            Battle.objects.filter(participants__user=user, participants__status='active')
+            .order_by('pk') # Same battle .first() picked before
+            .values('id', *BATTLE_STATE_VERSION_FIELDS)
+            .first()
+        )
+        if row is None:
+            return Response({"message": "No active battle found."}, status=status.HTTP_404_NOT_FOUND)
 
-        if active_battle:
+        def build_response():
+            active_battle = battle_queryset_for_serializer().get(pk=row['id'])
             serializer = BattleSerializer(active_battle, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            return Response({"message": "No active battle found."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag, last_modified = battle_state_version(request, row, row['id'])
+        return conditional_response(request, etag, last_modified, build_response)
 
 
 class BattleActionView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
+    # Checked by request_timing.RequestTimingMiddleware. Measured (pinned in game/tests.py):
+    # 8 for a turn, 18 when the AI answers, 35-37 when the turn or the AI's answer finishes
+    # the battle (post-battle stats), plus up to 3 session/user/presence middleware queries.
+    # Every extra AI move (when momentum keeps the AI's turn) adds ~5 and is logged over budget.
+    timing_budget = {'queries': 42}
 
     def post(self, request, pk, *args, **kwargs):
-        battle = get_object_or_404(Battle, pk=pk)
+        battle = get_object_or_404(Battle.objects.select_related(*BATTLE_SERIALIZER_SELECT_RELATED), pk=pk)
         user = request.user
         serializer = BattleActionSerializer(data=request.data)
 
@@ -287,70 +376,12 @@ class BattleActionView(views.APIView):
                 return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
             # --- BEGIN BOT TURN LOGIC --- # REPLACED current_player.is_bot check
-            while not battle_ended and battle.status == 'active':
-                current_turn_role = battle.whose_turn
-                is_player2_ai = battle.player2_is_ai_controlled # Check the battle flag
-
-                # --- Determine if current turn is AI controlled --- 
-                is_ai_turn = (is_player2_ai and current_turn_role == 'player2')
-                # Add logic here if player1 could also be AI controlled in the future
-                # is_ai_turn = (is_player2_ai and current_turn_role == 'player2') or \ 
-                #            (battle.player1_is_ai_controlled and current_turn_role == 'player1')
-
-                if not is_ai_turn:
-                    break # Exit loop if it's a human's turn
-
-                # --- It's an AI Controlled Turn --- 
-                # Determine which player object and attack list to use based on role
-                if current_turn_role == 'player1':
-                    current_player = battle.player1
-                    bot_attack_list = battle.battle_attacks_player1.all()
-                else: # player2
-                    current_player = battle.player2
-                    bot_attack_list = battle.battle_attacks_player2.all()
-
-                print(f"[Battle {battle.id}] AI controlling {current_player.username} (Role: {current_turn_role})...")
-                
-                if not bot_attack_list:
-                    print(f"Warning: AI-controlled player {current_player.username} (Role: {current_turn_role}) in Battle {battle.id} has no attacks. Skipping turn.")
-                    original_turn = battle.whose_turn
-                    battle.whose_turn = 'player1' if current_turn_role == 'player2' else 'player2'
-                    if battle.whose_turn != original_turn:
-                        battle.turn_number += 1
-                    if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
-                    battle.last_turn_summary.append({
-                        "source": "system",
-                        "text": f"{current_player.username} (AI) has no moves and skips the turn.",
-                        "effect_type": "info"
-                    })
-                    battle.save()
-                    break # Exit the loop after skipping
-
-                bot_chosen_attack = random.choice(list(bot_attack_list))
-                print(f"  AI chose attack: {bot_chosen_attack.name} (ID: {bot_chosen_attack.id})")
-
-                try:
-                    # Apply the AI's attack
-                    _, bot_battle_ended = apply_attack(battle, current_player, bot_chosen_attack)
-                    battle_ended = bot_battle_ended # Update overall status
-                except ValueError as e:
-                    print(f"Error during AI ({current_player.username}) turn in Battle {battle.id}: {e}")
-                    if not isinstance(battle.last_turn_summary, list): battle.last_turn_summary = []
-                    battle.last_turn_summary.append({
-                        "source": "system",
-                        "text": f"Error processing AI ({current_player.username}) turn: {e}",
-                        "effect_type": "error"
-                    })
-                    original_turn = battle.whose_turn
-                    battle.whose_turn = 'player1' if current_turn_role == 'player2' else 'player2'
-                    if battle.whose_turn != original_turn:
-                        battle.turn_number += 1
-                    battle.save()
-                    break # Exit the loop on error
+            if not battle_ended:
+                battle_ended = run_ai_turns(battle)
             # --- END BOT/AI TURN LOGIC ---
 
             # --- Respond with final battle state ---
-            updated_battle_state = BattleSerializer(battle, context={'request': request}).data
+            updated_battle_state = BattleSerializer(prefetch_battle_for_serializer(battle), context={'request': request}).data
             if battle_ended:
                 return Response({
                     "message": "Battle finished!",
@@ -372,11 +403,118 @@ class BattleActionView(views.APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BattleMultiActionView(views.APIView):
+    """POST {"attack_ids": [...]}: uses the attacks in order while it stays the requester's
+    turn (spending momentum keeps the turn), then plays any AI turns that follow. Everything
+    is applied in memory and written once; the response carries only what changed
+    (BattleDeltaSerializer) and the new log entries. Ids left when the turn passed or the
+    battle ended are returned in `skipped`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES
+    parser_classes = GAME_PARSER_CLASSES
+    # Measured (pinned in game/tests.py): 9 for a chain, 36 when it finishes the battle
+    # (post-battle stats), plus up to 3 session/user/presence middleware queries
+    timing_budget = {'queries': 41}
+
+    def post(self, request, pk, *args, **kwargs):
+        serializer = BattleMultiActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        attack_ids = serializer.validated_data['attack_ids']
+        user = request.user
+
+        with transaction.atomic():
+            battle = get_object_or_404(
+                Battle.objects.select_for_update(of=('self',)).select_related(*BATTLE_SERIALIZER_SELECT_RELATED), pk=pk
+            )
+            role = battle.get_player_role(user)
+            if not role:
+                return Response({"error": "You are not part of this battle."}, status=status.HTTP_403_FORBIDDEN)
+            if battle.status != 'active':
+                return Response({"error": "Battle is not active."}, status=status.HTTP_400_BAD_REQUEST)
+            if battle.whose_turn != role:
+                return Response({"error": "It's not your turn!"}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Both loadouts with their scripts: no queries while the actions are applied
+            prefetch_related_objects([battle], 'battle_attacks_player1__scripts', 'battle_attacks_player2__scripts')
+            attacks_by_id = {attack.pk: attack for attack in [*battle.battle_attacks_player1.all(), *battle.battle_attacks_player2.all()]}
+            my_attacks = {attack.pk: attack for attack in getattr(battle, f'battle_attacks_{role}').all()}
+            invalid = [attack_id for attack_id in attack_ids if attack_id not in my_attacks]
+            if invalid:
+                return Response({"error": f"Invalid action: Attack IDs {invalid} not available in this battle for {role}."}, status=status.HTTP_400_BAD_REQUEST)
+
+            snapshot = battle_delta_snapshot(battle)
+            log_from = len(battle.last_turn_summary) if isinstance(battle.last_turn_summary, list) else 0
+            applied = []
+            battle_ended = False
+            for attack_id in attack_ids:
+                if battle_ended or battle.whose_turn != role:
+                    break # The turn passed: the rest of the chain is not used
+                _, battle_ended = apply_attack(battle, user, my_attacks[attack_id], persist=False, attacks_by_id=attacks_by_id)
+                applied.append(attack_id)
+            if not battle_ended:
+                battle_ended = run_ai_turns(battle, persist=False, attacks_by_id=attacks_by_id)
+            save_battle_state(battle)
+
+        delta = BattleDeltaSerializer(battle, context={'request': request, 'snapshot': snapshot, 'log_from': log_from}).data
+        if battle_ended:
+            message = "Battle finished!"
+        elif battle.whose_turn == role:
+            message = "Actions applied. It's your turn!"
+        else:
+            message = f"Actions applied. Waiting for {getattr(battle, battle.whose_turn).username}."
+        return Response({
+            "message": message,
+            "applied": applied,
+            "skipped": attack_ids[len(applied):],
+            "delta": delta,
+        }, status=status.HTTP_200_OK)
+# --- End BattleMultiActionView ---
+
+
+class AutoBattleView(views.APIView):
+    """POST: plays `runs` AI-vs-AI matches between the requester's loadout and the
+    opponent's, in memory (see game/auto_battle.py). With `persist` they are saved.
+    Simulations return their `seed`; sending it back replays the same matches from the cache.
+    The opponent's loadout is played by the AI, so they must allow bot challenges."""
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES
+    parser_classes = GAME_PARSER_CLASSES
+
+    def post(self, request, *args, **kwargs):
+        serializer = AutoBattleRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data['opponent_id'] == request.user.id:
+            return Response({"error": "You cannot battle yourself."}, status=status.HTTP_400_BAD_REQUEST)
+        opponent = User.objects.filter(pk=serializer.validated_data['opponent_id']).first()
+        if opponent is None:
+            return Response({"error": "Opponent not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not opponent.allow_bot_challenges:
+            return Response({"error": f"{opponent.username} does not allow being fought as a bot."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            matchup = load_matchup(request.user, opponent)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        runs = serializer.validated_data['runs']
+        if not serializer.validated_data['persist']:
+            # Simulation only: a seeded preview of an unchanged matchup comes from the cache
+            summary = simulate_matchup(matchup, runs, seed=serializer.validated_data['seed'])
+            return Response({**summary, "persisted": False}, status=status.HTTP_200_OK)
+
+        battles = [persist_auto_battle(play_auto_battle(matchup), matchup) for _ in range(runs)]
+        # Saved matches can also be replayed later (battles/<id>/replay/)
+        return Response({**summarize_auto_battles(battles), "persisted": True}, status=status.HTTP_201_CREATED)
+# --- End AutoBattleView ---
+
+
 class ConcedeBattleView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
 
     def post(self, request, pk, *args, **kwargs):
-        battle = get_object_or_404(Battle, pk=pk)
+        battle = get_object_or_404(Battle.objects.select_related(*BATTLE_SERIALIZER_SELECT_RELATED), pk=pk)
         user = request.user
 
         role = battle.get_player_role(user)
@@ -389,27 +527,16 @@ class ConcedeBattleView(views.APIView):
         # Determine the winner (the opponent)
         opponent = battle.player2 if role == 'player1' else battle.player1
 
-        # Update battle state
-        battle.status = 'finished'
-        battle.winner = opponent
-        battle.save()
+        with transaction.atomic():
+            # Lock the row so a concurrent concede/killing blow cannot finish the battle twice
+            current_status = Battle.objects.select_for_update().filter(pk=battle.pk).values_list('status', flat=True).first()
+            if current_status != 'active':
+                return Response({"error": "Battle is not active or already finished."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # --- Award Booster Credits on Concede ---
-        conceder = user # The user making the request is the conceder (loser)
-        winner = opponent 
-        winner_credits_earned = 2
-        loser_credits_earned = 1 # Conceder still gets 1 credit
-
-        winner.booster_credits += winner_credits_earned
-        conceder.booster_credits += loser_credits_earned
-        
-        winner.save(update_fields=['booster_credits'])
-        conceder.save(update_fields=['booster_credits'])
-        print(f"[Battle {battle.id}] Awarded {winner_credits_earned} credits to winner {winner.username}, {loser_credits_earned} credit to conceder {conceder.username}.")
-        # --- End Award Credits ---
+            forfeit_battle(battle, user)
 
         # Serialize the final state
-        final_state_serializer = BattleSerializer(battle, context={'request': request}) # Pass context
+        final_state_serializer = BattleSerializer(prefetch_battle_for_serializer(battle), context={'request': request}) # Pass context
 
         return Response({
             "message": f"{user.username} conceded. {opponent.username} wins!",
@@ -533,6 +660,8 @@ class MyAttacksListView(generics.ListAPIView):
 # --- Add CancelBattleView --- 
 class CancelBattleView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
 
     def post(self, request, pk, *args, **kwargs):
         battle = get_object_or_404(Battle, pk=pk)
@@ -551,31 +680,112 @@ class CancelBattleView(views.APIView):
         return Response({"message": "Challenge cancelled successfully."}, status=status.HTTP_200_OK)
 # --- End CancelBattleView --- 
 
+# --- NEW: Battle Replay View ---
+class BattleReplayView(views.APIView):
+    """Streams a battle's full log as NDJSON (`application/x-ndjson`) for match review.
+
+    Works for live and archived battles; see game/replay.py for the line format.
+    `?from_turn=N` starts the stream at turn N. Only the players of the battle may
+    fetch it. Live logs are loaded whole, so ones over BATTLE_REPLAY_MAX_LIVE_LOG_BYTES
+    get a 413 until the battle is archived.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        battle = get_object_or_404(
+            with_live_log_size(Battle.objects.filter(participants__user=request.user))
+            .select_related('player1', 'player2', 'winner')
+            .only('id', 'status', 'is_archived', 'player1__id', 'player1__username', 'player1__updated_at',
+                  'player2__id', 'player2__username', 'player2__updated_at',
+                  'winner__id', 'winner__username', 'winner__updated_at'),
+            pk=pk,
+        )
+        try:
+            from_turn = int(request.query_params.get('from_turn', 1))
+            if from_turn < 1:
+                raise ValueError
+        except ValueError:
+            return Response({"error": "from_turn must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if not battle.is_archived and (battle.live_log_bytes or 0) > settings.BATTLE_REPLAY_MAX_LIVE_LOG_BYTES:
+            return Response({"error": "This battle log is too large to replay until it is archived."},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # Everything is read before streaming starts; the generator itself runs no queries
+        source = BattleLogSource(battle)
+        response = StreamingHttpResponse(replay_lines(battle, source, from_turn), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+# --- END Battle Replay View ---
+
+# --- NEW: Matchmaking View ---
+class MatchmakingView(views.APIView):
+    """Matchmaking queue of the logged-in user (pairing: `manage.py run_matchmaking`).
+
+    - POST: join (or re-join) with the current level and loadout.
+    - GET: ticket status; once `matched`, `battle` is the id of the started battle.
+    - DELETE: leave the queue.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = GAME_RENDERER_CLASSES # orjson by default, MessagePack via Accept
+    parser_classes = GAME_PARSER_CLASSES
+
+    def get(self, request, *args, **kwargs):
+        ticket = MatchmakingTicket.objects.filter(user=request.user).first()
+        if ticket is None:
+            return Response({"error": "You are not in the matchmaking queue."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(MatchmakingTicketSerializer(ticket).data, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        user = request.user
+        if BattleParticipant.objects.filter(user=user, status='active').exists():
+            return Response({"error": "You are already in an active battle."}, status=status.HTTP_400_BAD_REQUEST)
+        # initialize_battle_state copies the selected attacks when the pair is found
+        if not user.selected_attacks.exists():
+            return Response({"error": "Select at least one attack before joining matchmaking."}, status=status.HTTP_400_BAD_REQUEST)
+
+        ticket, _ = MatchmakingTicket.objects.update_or_create(
+            user=user,
+            defaults={'status': 'waiting', 'skill': user.level, 'joined_at': timezone.now(), 'matched_at': None, 'battle': None},
+        )
+        return Response(MatchmakingTicketSerializer(ticket).data, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, *args, **kwargs):
+        left = MatchmakingTicket.objects.filter(user=request.user, status='waiting').update(status='cancelled')
+        if not left:
+            return Response({"error": "You are not waiting in the matchmaking queue."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+# --- END Matchmaking View ---
+
 # --- NEW: Attack Leaderboard View ---
-class AttackLeaderboardView(generics.ListAPIView):
-    """Provides a leaderboard ranked by attack usage or wins."""
+class AttackLeaderboardView(CachedLeaderboardPageMixin, generics.ListAPIView):
+    """Provides a leaderboard ranked by attack usage.
+
+    Keyset-paginated (`?cursor=`, `?limit=` capped at 100); the first pages are
+    served from the cache until a battle finishes or the TTL expires.
+    """
     serializer_class = AttackLeaderboardSerializer
     permission_classes = [permissions.AllowAny] # Leaderboard is public
+    pagination_class = AttackLeaderboardPagination
+    throttle_classes = [AnonRateThrottle]
+    page_cache_prefix = 'attacks'
 
     def get_queryset(self):
-        # Pre-fetch related data for efficiency
-        queryset = AttackUsageStats.objects.select_related(
+        # Pre-fetch related data for efficiency; ordering is applied by the paginator
+        return AttackUsageStats.objects.select_related(
             'attack',
             'attack__creator' # Include creator for username
-        ).all() # Correct base queryset
-
-        # Allow sorting via query parameters (e.g., ?sort=wins or ?sort=used)
-        # sort_by = self.request.query_params.get('sort', 'used') # Default sort by times_used
+        )
 
-        # --- SIMPLIFIED SORTING FOR NOW ---
-        # Let's temporarily remove custom sorting to eliminate it as a potential issue
-        # We rely on the default ordering in the serializer/model or apply a simple one here
-        queryset = queryset.order_by('-times_used') # Simple default ordering
-        # --- END SIMPLIFIED SORTING ---
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # One query for the co-used attacks of every row on the page (instead of one per row)
+        self.co_used_attack_lookup = AttackLeaderboardSerializer.build_co_used_attack_lookup(page or [])
+        return page
 
-        # Limit the results (e.g., top 50)
-        limit = int(self.request.query_params.get('limit', 50))
-        return queryset[:limit]
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['co_used_attack_lookup'] = getattr(self, 'co_used_attack_lookup', None)
+        return context
 # --- END Attack Leaderboard View ---
 
 # --- NEW: Attack Delete View ---
@@ -634,4 +844,67 @@ class AttackFavoriteToggleView(generics.UpdateAPIView):
         return Response(full_serializer.data)
 
     # perform_update is handled by UpdateAPIView
-# --- END NEW --- 
\ No newline at end of file
+# --- END NEW --- 
+# --- NEW: Analytics Views (served from the daily rollups) ---
+ANALYTICS_ATTACK_FIELDS = ('uses', 'wins', 'losses', 'damage_dealt', 'healing_done')
+
+class AttackTrendsView(views.APIView):
+    """Attacks ranked by uses over a date range, from AttackDailyStats.
+
+    Query params: `from`, `to` (YYYY-MM-DD, inclusive; default last 30 days), `limit` (default 20, max 100).
+    Endpoint: `/api/game/analytics/attacks/`
+    """
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [AnonRateThrottle]
+
+    def get(self, request, *args, **kwargs):
+        date_from, date_to = parse_date_range(request)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        except ValueError:
+            limit = 20
+
+        rows = (
+            AttackDailyStats.objects
+            .filter(date__range=(date_from, date_to))
+            .values('attack_id', 'attack__name', 'attack__emoji')
+            .annotate(**{field: Sum(field) for field in ANALYTICS_ATTACK_FIELDS})
+            .order_by('-uses', 'attack_id')[:limit]
+        )
+        results = [{
+            'attack_id': row['attack_id'],
+            'name': row['attack__name'],
+            'emoji': row['attack__emoji'],
+            **{field: row[field] for field in ANALYTICS_ATTACK_FIELDS},
+            'win_rate': win_rate(row['wins'], row['losses']),
+        } for row in rows]
+        return Response({'from': date_from, 'to': date_to, 'results': results})
+
+
+class AttackDailyStatsView(views.APIView):
+    """Day-by-day usage of one attack over a date range, from AttackDailyStats (days without battles are omitted).
+
+    Query params: `from`, `to` (YYYY-MM-DD, inclusive; default last 30 days).
+    Endpoint: `/api/game/analytics/attacks/<pk>/`
+    """
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [AnonRateThrottle]
+
+    def get(self, request, pk, *args, **kwargs):
+        date_from, date_to = parse_date_range(request)
+        attack = get_object_or_404(Attack.objects.only('id', 'name', 'emoji'), pk=pk)
+        days = list(
+            AttackDailyStats.objects
+            .filter(attack_id=pk, date__range=(date_from, date_to))
+            .order_by('date')
+            .values('date', *ANALYTICS_ATTACK_FIELDS)
+        )
+        for day in days:
+            day['win_rate'] = win_rate(day['wins'], day['losses'])
+        return Response({
+            'from': date_from,
+            'to': date_to,
+            'attack': {'id': attack.id, 'name': attack.name, 'emoji': attack.emoji},
+            'days': days,
+        })
+# --- END Analytics Views ---
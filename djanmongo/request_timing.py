@@ -0,0 +1,180 @@
+"""
+Per-request query and timing instrumentation (enabled with REQUEST_TIMING_ENABLED).
+
+RequestTimingMiddleware records, for every request:
+- the number of SQL queries and the time spent in them (connection.execute_wrapper)
+- time spent running Lua scripts (`timed_section('lua')`, see lua_integration.execute_lua_script)
+- time spent serializing (`serializer.data` of top-level DRF serializers; includes queries they trigger)
+
+and reports them as a `Server-Timing` header and one JSON log line on the
+'request_timing' logger. Views can declare a budget:
+
+    class BattleActionView(views.APIView):
+        timing_budget = {'queries': 42}
+
+Keys are any recorded metric (queries, db_ms, lua_ms, serializer_ms, total_ms). A request
+over budget is logged as a warning. With REQUEST_TIMING_ENFORCE_BUDGETS (the default under
+`manage.py test`) it fails with TimingBudgetExceeded, but only for the deterministic
+ENFORCED_METRICS: wall-clock budgets would make CI flaky, so they are only logged.
+Query counts include the middleware's own queries (session, user, presence).
+"""
+
+import contextvars
+import json
+import logging
+import time
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('request_timing')
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+# Budgets that can fail a request; the *_ms ones are only logged
+ENFORCED_METRICS = ('queries',)
+
+
+class TimingBudgetExceeded(Exception):
+    pass
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.lua_ms = 0.0
+        self.serializer_ms = 0.0
+        self.view_name = None
+        self.budget = None
+
+    def metrics(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_ms, 2),
+            'lua_ms': round(self.lua_ms, 2),
+            'serializer_ms': round(self.serializer_ms, 2),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+        }
+
+    def over_budget(self, metrics):
+        """{metric: (value, limit)} for every exceeded budget entry."""
+        return {
+            metric: (metrics[metric], limit)
+            for metric, limit in (self.budget or {}).items()
+            if metric in metrics and metrics[metric] > limit
+        }
+
+
+class timed_section(ContextDecorator):
+    """Adds the wall time of the block to `<category>_ms` of the current request. No-op outside one."""
+
+    def __init__(self, category):
+        self.category = category
+        self.attribute = f"{category}_ms"
+        self._start = None
+
+    def _recreate_cm(self):
+        # Fresh instance per decorated call, so concurrent calls never share _start
+        return type(self)(self.category)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_ms = (time.perf_counter() - self._start) * 1000
+        timings = _current_timings.get()
+        if timings is not None:
+            setattr(timings, self.attribute, getattr(timings, self.attribute) + elapsed_ms)
+        return False
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current_timings.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timings is not None:
+            timings.queries += 1
+            timings.db_ms += (time.perf_counter() - started) * 1000
+
+
+_serializer_timing_installed = False
+
+def install_serializer_timing():
+    """Wraps BaseSerializer.data so top-level serialization is timed. Nested serializers
+    use to_representation directly, so nothing is counted twice. Done once, only when
+    the middleware is enabled.
+    """
+    global _serializer_timing_installed
+    if _serializer_timing_installed:
+        return
+    from rest_framework.serializers import BaseSerializer
+
+    original_data = BaseSerializer.data
+
+    def timed_data(serializer):
+        if hasattr(serializer, '_data') or _current_timings.get() is None:
+            return original_data.fget(serializer)
+        with timed_section('serializer'):
+            return original_data.fget(serializer)
+
+    BaseSerializer.data = property(timed_data)
+    _serializer_timing_installed = True
+
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_serializer_timing()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_record_query))
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+
+        metrics = timings.metrics()
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics["db_ms"]};desc="{metrics["queries"]} queries"',
+            f'lua;dur={metrics["lua_ms"]}',
+            f'ser;dur={metrics["serializer_ms"]}',
+            f'total;dur={metrics["total_ms"]}',
+        ))
+        log_record = {
+            'method': request.method,
+            'path': request.path,
+            'view': timings.view_name,
+            'status': response.status_code,
+            **metrics,
+        }
+        over_budget = timings.over_budget(metrics)
+        if over_budget:
+            log_record['over_budget'] = {metric: {'value': value, 'budget': limit} for metric, (value, limit) in over_budget.items()}
+            logger.warning(json.dumps(log_record))
+            enforced = {metric: values for metric, values in over_budget.items() if metric in ENFORCED_METRICS}
+            if enforced and settings.REQUEST_TIMING_ENFORCE_BUDGETS:
+                details = ', '.join(f"{metric}={value} > {limit}" for metric, (value, limit) in enforced.items())
+                raise TimingBudgetExceeded(f"{timings.view_name} exceeded its timing budget: {details}")
+        else:
+            logger.info(json.dumps(log_record))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _current_timings.get()
+        if timings is None:
+            return None
+        # DRF sets .cls on as_view() functions, Django class-based views set .view_class
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        timings.view_name = view_class.__name__ if view_class else getattr(view_func, '__name__', None)
+        timings.budget = getattr(view_class, 'timing_budget', None) if view_class else None
+        return None
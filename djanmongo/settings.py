@@ -1,4 +1,5 @@
 import os
+import sys
 import dj_database_url
 from pathlib import Path
 from datetime import timedelta  # Import timedelta
@@ -151,7 +152,11 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly', # Adjust as needed
-    )
+    ),
+    # Only applied to views that opt in via throttle_classes (e.g. public leaderboards)
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.environ.get('ANON_THROTTLE_RATE', '120/min'),
+    },
 }
 
 # Use environment variable for Gemini API Key, default to None if not set
@@ -274,3 +279,102 @@ CREDITS_WIN_VS_HUMAN = int(os.environ.get('CREDITS_WIN_VS_HUMAN', '3'))
 CREDITS_WIN_VS_BOT = int(os.environ.get('CREDITS_WIN_VS_BOT', '2'))
 CREDITS_LOSS = int(os.environ.get('CREDITS_LOSS', '1'))
 # --- END NEW ---
+
+# --- Simulation Result Cache ---
+# Per-worker LRU size; set SIMULATION_CACHE_DISK_PATH to share results between workers via SQLite.
+SIMULATION_CACHE_MAX_ENTRIES = int(os.environ.get('SIMULATION_CACHE_MAX_ENTRIES', '2048'))
+SIMULATION_CACHE_DISK_PATH = os.environ.get('SIMULATION_CACHE_DISK_PATH') or None
+SIMULATION_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('SIMULATION_CACHE_DISK_MAX_ENTRIES', '100000'))
+
+# --- Leaderboard Page Cache ---
+# The first pages of each leaderboard are cached; finishing a battle invalidates them early.
+LEADERBOARD_CACHED_PAGES = int(os.environ.get('LEADERBOARD_CACHED_PAGES', '3'))
+LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL', '60')) # Seconds
+
+# --- Post-Battle Stats Pipeline ---
+# When True, finished battles are queued (BattleStatsOutbox) and applied in batches by
+# `manage.py process_battle_stats --loop`; when False they are applied in the finishing request.
+BATTLE_STATS_ASYNC = os.environ.get('BATTLE_STATS_ASYNC', 'False') == 'True'
+BATTLE_STATS_BATCH_SIZE = int(os.environ.get('BATTLE_STATS_BATCH_SIZE', '500'))
+BATTLE_STATS_POLL_INTERVAL = float(os.environ.get('BATTLE_STATS_POLL_INTERVAL', '2')) # Seconds between polls when the queue is empty
+
+# --- Attack Stats Recalculation (manage.py recalculate_attack_stats) ---
+STATS_RECALCULATION_WORKERS = int(os.environ.get('STATS_RECALCULATION_WORKERS', '2'))
+STATS_RECALCULATION_SHARD_SIZE = int(os.environ.get('STATS_RECALCULATION_SHARD_SIZE', '2000')) # Battle ids per shard
+
+# --- Analytics (daily rollups) ---
+ANALYTICS_DEFAULT_DAYS = int(os.environ.get('ANALYTICS_DEFAULT_DAYS', '30'))
+ANALYTICS_MAX_DAYS = int(os.environ.get('ANALYTICS_MAX_DAYS', '366'))
+
+# --- Battle State / Player Cards ---
+BATTLE_STATE_LOG_TAIL = int(os.environ.get('BATTLE_STATE_LOG_TAIL', '20')) # Log entries sent when the client has none yet
+PLAYER_CARD_MAX_AGE = int(os.environ.get('PLAYER_CARD_MAX_AGE', '86400')) # Seconds; card URLs carry ?v=<card_version>
+
+# --- Profile Pictures (content-addressed, see users/image_storage.py) ---
+# 'database' by default: hosts with an ephemeral disk (Render) lose files on every redeploy.
+# Only use 'filesystem' with a persistent volume mounted at PROFILE_IMAGE_ROOT.
+PROFILE_IMAGE_BACKEND = os.environ.get('PROFILE_IMAGE_BACKEND', 'database') # 'database' or 'filesystem'
+PROFILE_IMAGE_ROOT = os.environ.get('PROFILE_IMAGE_ROOT', str(BASE_DIR / 'media' / 'profile_images'))
+
+# --- Request Timing (see request_timing.py) ---
+# Server-Timing headers + JSON log lines with query count, DB/Lua/serializer time per request.
+# Both default to on under `manage.py test`, so views over their `timing_budget` query count fail tests
+# (time budgets are only logged).
+RUNNING_TESTS = len(sys.argv) > 1 and sys.argv[1] == 'test'
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING_ENABLED', str(RUNNING_TESTS)) == 'True'
+REQUEST_TIMING_ENFORCE_BUDGETS = os.environ.get('REQUEST_TIMING_ENFORCE_BUDGETS', str(RUNNING_TESTS)) == 'True'
+if REQUEST_TIMING_ENABLED:
+    # First, so the numbers cover all other middleware
+    MIDDLEWARE.insert(0, 'request_timing.RequestTimingMiddleware')
+
+# --- Battle Sweeper (manage.py sweep_battles, see game/sweeper.py) ---
+PENDING_BATTLE_EXPIRY_MINUTES = int(os.environ.get('PENDING_BATTLE_EXPIRY_MINUTES', '10'))
+IDLE_BATTLE_FORFEIT_MINUTES = int(os.environ.get('IDLE_BATTLE_FORFEIT_MINUTES', '30')) # No move for this long: whose_turn forfeits
+SWEEPER_BATCH_SIZE = int(os.environ.get('SWEEPER_BATCH_SIZE', '200'))
+SWEEPER_INTERVAL = float(os.environ.get('SWEEPER_INTERVAL', '60')) # Seconds between sweeps with --loop
+
+# --- Matchmaking (manage.py run_matchmaking, see game/matchmaking.py) ---
+MATCHMAKING_BASE_BAND = int(os.environ.get('MATCHMAKING_BASE_BAND', '1')) # Levels either side when joining
+MATCHMAKING_BAND_WIDEN_PER_SECOND = float(os.environ.get('MATCHMAKING_BAND_WIDEN_PER_SECOND', '0.2')) # +1 level every 5s waited
+MATCHMAKING_MAX_BAND = int(os.environ.get('MATCHMAKING_MAX_BAND', '20'))
+MATCHMAKING_TICKET_TTL_MINUTES = int(os.environ.get('MATCHMAKING_TICKET_TTL_MINUTES', '10'))
+MATCHMAKING_INTERVAL = float(os.environ.get('MATCHMAKING_INTERVAL', '1')) # Seconds between pairing passes
+
+# --- Skill Rating (Elo, see game/rating.py; rebuild with manage.py recompute_ratings) ---
+RATING_K = float(os.environ.get('RATING_K', '20'))
+RATING_K_PROVISIONAL = float(os.environ.get('RATING_K_PROVISIONAL', '40')) # Faster movement for new players
+RATING_PROVISIONAL_BATTLES = int(os.environ.get('RATING_PROVISIONAL_BATTLES', '20'))
+
+# --- Battle Archive (manage.py archive_battles, see game/archive.py) ---
+BATTLE_ARCHIVE_AFTER_DAYS = int(os.environ.get('BATTLE_ARCHIVE_AFTER_DAYS', '30')) # Finished battles older than this move to BattleArchive
+BATTLE_ARCHIVE_BATCH_SIZE = int(os.environ.get('BATTLE_ARCHIVE_BATCH_SIZE', '200'))
+# Live (unarchived) logs are loaded whole to be replayed; larger ones get a 413 until archived
+BATTLE_REPLAY_MAX_LIVE_LOG_BYTES = int(os.environ.get('BATTLE_REPLAY_MAX_LIVE_LOG_BYTES', str(5 * 1024 * 1024)))
+
+# --- Auto Battles (AI vs AI, see game/auto_battle.py and manage.py run_auto_battles) ---
+AUTO_BATTLE_MAX_ACTIONS = int(os.environ.get('AUTO_BATTLE_MAX_ACTIONS', '500')) # A match still running after this many actions is a draw
+AUTO_BATTLE_MAX_RUNS = int(os.environ.get('AUTO_BATTLE_MAX_RUNS', '20')) # Matches one request to the auto battle endpoint may play
+AUTO_BATTLE_WORKERS = int(os.environ.get('AUTO_BATTLE_WORKERS', str(os.cpu_count() or 1)))
+
+# --- Chained Actions (POST battles/<id>/actions/, see BattleMultiActionView) ---
+BATTLE_MAX_CHAINED_ACTIONS = int(os.environ.get('BATTLE_MAX_CHAINED_ACTIONS', '10'))
+
+# --- Presence (User.last_seen, see users/presence.py) ---
+PRESENCE_TRACKING_ENABLED = os.environ.get('PRESENCE_TRACKING_ENABLED', 'True') == 'True'
+# Seconds between batched last_seen flushes; 0 writes inline after each request (default under tests)
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '0' if RUNNING_TESTS else '5'))
+PRESENCE_WRITE_INTERVAL = float(os.environ.get('PRESENCE_WRITE_INTERVAL', '60')) # Seconds; at most one write per user per window
+if PRESENCE_TRACKING_ENABLED:
+    # After AuthenticationMiddleware, so the session is available when the response comes back
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1, 'users.presence.PresenceMiddleware')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'request_timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -0,0 +1,61 @@
+"""
+Conditional GET helpers (ETag / Last-Modified / 304).
+
+Views compute their validators from a single cheap `values()` query over version
+columns (`updated_at` and friends) and only fall through to the queryset/serializer
+when the client's copy is stale:
+
+    row = Battle.objects.filter(pk=pk).values('updated_at').first()
+    return conditional_response(request, version_etag(row['updated_at']), row['updated_at'],
+                                partial(super().get, request, *args, **kwargs))
+"""
+
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def version_etag(*parts):
+    """Strong ETag from any number of version values (timestamps, ids, counters)."""
+    digest = hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return quote_etag(digest)
+
+
+def latest(*timestamps):
+    """Most recent of the given datetimes, ignoring None (Last-Modified of a composed resource)."""
+    present = [ts for ts in timestamps if ts is not None]
+    return max(present) if present else None
+
+
+def _add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept',)) # JSON and MessagePack bodies have different ETags
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Per-user data: browsers may keep it but must revalidate on every poll
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_response(request, etag, last_modified, build_response):
+    """Returns 304 Not Modified if the request's validators match, otherwise
+    build_response() (which runs the real queryset and serializer) with ETag and
+    Last-Modified attached to successful responses. The negotiated media type is part
+    of the ETag, since each representation is a different body.
+    """
+    media_type = getattr(request, 'accepted_media_type', None)
+    if media_type:
+        etag = version_etag(etag, media_type)
+    not_modified = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified is not None else None,
+    )
+    if not_modified is not None:
+        return _add_validators(not_modified, etag, last_modified)
+
+    response = build_response()
+    if response.status_code == 200:
+        _add_validators(response, etag, last_modified)
+    return response
@@ -0,0 +1,122 @@
+"""
+Content-addressed storage for profile pictures.
+
+Images are stored once under their SHA-256 and never change, so the URL built from
+the hash (see ProfileImageView) can be cached forever. The user row only keeps the
+hash (User.profile_picture_hash). Two backends, picked by PROFILE_IMAGE_BACKEND:
+
+- 'database':   rows of users.ProfileImage (bytea on Postgres), nothing to mount (default)
+- 'filesystem': files under PROFILE_IMAGE_ROOT/<aa>/<bb>/<hash>; only with a persistent
+                volume, an ephemeral disk loses every picture on redeploy
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def detect_content_type(data):
+    """Content type from the file signature; generated pictures are PNG."""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def decode_base64_image(value):
+    """Bytes of a base64 image (with or without a data: URL prefix), or None if invalid."""
+    if not value:
+        return None
+    if value.startswith('data:') and ',' in value:
+        value = value.split(',', 1)[1]
+    try:
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class FilesystemImageStore:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path_for(self, image_hash):
+        return self.root / image_hash[:2] / image_hash[2:4] / image_hash
+
+    def save(self, image_hash, data):
+        path = self.path_for(image_hash)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def load(self, image_hash):
+        try:
+            return self.path_for(image_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+
+
+class DatabaseImageStore:
+    def __init__(self, model=None):
+        self._model = model # Migrations pass their historical ProfileImage
+
+    @property
+    def model(self):
+        if self._model is None:
+            from .models import ProfileImage
+            self._model = ProfileImage
+        return self._model
+
+    def save(self, image_hash, data):
+        self.model.objects.get_or_create(sha256=image_hash, defaults={'data': data, 'size': len(data)})
+
+    def load(self, image_hash):
+        data = self.model.objects.filter(sha256=image_hash).values_list('data', flat=True).first()
+        return bytes(data) if data is not None else None
+
+
+def get_image_store(profile_image_model=None):
+    backend = settings.PROFILE_IMAGE_BACKEND
+    if backend == 'filesystem':
+        return FilesystemImageStore(settings.PROFILE_IMAGE_ROOT)
+    if backend == 'database':
+        return DatabaseImageStore(profile_image_model)
+    raise ValueError(f"Unknown PROFILE_IMAGE_BACKEND '{backend}' (expected 'filesystem' or 'database').")
+
+
+def store_image(data, store=None):
+    """Stores the image (once per content) and returns its hash."""
+    image_hash = content_hash(data)
+    (store or get_image_store()).save(image_hash, data)
+    return image_hash
+
+
+def load_image(image_hash, store=None):
+    return (store or get_image_store()).load(image_hash)
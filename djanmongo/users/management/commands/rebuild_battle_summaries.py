@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.models import UserBattleSummary
+
+
+class Command(BaseCommand):
+    help = "Recomputes every UserBattleSummary (wins, losses, rounds, nemesis) from the Battle table."
+
+    def handle(self, *args, **options):
+        count = UserBattleSummary.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt battle summaries for {count} users."))
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:38
+
+from django.db import migrations, models
+
+COUNTER_KEYS = ('wins_vs_human', 'losses_vs_human', 'wins_vs_bot', 'losses_vs_bot', 'total_damage_dealt')
+
+
+def copy_stats_json_to_columns(apps, schema_editor):
+    """Moves the counters out of User.stats into the new columns."""
+    User = apps.get_model('users', 'User')
+    batch = []
+    for user in User.objects.only('id', 'stats').iterator(chunk_size=1000):
+        stats = user.stats if isinstance(user.stats, dict) else {}
+        if not any(key in stats for key in COUNTER_KEYS):
+            continue
+        for key in COUNTER_KEYS:
+            value = stats.pop(key, 0)
+            setattr(user, key, value if isinstance(value, int) and value > 0 else 0)
+        user.stats = stats
+        batch.append(user)
+        if len(batch) >= 1000:
+            User.objects.bulk_update(batch, COUNTER_KEYS + ('stats',))
+            batch = []
+    if batch:
+        User.objects.bulk_update(batch, COUNTER_KEYS + ('stats',))
+
+
+def copy_columns_to_stats_json(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    for user in User.objects.iterator(chunk_size=1000):
+        stats = user.stats if isinstance(user.stats, dict) else {}
+        for key in COUNTER_KEYS:
+            stats[key] = getattr(user, key)
+        user.stats = stats
+        user.save(update_fields=['stats'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('game', '0032_attack_is_favorite'),
+        ('users', '0015_remove_user_profile_picture_url_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='losses_vs_bot',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Battles lost against AI-controlled opponents.'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='losses_vs_human',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Battles lost against human opponents.'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='total_damage_dealt',
+            field=models.BigIntegerField(default=0, help_text='Sum of all damage dealt across finished battles.'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='wins_vs_bot',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Battles won against AI-controlled opponents.'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='wins_vs_human',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Battles won against human opponents.'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='stats',
+            field=models.JSONField(default=dict, help_text='Stores additional battle statistics. Win/loss/damage counters live in the columns below.'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-wins_vs_human', 'username'], name='user_leaderboard_idx'),
+        ),
+        migrations.RunPython(copy_stats_json_to_columns, copy_columns_to_stats_json),
+    ]
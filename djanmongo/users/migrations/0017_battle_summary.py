@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Q
+
+
+def build_summaries(apps, schema_editor):
+    """Backfills UserBattleSummary / UserOpponentLosses from finished battles (same rules as UserBattleSummary.rebuild_all)."""
+    Battle = apps.get_model('game', 'Battle')
+    UserBattleSummary = apps.get_model('users', 'UserBattleSummary')
+    UserOpponentLosses = apps.get_model('users', 'UserOpponentLosses')
+
+    finished = Battle.objects.filter(status='finished')
+    summaries = {}
+    for user_field in ('player1_id', 'player2_id'):
+        for user_id, played in finished.values_list(user_field).annotate(n=Count('id')).order_by():
+            summaries.setdefault(user_id, UserBattleSummary(user_id=user_id)).rounds_played += played
+    for user_id, won in finished.filter(winner__isnull=False).values_list('winner_id').annotate(n=Count('id')).order_by():
+        summaries.setdefault(user_id, UserBattleSummary(user_id=user_id)).wins += won
+
+    opponent_losses = {}
+    for user_field, opponent_field in (('player1_id', 'player2_id'), ('player2_id', 'player1_id')):
+        lost = finished.filter(Q(winner__isnull=True) | ~Q(winner_id=F(user_field)))
+        for user_id, opponent_id, n in lost.values_list(user_field, opponent_field).annotate(n=Count('id')).order_by():
+            opponent_losses[(user_id, opponent_id)] = opponent_losses.get((user_id, opponent_id), 0) + n
+
+    for summary in summaries.values():
+        summary.losses = summary.rounds_played - summary.wins
+    for (user_id, opponent_id), n in sorted(opponent_losses.items()):
+        summary = summaries[user_id]
+        if n > summary.nemesis_losses:
+            summary.nemesis_id, summary.nemesis_losses = opponent_id, n
+
+    UserBattleSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+    UserOpponentLosses.objects.bulk_create(
+        [UserOpponentLosses(user_id=user_id, opponent_id=opponent_id, losses=n) for (user_id, opponent_id), n in opponent_losses.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_user_battle_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBattleSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='battle_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('rounds_played', models.PositiveIntegerField(default=0)),
+                ('nemesis_losses', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('nemesis', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserOpponentLosses',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('opponent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opponent_losses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-losses'], name='user_opponent_losses_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'opponent'), name='unique_user_opponent_losses')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
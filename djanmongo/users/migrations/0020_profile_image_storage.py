@@ -0,0 +1,113 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:01
+
+import base64
+import binascii
+import hashlib
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of users.image_storage as of this migration (decode, hash, both backends),
+# so later changes to that module cannot break migrating from scratch.
+
+
+def _decode_base64_image(value):
+    if value.startswith('data:') and ',' in value:
+        value = value.split(',', 1)[1]
+    try:
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class _ImageStore:
+    """Saves/loads images under their SHA-256 with the configured backend."""
+
+    def __init__(self, apps):
+        self.backend = settings.PROFILE_IMAGE_BACKEND
+        if self.backend not in ('database', 'filesystem'):
+            raise ValueError(f"Unknown PROFILE_IMAGE_BACKEND '{self.backend}' (expected 'filesystem' or 'database').")
+        self.ProfileImage = apps.get_model('users', 'ProfileImage')
+        self.root = Path(settings.PROFILE_IMAGE_ROOT)
+
+    def _path(self, image_hash):
+        return self.root / image_hash[:2] / image_hash[2:4] / image_hash
+
+    def save(self, data):
+        image_hash = hashlib.sha256(data).hexdigest()
+        if self.backend == 'database':
+            self.ProfileImage.objects.get_or_create(sha256=image_hash, defaults={'data': data, 'size': len(data)})
+            return image_hash
+        path = self._path(image_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        return image_hash
+
+    def load(self, image_hash):
+        if self.backend == 'database':
+            data = self.ProfileImage.objects.filter(sha256=image_hash).values_list('data', flat=True).first()
+            return bytes(data) if data is not None else None
+        try:
+            return self._path(image_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+
+
+def move_pictures_to_storage(apps, schema_editor):
+    """Moves base64 profile pictures into content-addressed storage, keeping only the hash on the user."""
+    User = apps.get_model('users', 'User')
+    store = _ImageStore(apps)
+    moved = skipped = 0
+    pictures = User.objects.exclude(profile_picture_base64__isnull=True).exclude(profile_picture_base64='')
+    for user_id, value in pictures.values_list('id', 'profile_picture_base64').iterator(chunk_size=100):
+        data = _decode_base64_image(value)
+        if not data:
+            skipped += 1
+            continue
+        User.objects.filter(pk=user_id).update(profile_picture_hash=store.save(data))
+        moved += 1
+    if moved or skipped:
+        print(f"\n  [Migration] Moved {moved} profile pictures to storage ({skipped} undecodable skipped).")
+
+
+def restore_base64_pictures(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    store = _ImageStore(apps)
+    for user_id, image_hash in User.objects.exclude(profile_picture_hash__isnull=True).exclude(profile_picture_hash='').values_list('id', 'profile_picture_hash').iterator():
+        data = store.load(image_hash)
+        if data is not None:
+            User.objects.filter(pk=user_id).update(profile_picture_base64=base64.b64encode(data).decode('ascii'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_user_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileImage',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_picture_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the profile picture in image storage.', max_length=64, null=True),
+        ),
+        migrations.RunPython(move_pictures_to_storage, restore_base64_pictures),
+        migrations.RemoveField(
+            model_name='user',
+            name='profile_picture_base64',
+        ),
+    ]
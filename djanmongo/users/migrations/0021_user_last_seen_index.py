@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_profile_image_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_seen',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Last time the user made an authenticated request.'),
+        ),
+    ]
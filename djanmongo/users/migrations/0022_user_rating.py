@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('game', '0039_matchmaking_ticket'),
+        ('users', '0021_user_last_seen_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rated_battles',
+            field=models.PositiveIntegerField(default=0, help_text='Rated battles played; fewer than RATING_PROVISIONAL_BATTLES use the provisional K-factor.'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='rating',
+            field=models.FloatField(default=1500.0, help_text='Elo rating from rated (human vs human) battles.'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-rating', 'username'], name='user_rating_idx'),
+        ),
+    ]
@@ -1,10 +1,9 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MaxValueValidator
-from django.db.models import Q, Count
+from django.db.models import Q, Count, F
 from django.db import models as db_models
 from django.utils import timezone # Added for default value
-import json # For JSONField default
 
 # --- NEW: Import Django Settings --- 
 from django.conf import settings
@@ -13,6 +12,8 @@ from django.conf import settings
 # Import Attack model safely for relationship definition
 from game.models import Attack
 
+DEFAULT_RATING = 1500.0 # Elo rating of a new player
+
 class User(AbstractUser):
     # Basic stats
     level = models.IntegerField(default=1)
@@ -25,13 +26,17 @@ class User(AbstractUser):
     booster_credits = models.PositiveIntegerField(default=100, help_text="Currency earned from battles to open boosters.")
 
     # NEW: Track user activity
-    last_seen = models.DateTimeField(default=timezone.now, help_text="Last time the user made an authenticated request.")
+    last_seen = models.DateTimeField(default=timezone.now, db_index=True, help_text="Last time the user made an authenticated request.") # Indexed for the "online in the last N minutes" directory filter
+    # Bumped by every full save(); partial saves must list it in update_fields when they touch card fields.
+    # Versions the player card (PlayerCardView) so clients can cache it.
+    updated_at = models.DateTimeField(auto_now=True)
 
-    # NEW: Profile Picture fields (Storing Base64)
-    profile_picture_base64 = models.TextField(
-        blank=True, 
-        null=True, 
-        help_text="Base64 encoded string of the generated profile picture."
+    # Profile picture: SHA-256 of the image in content-addressed storage (see users/image_storage.py)
+    profile_picture_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="SHA-256 of the profile picture in image storage."
     )
     profile_picture_prompt = models.TextField(
         blank=True, 
@@ -64,61 +69,89 @@ class User(AbstractUser):
     # NEW: Store detailed battle stats
     stats = models.JSONField(
         default=dict, 
-        help_text="Stores battle statistics like wins/losses vs human/bot, damage dealt etc."
+        help_text="Stores additional battle statistics. Win/loss/damage counters live in the columns below."
     )
 
+    # --- Battle counters (indexed for leaderboard ordering) ---
+    wins_vs_human = models.PositiveIntegerField(default=0, db_index=True, help_text="Battles won against human opponents.")
+    losses_vs_human = models.PositiveIntegerField(default=0, db_index=True, help_text="Battles lost against human opponents.")
+    wins_vs_bot = models.PositiveIntegerField(default=0, db_index=True, help_text="Battles won against AI-controlled opponents.")
+    losses_vs_bot = models.PositiveIntegerField(default=0, db_index=True, help_text="Battles lost against AI-controlled opponents.")
+    total_damage_dealt = models.BigIntegerField(default=0, help_text="Sum of all damage dealt across finished battles.")
+    # --- END Battle counters ---
+
+    # --- Skill rating (Elo, see game/rating.py) ---
+    rating = models.FloatField(default=DEFAULT_RATING, help_text="Elo rating from rated (human vs human) battles.")
+    rated_battles = models.PositiveIntegerField(default=0, help_text="Rated battles played; fewer than RATING_PROVISIONAL_BATTLES use the provisional K-factor.")
+    # --- END Skill rating ---
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Serves LeaderboardView's ORDER BY without sorting the whole table
+            models.Index(fields=['-wins_vs_human', 'username'], name='user_leaderboard_idx'),
+            # Rating leaderboard ordering and rating range filters
+            models.Index(fields=['-rating', 'username'], name='user_rating_idx'),
+        ]
+
     def __str__(self):
         return f"{self.username} (Lvl {self.level})"
 
+    @staticmethod
+    def card_version_for(updated_at):
+        """Integer version of a player card (microseconds since epoch of updated_at)."""
+        return int(updated_at.timestamp() * 1_000_000) if updated_at else 0
+
+    @property
+    def card_version(self):
+        return self.card_version_for(self.updated_at)
+
+    @property
+    def profile_picture_url(self):
+        """Immutable URL of the profile picture (changes with the picture), or None."""
+        if not self.profile_picture_hash:
+            return None
+        from django.urls import reverse
+        return reverse('user_profile_image', args=[self.profile_picture_hash])
+
     # --- Leaderboard Stats ---
 
     def get_total_wins(self):
         """Counts the number of finished battles this user has won."""
         # Ensure we import Battle model locally to avoid potential circular imports at module level
         from game.models import Battle 
-        return Battle.objects.filter(winner=self, status='finished').count()
+        return Battle.objects.filter(winner=self, status='finished', player1_is_ai_controlled=False).count()
 
     def get_total_losses(self):
         """Counts the number of finished battles this user has lost."""
-        from game.models import Battle
+        from game.models import BattleParticipant
         # Battles where the user participated but was not the winner, and the battle is finished
-        return Battle.objects.filter(
-            Q(player1=self) | Q(player2=self), 
-            status='finished'
-        ).exclude(winner=self).count()
+        return BattleParticipant.objects.filter(
+            user=self,
+            status='finished',
+            battle__player1_is_ai_controlled=False, # Auto battles are not counted
+        ).exclude(battle__winner=self).count()
 
     def get_total_rounds_played(self):
         """Counts the total number of finished battles this user participated in."""
-        from game.models import Battle
-        return Battle.objects.filter(
-            Q(player1=self) | Q(player2=self), 
-            status='finished'
-        ).count()
+        from game.models import BattleParticipant
+        return BattleParticipant.objects.filter(user=self, status='finished', battle__player1_is_ai_controlled=False).count()
 
     def get_nemesis(self):
         """Finds the opponent the user has lost to the most using DB aggregation."""
-        from game.models import Battle
-        from django.db.models import Count, Case, When, F, Q, IntegerField # Import necessary functions
-
-        # Filter finished battles where this user participated but did not win
-        lost_battles_base_qs = Battle.objects.filter(
-            Q(player1=self) | Q(player2=self),
-            status='finished'
-        ).exclude(winner=self)
-
-        # Annotate with the opponent's ID, group by it, count, and order
-        opponent_losses = lost_battles_base_qs.annotate(
-            # Determine opponent ID based on who player1/player2 is
-            opponent_id=Case(
-                When(player1=self, then=F('player2_id')),
-                When(player2=self, then=F('player1_id')),
-                # default=Value(None), # Should not happen due to the initial filter
-                output_field=IntegerField(), # Specify the output type
-            )
+        from game.models import BattleParticipant
+        from django.db.models import Count # Import necessary functions
+
+        # Finished battles where this user participated but did not win, grouped by opponent
+        opponent_losses = BattleParticipant.objects.filter(
+            user=self,
+            status='finished',
+            battle__player1_is_ai_controlled=False,
+        ).exclude(
+            battle__winner=self
         ).values(
-            'opponent_id' # Group by the annotated opponent_id
+            'opponent_id' # Group by the opponent
         ).annotate(
-            losses=Count('opponent_id') # Count battles for each opponent_id group
+            losses=Count('id') # Count battles for each opponent_id group
         ).order_by(
             '-losses' # Order by the count descending to get the highest first
         )
@@ -144,49 +177,232 @@ class User(AbstractUser):
             return None
 
     # --- NEW: Method to update stats after a battle --- 
-    def update_stats_on_battle_end(self, is_winner, is_vs_bot, damage_dealt=0):
-        """Updates stats stored in the profile's JSON field after a battle.
-           Also updates the user's booster credits.
+    @staticmethod
+    def battle_end_increments(is_winner, is_vs_bot, damage_dealt=0):
+        """Returns {field: increment} for one finished battle (counters, damage and booster credits).
+           Shared by update_stats_on_battle_end and the batched stats worker (game.battle_stats).
         """
-        # Ensure stats is a dictionary
-        if not isinstance(self.stats, dict):
-            # Attempt to load if it's a string, otherwise reset
-            try:
-                loaded_stats = json.loads(self.stats) if isinstance(self.stats, str) else {}
-                self.stats = loaded_stats if isinstance(loaded_stats, dict) else {}
-            except json.JSONDecodeError:
-                self.stats = {}
-
-        # Ensure keys exist and increment damage
-        self.stats.setdefault('wins_vs_human', 0)
-        self.stats.setdefault('losses_vs_human', 0)
-        self.stats.setdefault('wins_vs_bot', 0)
-        self.stats.setdefault('losses_vs_bot', 0)
-        self.stats.setdefault('total_damage_dealt', 0)
-        # self.stats.setdefault('total_battles', 0) # Optional: track total battles
-
-        self.stats['total_damage_dealt'] += damage_dealt
-        # self.stats['total_battles'] += 1 # Optional
-
-        # --- NEW: Calculate and Update Booster Credits ---
-        credits_earned = 0
         if is_winner:
-            if is_vs_bot:
-                self.stats['wins_vs_bot'] += 1
-                credits_earned = settings.CREDITS_WIN_VS_BOT # Use settings
-            else:
-                self.stats['wins_vs_human'] += 1
-                credits_earned = settings.CREDITS_WIN_VS_HUMAN # Use settings
+            counter = 'wins_vs_bot' if is_vs_bot else 'wins_vs_human'
+            credits_earned = settings.CREDITS_WIN_VS_BOT if is_vs_bot else settings.CREDITS_WIN_VS_HUMAN
         else: # Loser
-            if is_vs_bot:
-                self.stats['losses_vs_bot'] += 1
-            else:
-                self.stats['losses_vs_human'] += 1
-            credits_earned = settings.CREDITS_LOSS # Use settings
+            counter = 'losses_vs_bot' if is_vs_bot else 'losses_vs_human'
+            credits_earned = settings.CREDITS_LOSS
+        return {counter: 1, 'total_damage_dealt': damage_dealt, 'booster_credits': credits_earned}
 
-        self.booster_credits = (self.booster_credits or 0) + credits_earned # Ensure booster_credits is not None
-        # --- END NEW ---
+    def update_stats_on_battle_end(self, is_winner, is_vs_bot, damage_dealt=0):
+        """Updates the battle counters and booster credits after a battle.
+           Uses a single F()-based UPDATE so concurrent battle endings cannot lose increments.
+        """
+        increments = self.battle_end_increments(is_winner, is_vs_bot, damage_dealt)
+        credits_earned = increments['booster_credits']
 
-        # Save the updated stats and booster_credits fields
-        self.save(update_fields=['stats', 'booster_credits'])
+        User.objects.filter(pk=self.pk).update(**{field: F(field) + n for field, n in increments.items()})
+        # Keep the in-memory instance consistent with the row
+        self.refresh_from_db(fields=['wins_vs_human', 'losses_vs_human', 'wins_vs_bot', 'losses_vs_bot', 'total_damage_dealt', 'booster_credits'])
         print(f"[Stats Update - User] User {self.username} awarded {credits_earned} credits. New total: {self.booster_credits}") # Add logging
+
+
+# --- Profile Image Blobs (PROFILE_IMAGE_BACKEND = 'database') ---
+class ProfileImage(models.Model):
+    """Content-addressed image bytes, keyed by SHA-256. Rows are written once and never updated."""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]}… ({self.size} bytes)"
+# --- END Profile Image Blobs ---
+
+
+# --- NEW: Materialised Battle Summary ---
+class UserBattleSummary(models.Model):
+    """Per-user totals over finished battles, kept up to date incrementally.
+
+    Replaces the COUNT/GROUP BY queries the stats endpoint used to run on every view
+    (see User.get_total_wins / get_nemesis, which remain as the reference definitions):
+    a loss is any finished battle the user took part in and did not win, and the
+    nemesis is the opponent with the most such losses (ties: lowest user id).
+    Rebuild from scratch with `manage.py rebuild_battle_summaries`.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='battle_summary')
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    rounds_played = models.PositiveIntegerField(default=0)
+    nemesis = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    nemesis_losses = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary for user {self.user_id}: {self.wins}W/{self.losses}L"
+
+    @staticmethod
+    def battle_increments(battle):
+        """Returns ({user_id: {field: n}}, {(user_id, opponent_id): losses}) for one finished battle."""
+        summary_increments, opponent_losses = {}, {}
+        for user_id, opponent_id in ((battle.player1_id, battle.player2_id), (battle.player2_id, battle.player1_id)):
+            if not user_id:
+                continue
+            won = battle.winner_id is not None and battle.winner_id == user_id
+            summary_increments[user_id] = {'rounds_played': 1, 'wins' if won else 'losses': 1}
+            if not won and opponent_id:
+                opponent_losses[(user_id, opponent_id)] = 1
+        return summary_increments, opponent_losses
+
+    @classmethod
+    def record_battles(cls, battles):
+        """Adds finished battles that did not go through the stats pipeline (e.g. concessions)
+           to the summaries and the daily user rollup.
+        """
+        from collections import Counter, defaultdict
+        from game.battle_stats import upsert_increments # Local import: game.battle_stats imports game.models
+        summary_increments, opponent_losses, daily_increments = defaultdict(Counter), Counter(), defaultdict(Counter)
+        for battle in battles:
+            battle_summary, battle_losses = cls.battle_increments(battle)
+            for user_id, increments in battle_summary.items():
+                summary_increments[user_id].update(increments)
+            opponent_losses.update(battle_losses)
+            for key, increments in UserDailyStats.battle_increments(battle).items():
+                daily_increments[key].update(increments)
+        cls.apply_increments(summary_increments, opponent_losses)
+        upsert_increments(UserDailyStats, ('user_id', 'date'), daily_increments)
+
+    @classmethod
+    def apply_increments(cls, summary_increments, opponent_losses):
+        """Applies {user_id: {field: n}} and {(user_id, opponent_id): n} with set-based F() updates,
+           then re-derives the nemesis of every user who gained a loss. Call inside a transaction.
+        """
+        from game.battle_stats import _case_increments # Local import: game.battle_stats imports game.models
+
+        if summary_increments:
+            cls.objects.bulk_create([cls(user_id=user_id) for user_id in summary_increments], ignore_conflicts=True)
+            cls.objects.filter(pk__in=summary_increments.keys()).update(**_case_increments('user_id', summary_increments))
+        if not opponent_losses:
+            return
+
+        UserOpponentLosses.objects.bulk_create(
+            [UserOpponentLosses(user_id=user_id, opponent_id=opponent_id, losses=0) for user_id, opponent_id in opponent_losses],
+            ignore_conflicts=True,
+        )
+        pair_filter = Q()
+        whens = []
+        for (user_id, opponent_id), n in opponent_losses.items():
+            pair_filter |= Q(user_id=user_id, opponent_id=opponent_id)
+            whens.append(models.When(user_id=user_id, opponent_id=opponent_id, then=models.Value(n)))
+        UserOpponentLosses.objects.filter(pair_filter).update(
+            losses=F('losses') + models.Case(*whens, default=models.Value(0), output_field=models.IntegerField())
+        )
+        cls.refresh_nemeses({user_id for user_id, _ in opponent_losses})
+
+    @classmethod
+    def refresh_nemeses(cls, user_ids):
+        """Sets nemesis/nemesis_losses from UserOpponentLosses for the given users (one ranked query)."""
+        from django.db.models import Window
+        from django.db.models.functions import RowNumber
+
+        top_rows = (
+            UserOpponentLosses.objects
+            .filter(user_id__in=user_ids, losses__gt=0)
+            .annotate(rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('user_id')],
+                order_by=[F('losses').desc(), F('opponent_id').asc()],
+            ))
+            .filter(rank=1)
+            .values_list('user_id', 'opponent_id', 'losses')
+        )
+        summaries = [cls(user_id=user_id, nemesis_id=opponent_id, nemesis_losses=losses) for user_id, opponent_id, losses in top_rows]
+        cls.objects.bulk_update(summaries, ['nemesis', 'nemesis_losses'])
+
+    @classmethod
+    def rebuild_all(cls):
+        """Recomputes every summary and per-opponent count from the Battle table. Returns the number of users."""
+        from game.models import Battle
+
+        # Auto battles (AI on both sides) never reach the live counters either
+        finished = Battle.objects.filter(status='finished', player1_is_ai_controlled=False)
+        summaries = {}
+
+        def summary_for(user_id):
+            return summaries.setdefault(user_id, cls(user_id=user_id))
+
+        for user_field in ('player1_id', 'player2_id'):
+            for user_id, played in finished.values_list(user_field).annotate(n=Count('id')).order_by():
+                summary_for(user_id).rounds_played += played
+        for user_id, won in finished.filter(winner__isnull=False).values_list('winner_id').annotate(n=Count('id')).order_by():
+            summary_for(user_id).wins += won
+
+        opponent_losses = {}
+        for user_field, opponent_field in (('player1_id', 'player2_id'), ('player2_id', 'player1_id')):
+            lost = finished.filter(Q(winner__isnull=True) | ~Q(winner_id=F(user_field)))
+            for user_id, opponent_id, n in lost.values_list(user_field, opponent_field).annotate(n=Count('id')).order_by():
+                opponent_losses[(user_id, opponent_id)] = opponent_losses.get((user_id, opponent_id), 0) + n
+
+        for summary in summaries.values():
+            summary.losses = summary.rounds_played - summary.wins
+        for (user_id, opponent_id), n in sorted(opponent_losses.items()):
+            summary = summary_for(user_id)
+            if n > summary.nemesis_losses:
+                summary.nemesis_id, summary.nemesis_losses = opponent_id, n
+
+        with transaction.atomic():
+            UserOpponentLosses.objects.all().delete()
+            cls.objects.all().delete()
+            cls.objects.bulk_create(summaries.values(), batch_size=1000)
+            UserOpponentLosses.objects.bulk_create(
+                [UserOpponentLosses(user_id=user_id, opponent_id=opponent_id, losses=n) for (user_id, opponent_id), n in opponent_losses.items()],
+                batch_size=1000,
+            )
+        return len(summaries)
+
+
+class UserOpponentLosses(models.Model):
+    """How many finished battles `user` lost against `opponent` (feeds UserBattleSummary.nemesis)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='opponent_losses')
+    opponent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    losses = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'opponent'], name='unique_user_opponent_losses'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-losses'], name='user_opponent_losses_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} lost {self.losses}x to {self.opponent_id}"
+# --- END Materialised Battle Summary ---
+
+
+# --- NEW: Daily User Rollup ---
+class UserDailyStats(models.Model):
+    """Battles and wins of a user for one day (the local date the battle finished).
+
+    Filled incrementally alongside UserBattleSummary; `manage.py backfill_daily_rollups`
+    rebuilds past days.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    battles = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_user_daily_stats'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} on {self.date}: {self.wins}/{self.battles} won"
+
+    @staticmethod
+    def battle_increments(battle):
+        """Returns {(user_id, date): {field: n}} for one finished battle."""
+        day = timezone.localdate(battle.updated_at) if battle.updated_at else timezone.localdate()
+        increments = {}
+        for user_id in {battle.player1_id, battle.player2_id} - {None}:
+            won = battle.winner_id is not None and battle.winner_id == user_id
+            increments[(user_id, day)] = {'battles': 1, 'wins': 1 if won else 0}
+        return increments
+# --- END Daily User Rollup ---
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import time
+from operator import attrgetter
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+LEADERBOARD_CACHE_VERSION_KEY = 'leaderboards:version'
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination that seeks on the full ordering tuple.
+
+    Unlike OFFSET paging (or DRF's CursorPagination, which offsets through ties of
+    the first field), every page is a single index range scan: the cursor carries
+    the ordering values of the last row and the next page filters strictly after them.
+    The last field of `ordering` must be unique so the ordering is total.
+
+    Cursors are signed (django.core.signing): the page index decides whether a page
+    may be cached, so clients must not be able to forge it.
+    """
+    ordering = ()
+    page_size = 50
+    max_page_size = 100 # Hard cap, enforced even if the client asks for more
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_salt = 'users.pagination.cursor'
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def decode_cursor(self, request, model):
+        """Returns {'v': [ordering values], 'p': page index} or None for the first page.
+        A tampered cursor is a 404; every value is still converted with its model field.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = signing.loads(encoded, salt=self.cursor_salt)
+            if not isinstance(cursor, dict) or not isinstance(cursor.get('v'), list) or len(cursor['v']) != len(self.ordering):
+                raise ValueError
+            cursor['v'] = [self._cursor_value(model, field, value) for field, value in zip(self.ordering, cursor['v'])]
+            cursor['p'] = int(cursor.get('p', 1))
+            if cursor['p'] < 0:
+                raise ValueError
+        except (signing.BadSignature, TypeError, ValueError, AttributeError, DjangoValidationError, FieldDoesNotExist):
+            raise NotFound('Invalid cursor')
+        return cursor
+
+    @staticmethod
+    def _cursor_value(model, field, value):
+        """Converts one cursor value with the model field it seeks on (ordering fields are not null)."""
+        if value is None or isinstance(value, (dict, list, bool)):
+            raise ValueError
+        *relations, name = field.lstrip('-').split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name).to_python(value)
+
+    def encode_cursor(self, values, page_index):
+        return signing.dumps({'v': values, 'p': page_index}, salt=self.cursor_salt)
+
+    def _seek_filter(self, values):
+        """Builds (a < x) OR (a = x AND b > y) ... honouring each field's direction."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            term = Q(**{f"{field.lstrip('-')}__{'lt' if field.startswith('-') else 'gt'}": values[i]})
+            for prior_field, prior_value in zip(self.ordering[:i], values[:i]):
+                term &= Q(**{prior_field.lstrip('-'): prior_value})
+            condition |= term
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        self.page_index = cursor['p'] if cursor else 0
+
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._seek_filter(cursor['v']))
+
+        rows = list(queryset[:self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.next_values = None
+        if self.has_next:
+            last = rows[-1]
+            self.next_values = [attrgetter(field.lstrip('-').replace('__', '.'))(last) for field in self.ordering]
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_values, self.page_index + 1))
+
+    def get_first_link(self):
+        if self.page_index == 0:
+            return None
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_page_state(self):
+        """What get_paginated_response needs besides the rows (cached with them, without links)."""
+        return {'page_index': self.page_index, 'has_next': self.has_next, 'next_values': self.next_values}
+
+    def restore_page_state(self, request, state):
+        """Restores get_page_state() for this request, so the links are built from its own URL."""
+        self.request = request
+        self.page_index = state['page_index']
+        self.has_next = state['has_next']
+        self.next_values = state['next_values']
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'first': self.get_first_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    # --- Page cache support ---
+
+    def get_page_cache_key(self, request, prefix, model, filter_params=()):
+        """Cache key for this page, or None if the page is too deep to be worth caching.
+
+        Built from the decoded (signed) cursor, the page size and the view's own filter
+        params only, so unknown query parameters cannot create extra cache entries.
+        """
+        cursor = self.decode_cursor(request, model)
+        page_index = cursor['p'] if cursor else 0
+        if page_index >= settings.LEADERBOARD_CACHED_PAGES:
+            return None
+        version = cache.get_or_set(LEADERBOARD_CACHE_VERSION_KEY, int(time.time()), None)
+        key_parts = {
+            'cursor': [cursor['v'], page_index] if cursor else None,
+            'filters': [[param, request.query_params.get(param)] for param in sorted(filter_params) if param in request.query_params],
+        }
+        digest = hashlib.sha1(json.dumps(key_parts, default=str, separators=(',', ':')).encode('utf-8')).hexdigest()
+        return f"leaderboards:{prefix}:{version}:{self.get_page_size(request)}:{digest}"
+
+
+class LeaderboardPagination(KeysetPagination):
+    """User leaderboard: most wins vs humans first; username is unique and breaks ties."""
+    ordering = ('-wins_vs_human', 'username')
+
+
+class RatingLeaderboardPagination(KeysetPagination):
+    """Rating leaderboard: highest Elo rating first (user_rating_idx); username breaks ties."""
+    ordering = ('-rating', 'username')
+
+
+class UserDirectoryPagination(KeysetPagination):
+    """Player directory: alphabetical; username is unique, so it alone is a total order."""
+    ordering = ('username',)
+    page_size = 50
+
+
+class CachedLeaderboardPageMixin:
+    """Serves the first LEADERBOARD_CACHED_PAGES pages of a keyset-paginated list from the cache.
+
+    Entries expire after LEADERBOARD_CACHE_TTL seconds and are dropped early when a
+    finished battle bumps the version (see bump_leaderboard_cache_version). Only the rows
+    and the paginator state are cached; `next`/`first` are rebuilt for every request.
+    """
+    page_cache_prefix = None
+    page_cache_filter_params = () # Query params that change the page (part of the cache key)
+
+    def list(self, request, *args, **kwargs):
+        cache_key = self.paginator.get_page_cache_key(
+            request, self.page_cache_prefix, self.get_queryset().model, self.page_cache_filter_params,
+        )
+        if cache_key:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.paginator.restore_page_state(request, cached['state'])
+                return self.paginator.get_paginated_response(cached['results'])
+
+        response = super().list(request, *args, **kwargs)
+        if cache_key and response.status_code == 200:
+            cache.set(cache_key, {'results': response.data['results'], 'state': self.paginator.get_page_state()}, settings.LEADERBOARD_CACHE_TTL)
+        return response
+
+
+def bump_leaderboard_cache_version():
+    """Invalidates every cached leaderboard page (called when a battle finishes)."""
+    try:
+        cache.incr(LEADERBOARD_CACHE_VERSION_KEY)
+    except ValueError:
+        # Key missing or evicted: start from a timestamp so old versions are never reused
+        cache.set(LEADERBOARD_CACHE_VERSION_KEY, int(time.time()), None)
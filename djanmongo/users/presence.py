@@ -0,0 +1,146 @@
+"""
+Write-coalescing presence tracking for `User.last_seen`.
+
+PresenceMiddleware records the user of every authenticated request in a per-process
+map ({user_id: last activity}) instead of saving the user. The map is flushed with one
+`UPDATE ... SET last_seen = CASE id WHEN ... END` per batch:
+
+- by a daemon thread every PRESENCE_FLUSH_INTERVAL seconds (inline after each request
+  when the interval is 0, the default under `manage.py test`),
+- and once more at interpreter exit.
+
+A user already written within PRESENCE_WRITE_INTERVAL seconds is not queued again, so a
+client polling every few seconds costs one row update per window, not one per request.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+# Users per UPDATE statement (keeps the CASE expression and the IN list bounded)
+FLUSH_BATCH_SIZE = 500
+
+
+class PresenceTracker:
+    def __init__(self, flush_interval, write_interval):
+        self.flush_interval = flush_interval
+        self.write_interval = write_interval
+        self._pending = {}      # user_id -> datetime of the latest activity not yet written
+        self._written = {}      # user_id -> monotonic time of the last write (coalescing window)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def record(self, user_id, seen_at=None):
+        """Notes activity for user_id. Returns True if it was queued for the next flush."""
+        now = time.monotonic()
+        with self._lock:
+            written = self._written.get(user_id)
+            if user_id not in self._pending and written is not None and now - written < self.write_interval:
+                return False
+            self._pending[user_id] = seen_at or timezone.now()
+        self._ensure_flusher()
+        return True
+
+    def flush(self):
+        """Writes all pending activity to the database. Returns the number of users updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            now = time.monotonic()
+            for user_id in pending:
+                self._written[user_id] = now
+            # Forget users whose window has passed, so the map only holds recently active users
+            self._written = {uid: ts for uid, ts in self._written.items() if now - ts < self.write_interval}
+        if not pending:
+            return 0
+
+        from .models import User
+
+        items = list(pending.items())
+        updated = 0
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = items[start:start + FLUSH_BATCH_SIZE]
+            # update() skips auto_now, so presence never bumps updated_at (player card versions)
+            updated += User.objects.filter(pk__in=[user_id for user_id, _ in batch]).update(
+                last_seen=Case(
+                    *(When(pk=user_id, then=Value(seen_at)) for user_id, seen_at in batch),
+                    output_field=DateTimeField(),
+                )
+            )
+        return updated
+
+    def _ensure_flusher(self):
+        if self.flush_interval <= 0:
+            return
+        # Worker processes forked after the first request need their own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='presence-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception as e:
+                # The batch is dropped, not retried: presence is best-effort and the map must stay bounded
+                print(f"[Presence] Flush failed: {e}")
+
+    def shutdown(self):
+        """Stops the flusher thread and writes whatever is still pending."""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[Presence] Final flush failed: {e}")
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_presence_tracker() -> PresenceTracker:
+    """Returns the process-wide tracker configured from settings."""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = PresenceTracker(
+                    flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 5),
+                    write_interval=getattr(settings, 'PRESENCE_WRITE_INTERVAL', 60),
+                )
+                atexit.register(_tracker.shutdown)
+    return _tracker
+
+
+class PresenceMiddleware:
+    """Records request activity of logged-in users (see PresenceTracker)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.tracker = get_presence_tracker()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, 'session', None)
+        # Only sessions the request already loaded (authenticated views do), so this adds no query
+        user_id = session.get(SESSION_KEY) if session is not None and session.accessed else None
+        if user_id is not None:
+            from .models import User
+            queued = self.tracker.record(User._meta.pk.to_python(user_id))
+            if queued and self.tracker.flush_interval <= 0:
+                self.tracker.flush()
+        return response
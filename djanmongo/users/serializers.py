@@ -3,9 +3,8 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
-import json
 
-from .models import User
+from .models import User, UserBattleSummary
 # Import AttackSerializer locally where needed to avoid potential circular imports at module level
 # from game.serializers import AttackSerializer 
 
@@ -40,7 +39,9 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return user
 
 class BasicUserSerializer(serializers.ModelSerializer):
-    """A basic serializer for listing users, now including profile picture."""
+    """A basic serializer for listing users, now including profile picture (as an immutable URL)."""
+    profile_picture_url = serializers.CharField(read_only=True)
+
     class Meta:
         model = User
         fields = (
@@ -48,9 +49,42 @@ class BasicUserSerializer(serializers.ModelSerializer):
             'username', 
             'level', 
             'allow_bot_challenges', 
-            'profile_picture_base64'
+            'profile_picture_url'
         )
 
+# --- Player Card ---
+class PlayerCardSerializer(serializers.ModelSerializer):
+    """The public, rarely changing part of a player shown next to a battle.
+    Served by PlayerCardView (cacheable, versioned by `card_version`) instead of being
+    nested in every battle-state response.
+    """
+    card_version = serializers.IntegerField(read_only=True)
+    profile_picture_url = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = (
+            'id', 'username', 'level',
+            'hp', 'attack', 'defense', 'speed',
+            'allow_bot_challenges',
+            'profile_picture_url',
+            'card_version',
+        )
+        read_only_fields = fields
+
+PLAYER_CARD_FIELDS = ('id', 'username', 'level', 'hp', 'attack', 'defense', 'speed',
+                      'allow_bot_challenges', 'profile_picture_hash', 'updated_at')
+# --- END Player Card ---
+
+class DirectoryUserSerializer(BasicUserSerializer):
+    """Player directory entry: BasicUserSerializer plus presence.
+    `in_active_battle` is annotated by UserListView (one EXISTS subquery in the list query).
+    """
+    in_active_battle = serializers.BooleanField(read_only=True)
+
+    class Meta(BasicUserSerializer.Meta):
+        fields = BasicUserSerializer.Meta.fields + ('last_seen', 'in_active_battle')
+
 class UserProfileSerializer(serializers.ModelSerializer):
     # Use a SerializerMethodField to avoid circular import
     attacks = serializers.SerializerMethodField()
@@ -69,9 +103,13 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
 # --- Updated UserSerializer --- 
 class UserSerializer(serializers.ModelSerializer):
-    """Serializer for the full user profile, including selected attacks."""
+    """Serializer for the full user profile, including selected attacks.
+    List/nested callers should prefetch 'attacks' and 'selected_attacks' (see game.views.battle_queryset_for_serializer).
+    """
     attacks = serializers.SerializerMethodField() 
     selected_attacks = serializers.SerializerMethodField()
+    stats = serializers.SerializerMethodField()
+    profile_picture_url = serializers.CharField(read_only=True)
 
     class Meta:
         model = User
@@ -81,14 +119,15 @@ class UserSerializer(serializers.ModelSerializer):
             'attacks', 'selected_attacks', 'booster_credits',
             'allow_bot_challenges', 'last_seen', # Added last_seen
             'stats', # Added stats
-            'profile_picture_base64', 'profile_picture_prompt' # Use base64 field
+            'profile_picture_url', 'profile_picture_prompt',
+            'rating', 'rated_battles',
         )
         read_only_fields = (
             'id', 'username', 'level', 
             'hp', 'attack', 'defense', 'speed',
             'attacks', 'selected_attacks', 'booster_credits', 'last_seen', 'stats',
-            'profile_picture_prompt' # Prompt usually read-only for client
-            # profile_picture_base64 is implicitly read-only as it's not listed for update
+            'profile_picture_prompt', # Prompt usually read-only for client
+            'rating', 'rated_battles',
         )
 
     def get_attacks(self, user_instance):
@@ -103,6 +142,18 @@ class UserSerializer(serializers.ModelSerializer):
         attacks_queryset = user_instance.selected_attacks.all()
         return AttackSerializer(attacks_queryset, many=True, read_only=True).data
 
+    def get_stats(self, user_instance):
+        """Keeps the historical `stats` shape while the counters live in dedicated columns."""
+        stats_data = user_instance.stats if isinstance(user_instance.stats, dict) else {}
+        return {
+            **stats_data,
+            'wins_vs_human': user_instance.wins_vs_human,
+            'losses_vs_human': user_instance.losses_vs_human,
+            'wins_vs_bot': user_instance.wins_vs_bot,
+            'losses_vs_bot': user_instance.losses_vs_bot,
+            'total_damage_dealt': user_instance.total_damage_dealt,
+        }
+
 # --- NEW: Serializer for Updating Base Stats --- 
 STAT_INCREMENT = 10
 MIN_STAT_VALUE = 10
@@ -145,7 +196,9 @@ class UserStatsUpdateSerializer(serializers.ModelSerializer):
 # --- NEW: Leaderboard Serializers ---
 
 class UserStatsSerializer(serializers.ModelSerializer):
-    """Serializer for the current user's detailed stats."""
+    """Serializer for the current user's detailed stats.
+    Reads the materialised UserBattleSummary (user.battle_summary); users without one have no finished battles yet.
+    """
     total_wins = serializers.SerializerMethodField()
     total_losses = serializers.SerializerMethodField()
     total_rounds_played = serializers.SerializerMethodField()
@@ -162,33 +215,38 @@ class UserStatsSerializer(serializers.ModelSerializer):
             'nemesis',
         )
 
+    def _summary(self, user_instance):
+        try:
+            return user_instance.battle_summary
+        except UserBattleSummary.DoesNotExist:
+            return None
+
     def get_total_wins(self, user_instance):
-        return user_instance.get_total_wins()
+        summary = self._summary(user_instance)
+        return summary.wins if summary else 0
 
     def get_total_losses(self, user_instance):
-        return user_instance.get_total_losses()
+        summary = self._summary(user_instance)
+        return summary.losses if summary else 0
 
     def get_total_rounds_played(self, user_instance):
-        return user_instance.get_total_rounds_played()
+        summary = self._summary(user_instance)
+        return summary.rounds_played if summary else 0
 
     def get_nemesis(self, user_instance):
-        # The model method already returns a dict or None
-        return user_instance.get_nemesis()
+        summary = self._summary(user_instance)
+        if not summary or not summary.nemesis:
+            return None
+        return {
+            "username": summary.nemesis.username,
+            "losses_against": summary.nemesis_losses
+        }
 
 
 class LeaderboardUserSerializer(serializers.ModelSerializer):
     """Serializer for displaying users on the public leaderboard."""
-    # total_wins = serializers.SerializerMethodField() # REMOVED - Replaced by detailed stats
     selected_attacks = serializers.SerializerMethodField(read_only=True) # User's current loadout
 
-    # --- RE-ADD STAT FIELDS --- 
-    wins_vs_human = serializers.SerializerMethodField()
-    losses_vs_human = serializers.SerializerMethodField()
-    wins_vs_bot = serializers.SerializerMethodField()
-    losses_vs_bot = serializers.SerializerMethodField()
-    total_damage_dealt = serializers.SerializerMethodField()
-    # --- END RE-ADD STAT FIELDS ---
-
     class Meta:
         model = User
         fields = (
@@ -196,51 +254,20 @@ class LeaderboardUserSerializer(serializers.ModelSerializer):
             'username', 
             'level', 
             'selected_attacks',
-            # --- ADDED new stat fields to output ---
+            # Counters are real columns now (see User model)
             'wins_vs_human',
             'losses_vs_human',
             'wins_vs_bot',
             'losses_vs_bot',
             'total_damage_dealt',
-            # --- END ADDED ---
+            'rating',
+            'rated_battles',
         )
-
-    # def get_total_wins(self, user_instance):
-    #     # Reuse the method from the User model
-    #     return user_instance.get_total_wins()
-
-    # --- RE-ADD Methods to get stats safely from JSON --- 
-    def get_user_stat(self, obj, key, default=0):
-        """Helper to safely get stats from user.stats JSON field."""
-        stats_data = getattr(obj, 'stats', {})
-        if not isinstance(stats_data, dict):
-            # Attempt to load if it's a string, otherwise return default
-            try:
-                loaded_stats = json.loads(stats_data) if isinstance(stats_data, str) else {}
-                stats_data = loaded_stats if isinstance(loaded_stats, dict) else {}
-            except json.JSONDecodeError:
-                stats_data = {}
-        return stats_data.get(key, default)
-
-    def get_wins_vs_human(self, obj):
-        return self.get_user_stat(obj, 'wins_vs_human')
-
-    def get_losses_vs_human(self, obj):
-        return self.get_user_stat(obj, 'losses_vs_human')
-
-    def get_wins_vs_bot(self, obj):
-        return self.get_user_stat(obj, 'wins_vs_bot')
-
-    def get_losses_vs_bot(self, obj):
-        return self.get_user_stat(obj, 'losses_vs_bot')
-
-    def get_total_damage_dealt(self, obj):
-        return self.get_user_stat(obj, 'total_damage_dealt')
-    # --- END RE-ADD Methods --- 
+        read_only_fields = fields
 
     def get_selected_attacks(self, user_instance):
         # Reuse logic similar to UserSerializer or import AttackSerializer
         from game.serializers import AttackSerializer
+        # .all() is served from the view's prefetch_related('selected_attacks')
         attacks_queryset = user_instance.selected_attacks.all()
-        # Limit the number of attacks shown in the leaderboard view if desired, e.g., [:4]
-        return AttackSerializer(attacks_queryset, many=True, read_only=True).data
\ No newline at end of file
+        return AttackSerializer(attacks_queryset, many=True, read_only=True).data
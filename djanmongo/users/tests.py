@@ -0,0 +1,124 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from game.models import Attack, Battle
+
+from .models import User, UserBattleSummary
+
+
+class UserEndpointQueryCountTests(APITestCase):
+    """Pins the query count of the profile, directory and leaderboards: it must not grow with the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        attacks = [Attack.objects.create(name=f"Attack {i}", momentum_cost=20) for i in range(4)]
+        cls.alice.attacks.set(attacks)
+        cls.alice.selected_attacks.set(attacks)
+
+        players = []
+        for i in range(6):
+            player = User.objects.create_user(f'player{i}', password='x', rating=1000 + i * 10)
+            player.selected_attacks.set(attacks[:2])
+            players.append(player)
+        for i, player in enumerate(players):
+            winner = cls.alice if i % 2 else player
+            Battle.objects.create(player1=cls.alice, player2=player, status='finished', winner=winner)
+        Battle.objects.create(player1=players[0], player2=players[1], status='active')
+        UserBattleSummary.rebuild_all()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_user_profile(self):
+        self.client.force_authenticate(self.alice)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_directory(self):
+        self.client.force_authenticate(self.alice)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 6)
+
+    def test_leaderboard(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/leaderboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 7)
+
+    def test_rating_leaderboard(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/leaderboard/ratings/', {'min_rating': 1020})
+        self.assertEqual(response.status_code, 200)
+        # Finished battles above were rated, so count what the filter should match
+        self.assertEqual(len(response.json()['results']), User.objects.filter(rating__gte=1020).count())
+
+    def test_leaderboard_cached_page(self):
+        self.client.get('/api/users/leaderboard/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/leaderboard/')
+        self.assertEqual(response.status_code, 200)
+
+
+class LeaderboardCursorTests(APITestCase):
+    """Cursors are signed and cached pages rebuild their links for each request."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            User.objects.create_user(f'player{i}', password='x')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_forged_cursor_is_rejected(self):
+        forged = base64.urlsafe_b64encode(json.dumps({'v': [0, 'zzz'], 'p': 0}).encode()).decode()
+        response = self.client.get('/api/users/leaderboard/', {'cursor': forged})
+        self.assertEqual(response.status_code, 404)
+
+    def test_next_cursor_round_trips(self):
+        first = self.client.get('/api/users/leaderboard/', {'limit': 2}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 2)
+        self.assertNotEqual(first['results'][0]['username'], second['results'][0]['username'])
+
+    @override_settings(ALLOWED_HOSTS=['first.example.com', 'second.example.com'])
+    def test_cached_page_links_follow_the_request_host(self):
+        self.client.get('/api/users/leaderboard/', {'limit': 2}, HTTP_HOST='first.example.com')
+        response = self.client.get('/api/users/leaderboard/', {'limit': 2}, HTTP_HOST='second.example.com')
+        self.assertTrue(response.json()['next'].startswith('http://second.example.com/'))
+
+
+class BattleSummaryTests(TestCase):
+    """The incremental summaries must match UserBattleSummary.rebuild_all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+
+    def summaries(self):
+        return list(UserBattleSummary.objects.order_by('user_id').values_list('user_id', 'wins', 'losses', 'rounds_played', 'nemesis_id', 'nemesis_losses'))
+
+    def forfeit(self, loser):
+        from game.battle_logic import forfeit_battle
+        battle = Battle.objects.create(player1=self.alice, player2=self.bob, status='active')
+        battle.initialize_battle_state()
+        with transaction.atomic():
+            forfeit_battle(battle, loser, reason="Test forfeit")
+
+    def test_forfeits_match_rebuild(self):
+        self.forfeit(self.bob)
+        self.forfeit(None) # Abandoned: no winner, a loss for both
+        incremental = self.summaries()
+        self.assertEqual(incremental, [(self.alice.pk, 1, 1, 2, self.bob.pk, 1), (self.bob.pk, 0, 2, 2, self.alice.pk, 2)])
+        UserBattleSummary.rebuild_all()
+        self.assertEqual(self.summaries(), incremental)
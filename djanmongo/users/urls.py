@@ -8,8 +8,12 @@ urlpatterns = [
     path('me/', views.UserProfileView.as_view(), name='user_profile'),
     path('me/selected-attacks/', views.UserSelectedAttacksUpdateView.as_view(), name='user_update_selected_attacks'),
     path('me/stats/', views.UserStatsView.as_view(), name='user_stats'),
+    path('me/analytics/', views.UserDailyStatsView.as_view(), name='user_analytics'),
     path('me/generate-profile-picture', views.GenerateProfilePictureView.as_view(), name='user_generate_profile_picture'),
+    path('images/<str:image_hash>/', views.ProfileImageView.as_view(), name='user_profile_image'),
+    path('<int:pk>/card/', views.PlayerCardView.as_view(), name='user_player_card'),
     path('', views.UserListView.as_view(), name='user_list'), # List users for potential battles
     path('leaderboard/', views.LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard/ratings/', views.RatingLeaderboardView.as_view(), name='rating_leaderboard'),
     path('csrf-token/', views.CsrfTokenView.as_view(), name='csrf_token'),
 ]
@@ -1,12 +1,26 @@
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.throttling import AnonRateThrottle
 from django.contrib.auth import authenticate, login, logout # <-- Add imports
 from django.middleware.csrf import get_token # <-- Add import
-
-from .models import User
-from .serializers import UserRegisterSerializer, UserProfileSerializer, BasicUserSerializer, UserSerializer, UserStatsSerializer, LeaderboardUserSerializer, UserStatsUpdateSerializer
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.utils import timezone
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotModified
+import re
+from datetime import timedelta
+from django.db.models import Count, Exists, OuterRef, Q, Subquery, Sum
+from functools import partial
+
+from .models import User, UserBattleSummary, UserDailyStats
+from .pagination import LeaderboardPagination, CachedLeaderboardPageMixin, RatingLeaderboardPagination, UserDirectoryPagination
+from .conditional import conditional_response, version_etag
+from .image_storage import decode_base64_image, detect_content_type, load_image, store_image
+from .serializers import UserRegisterSerializer, UserSerializer, UserStatsSerializer, LeaderboardUserSerializer, UserStatsUpdateSerializer, PlayerCardSerializer, PLAYER_CARD_FIELDS, DirectoryUserSerializer
 from game.models import Attack, GameConfiguration # Import Attack model and GameConfiguration
 
 # --- NEW: Import services ---
@@ -24,6 +38,27 @@ class RegisterView(generics.CreateAPIView):
     permission_classes = (permissions.AllowAny,)
     serializer_class = UserRegisterSerializer
 
+DIRECTORY_FIELDS = ('id', 'username', 'level', 'allow_bot_challenges', 'profile_picture_hash', 'last_seen')
+SHA256_HEX_RE = re.compile(r'[0-9a-f]{64}')
+PROFILE_IMAGE_MAX_AGE = 60 * 60 * 24 * 365 # Content-addressed: never changes
+
+# --- Profile version (conditional GET) ---
+# Every column UserSerializer shows directly
+PROFILE_VERSION_FIELDS = (
+    'pk', 'updated_at', 'last_seen', 'booster_credits', 'stats', 'profile_picture_hash', 'profile_picture_prompt',
+    'wins_vs_human', 'losses_vs_human', 'wins_vs_bot', 'losses_vs_bot', 'total_damage_dealt', 'rating', 'rated_battles',
+)
+
+def _m2m_version(through, aggregate):
+    """Scalar subquery aggregating the user's rows in an M2M table (used as an ETag part)."""
+    return Subquery(
+        through.objects.filter(user_id=OuterRef('pk'))
+        .values('user_id')
+        .annotate(version=aggregate)
+        .values('version')
+    )
+# --- END Profile version ---
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     """Retrieves or updates the profile of the currently authenticated user.
     
@@ -40,24 +75,122 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
         """Returns the currently authenticated user."""
         return self.request.user # Return the logged-in user's profile
 
+    def get(self, request, *args, **kwargs):
+        """Conditional GET. The scalar fields are read as they are in the row (counters and
+        credits change through F() updates that do not touch updated_at); the learned and
+        selected attacks are summarised by subqueries on the M2M tables. No Last-Modified:
+        there is no timestamp covering all of these, so only the ETag is a safe validator.
+        """
+        row = User.objects.filter(pk=request.user.pk).values(
+            *PROFILE_VERSION_FIELDS,
+            attacks_count=_m2m_version(User.attacks.through, Count('id')),
+            attacks_id_sum=_m2m_version(User.attacks.through, Sum('attack_id')),
+            favorites_id_sum=_m2m_version(User.attacks.through, Sum('attack_id', filter=Q(attack__is_favorite=True))),
+            selected_count=_m2m_version(User.selected_attacks.through, Count('id')),
+            selected_id_sum=_m2m_version(User.selected_attacks.through, Sum('attack_id')),
+        ).first()
+        etag = version_etag('profile', *row.values())
+        return conditional_response(request, etag, None, partial(super().get, request, *args, **kwargs))
+
 class UserListView(generics.ListAPIView):
-    """Lists users available for battling (excluding the requester).
-    
-    Responds to GET requests with a list of users (excluding the one making
-    the request), serialized using `BasicUserSerializer`.
-    Used for populating opponent lists.
-    Requires authentication.
+    """Player directory: users available for battling (excluding the requester).
+
+    Query parameters:
+    - `online_minutes=N`: only users seen in the last N minutes (indexed `last_seen`)
+    - `q=<prefix>`: username prefix search (case-insensitive)
+    - `cursor` / `limit`: keyset pagination in username order (see UserDirectoryPagination)
+
+    Each entry is a `DirectoryUserSerializer`: the basic card, `last_seen` and
+    `in_active_battle`, the latter annotated with an EXISTS subquery so a page is a
+    single query. Requires authentication.
     Endpoint: `/api/users/` (typically)
     """
     permission_classes = (permissions.IsAuthenticated,)
-    serializer_class = BasicUserSerializer # Use a simpler serializer for lists
+    serializer_class = DirectoryUserSerializer
+    pagination_class = UserDirectoryPagination
 
     def get_queryset(self):
-        """Returns a queryset of all users excluding the requesting user."""
-        # Exclude the requesting user from the list
-        return User.objects.exclude(pk=self.request.user.pk).order_by('username')
+        """Returns the filtered directory queryset, excluding the requesting user."""
+        from game.models import BattleParticipant
+
+        queryset = (
+            User.objects.exclude(pk=self.request.user.pk)
+            .only(*DIRECTORY_FIELDS)
+            .annotate(in_active_battle=Exists(
+                BattleParticipant.objects.filter(user=OuterRef('pk'), status='active')
+            ))
+        )
+
+        online_minutes = self.request.query_params.get('online_minutes')
+        if online_minutes is not None:
+            try:
+                online_minutes = int(online_minutes)
+                if online_minutes <= 0:
+                    raise ValueError
+            except ValueError:
+                raise ValidationError({"online_minutes": "Must be a positive integer."})
+            queryset = queryset.filter(last_seen__gte=timezone.now() - timedelta(minutes=online_minutes))
+
+        prefix = self.request.query_params.get('q', '').strip()
+        if prefix:
+            queryset = queryset.filter(username__istartswith=prefix)
+        return queryset
 
 # --- Add UserSelectedAttacksUpdateView ---
+class PlayerCardView(APIView):
+    """Returns a player's card (stats and profile picture) for display next to a battle.
+
+    Battle payloads only carry {id, username, card_version}; clients request
+    `/api/users/<id>/card/?v=<card_version>`, so the response can be cached for a long
+    time and a changed card simply gets a new URL. The ETag is derived from
+    User.updated_at and checked with a single-column query before the card is loaded.
+    Requires authentication.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, pk, *args, **kwargs):
+        updated_at = User.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = quote_etag(f"card-{pk}-{User.card_version_for(updated_at)}")
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            patch_cache_control(not_modified, private=True, max_age=settings.PLAYER_CARD_MAX_AGE)
+            return not_modified
+
+        user = User.objects.only(*PLAYER_CARD_FIELDS).get(pk=pk)
+        response = Response(PlayerCardSerializer(user).data, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.PLAYER_CARD_MAX_AGE)
+        return response
+
+class ProfileImageView(APIView):
+    """Serves a profile picture by its content hash.
+
+    The URL changes whenever the picture does (User.profile_picture_url), so responses
+    are public and cacheable forever. No authentication: avatars appear on public pages.
+    """
+    permission_classes = (permissions.AllowAny,)
+    authentication_classes = () # Skip session lookup and CSRF for image requests
+
+    def get(self, request, image_hash, *args, **kwargs):
+        if not SHA256_HEX_RE.fullmatch(image_hash):
+            return HttpResponseNotFound()
+        etag = quote_etag(image_hash)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            data = load_image(image_hash)
+            if data is None:
+                return HttpResponseNotFound()
+            response = HttpResponse(data, content_type=detect_content_type(data))
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=PROFILE_IMAGE_MAX_AGE, immutable=True)
+        return response
+
 class UserSelectedAttacksUpdateView(APIView):
     """Updates the selected attacks for the authenticated user.
 
@@ -146,17 +279,21 @@ class UserStatsView(generics.RetrieveUpdateAPIView):
     # serializer_class determined by get_serializer_class
 
     def get_object(self):
-        """Returns the currently authenticated user."""
-        return self.request.user
+        """Returns the currently authenticated user.
+           For GET, attaches the user's UserBattleSummary (and nemesis) fetched with one primary-key lookup.
+        """
+        user = self.request.user
+        if self.request.method == 'GET':
+            summary = UserBattleSummary.objects.select_related('nemesis').filter(pk=user.pk).first()
+            # Cache the result (even None) so the serializer does not query again
+            User.battle_summary.related.set_cached_value(user, summary)
+        return user
 
     def get_serializer_class(self):
         """Return appropriate serializer class based on request method."""
         if self.request.method in ('PUT', 'PATCH'):
-            # Import locally to potentially avoid circular dependency issues
-            from .serializers import UserStatsUpdateSerializer 
             return UserStatsUpdateSerializer
         # For GET requests
-        from .serializers import UserStatsSerializer
         return UserStatsSerializer
 
     # Optional: Override perform_update for additional logic after successful update
@@ -165,44 +302,92 @@ class UserStatsView(generics.RetrieveUpdateAPIView):
     #     super().perform_update(serializer)
     #     # e.g., send a signal, log the update
 
-class LeaderboardView(generics.ListAPIView):
+# --- NEW: Personal analytics from the daily rollup ---
+class UserDailyStatsView(APIView):
+    """Day-by-day battles, wins and win rate of the logged-in user, from UserDailyStats.
+
+    Query params: `from`, `to` (YYYY-MM-DD, inclusive; default last 30 days).
+    Days without battles are omitted.
+    Endpoint: `/api/users/me/analytics/`
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        from game.analytics import parse_date_range, win_rate
+        date_from, date_to = parse_date_range(request)
+        days = list(
+            UserDailyStats.objects
+            .filter(user=request.user, date__range=(date_from, date_to))
+            .order_by('date')
+            .values('date', 'battles', 'wins')
+        )
+        total_battles = total_wins = 0
+        for day in days:
+            day['losses'] = day['battles'] - day['wins']
+            day['win_rate'] = win_rate(day['wins'], day['losses'])
+            total_battles += day['battles']
+            total_wins += day['wins']
+        return Response({
+            'from': date_from,
+            'to': date_to,
+            'totals': {
+                'battles': total_battles,
+                'wins': total_wins,
+                'losses': total_battles - total_wins,
+                'win_rate': win_rate(total_wins, total_battles - total_wins),
+            },
+            'days': days,
+        })
+# --- END NEW ---
+
+class LeaderboardView(CachedLeaderboardPageMixin, generics.ListAPIView):
     """Provides a public leaderboard of users.
 
-    Responds to GET requests with a list of all users, serialized using
-    `LeaderboardUserSerializer` (includes username, level, wins, selected attacks).
-    Currently fetches all users; sorting/ranking logic might be handled client-side
-    or refined here later if needed.
-    Allows any user (no authentication required).
-    Endpoint: `/api/leaderboard/` (typically)
+    Responds to GET requests with a page of users ordered by wins against
+    humans (then username), serialized using `LeaderboardUserSerializer`
+    (includes username, level, win/loss counters, selected attacks).
+    Pages are keyset-paginated (`?cursor=`, `?limit=` up to 100) on the
+    indexed counter columns; the first pages are served from the cache.
+    Allows any user (no authentication required), throttled per client.
+    Endpoint: `/api/users/leaderboard/` (typically)
     """
     # Allow any user (authenticated or not) to view the leaderboard
     permission_classes = (permissions.AllowAny,)
     serializer_class = LeaderboardUserSerializer
+    # Checked by request_timing.RequestTimingMiddleware: page query + selected_attacks prefetch
+    # (0 when cached), plus up to 3 session/user/presence queries for logged-in requests
+    timing_budget = {'queries': 8}
+    pagination_class = LeaderboardPagination
+    throttle_classes = (AnonRateThrottle,)
+    page_cache_prefix = 'users'
 
     def get_queryset(self):
-        # Update: We need server-side sorting for the leaderboard based on stats.
-        # This requires annotation or careful ORM filtering/sorting.
-        # Simple annotation example (requires PostgreSQL for JSONField key lookups efficiently):
-        # from django.db.models.functions import Cast, Coalesce
-        # from django.db.models import IntegerField, Value
-        # queryset = User.objects.annotate(
-        #     human_wins=Coalesce(Cast(KeyTextTransform('wins_vs_human', 'stats'), IntegerField()), Value(0))
-        # ).order_by('-human_wins', 'username')
-        
-        # Simpler approach: Get all users, rely on serializer methods for stats.
-        # Let's SORT on the backend now. This might be slow without indexing/annotation.
-        # We'll sort by human wins descending primarily, then username.
-        # Note: Sorting on JSONField keys directly is database-dependent and can be slow.
-        # Consider creating dedicated fields or using annotations for performance.
-        users = sorted(
-            list(User.objects.all()), 
-            key=lambda u: (
-                u.stats.get('wins_vs_human', 0) if isinstance(u.stats, dict) else 0, 
-                u.username
-            ),
-            reverse=True # Sort descending by wins_vs_human
-        )
-        return users
+        # Ordered by the paginator (user_leaderboard_idx); selected attacks fetched in one extra query per page
+        return User.objects.prefetch_related('selected_attacks')
+
+class RatingLeaderboardView(LeaderboardView):
+    """Public leaderboard ordered by Elo rating (then username).
+
+    Same payload, pagination and caching as `LeaderboardView`. Optional
+    `?min_rating=` / `?max_rating=` restrict the page to a rating range
+    (a range scan on the same index).
+    Endpoint: `/api/users/leaderboard/ratings/` (typically)
+    """
+    pagination_class = RatingLeaderboardPagination
+    page_cache_prefix = 'ratings'
+    page_cache_filter_params = ('min_rating', 'max_rating')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for param, lookup in (('min_rating', 'rating__gte'), ('max_rating', 'rating__lte')):
+            value = self.request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                queryset = queryset.filter(**{lookup: float(value)})
+            except ValueError:
+                raise ValidationError({param: "Must be a number."})
+        return queryset
 
 # --- NEW: CSRF Token View ---
 class CsrfTokenView(APIView):
@@ -274,12 +459,16 @@ class GenerateProfilePictureView(APIView):
              # Optionally restore credits
             return Response({"detail": "Image generation service failed to return image data."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # 5. Save Base64 and Prompt to User
+        image_data = decode_base64_image(base64_image_data)
+        if not image_data:
+            return Response({"detail": "Image generation service returned invalid image data."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # 5. Store the image and save its hash and the prompt to the User
         try:
-            user.profile_picture_base64 = base64_image_data # Save base64 data
+            user.profile_picture_hash = store_image(image_data)
             user.profile_picture_prompt = generated_image_prompt
             # Update the correct fields
-            user.save(update_fields=["profile_picture_base64", "profile_picture_prompt"])
+            user.save(update_fields=["profile_picture_hash", "profile_picture_prompt", "updated_at"]) # updated_at versions the player card
         except Exception as e:
              print(f"[View Error] Failed to save image data for user {user.username}: {e}")
              # Credits already deducted, log error but maybe still return success? Or specific error?
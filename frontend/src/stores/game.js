@@ -7,6 +7,9 @@ import { fetchMyStats as apiFetchMyStats, fetchLeaderboard as apiFetchLeaderboar
 export const useGameStore = defineStore('game', () => {
   // --- State --- 
   const users = ref([]); // List of other users available to challenge
+  const userSearch = ref(''); // Username prefix filter for the directory (?q=)
+  const usersNextCursor = ref(null); // Cursor of the next directory page, null on the last page
+  const isLoadingMoreUsers = ref(false);
   const pendingBattles = ref([]); // List of battles awaiting response from logged-in user
   const activeBattle = ref(null); // Will hold full battle details if active
   // Track outgoing challenges { opponentId: battleId }
@@ -20,6 +23,9 @@ export const useGameStore = defineStore('game', () => {
   const battleMessage = ref(null); // Specific message for battle updates
   const turnSummary = ref([]); // Store turn summary messages
   const isConceding = ref(false); // Added state for concede loading
+  // Player cards by user id: { version, card }. Battle states only carry { id, username, card_version }.
+  const playerCards = ref({});
+  const pendingCardRequests = {};
 
   // NEW: Store last generated attacks preview
   const lastGeneratedAttacks = ref([]);
@@ -34,24 +40,92 @@ export const useGameStore = defineStore('game', () => {
   const leaderboardError = ref(null);
   const attackLeaderboardError = ref(null);
 
+  // --- Battle state helpers ---
+
+  // Fetch a player's card unless this version is already loaded. The URL carries the
+  // version, so the browser can keep the response cached for as long as it stays current.
+  async function ensurePlayerCard(playerRef) {
+    if (!playerRef?.id) return;
+    const key = `${playerRef.id}:${playerRef.card_version}`;
+    if (playerCards.value[playerRef.id]?.version === playerRef.card_version || pendingCardRequests[key]) return;
+    pendingCardRequests[key] = true;
+    try {
+      const response = await apiClient.get(`/users/${playerRef.id}/card/`, { params: { v: playerRef.card_version } });
+      playerCards.value[playerRef.id] = { version: response.data.card_version, card: response.data };
+    } catch (error) {
+      console.error(`Failed to fetch player card ${playerRef.id}:`, error.response?.data || error.message);
+    } finally {
+      delete pendingCardRequests[key];
+    }
+  }
+
+  // Player reference merged with its card (whatever part of it is loaded)
+  function playerWithCard(playerRef) {
+    if (!playerRef) return null;
+    return { ...(playerCards.value[playerRef.id]?.card || {}), ...playerRef };
+  }
+
+  // Query params asking the server only for log entries we do not have yet
+  function logParamsFor(battleId) {
+    const current = activeBattle.value;
+    if (!current || current.id !== parseInt(battleId)) return {};
+    return { log_from: current.last_turn_summary?.length ?? 0 };
+  }
+
+  // Battle states carry a window of the log (`log` from `log_offset`); rebuild the full
+  // log in `last_turn_summary` from what we already hold for the same battle.
+  function setActiveBattle(state) {
+    if (!state) {
+      activeBattle.value = null;
+      return;
+    }
+    const previous = activeBattle.value;
+    const knownLog = previous && previous.id === state.id ? (previous.last_turn_summary || []) : [];
+    const offset = state.log_offset ?? 0;
+    const fullLog = knownLog.length >= offset
+      ? knownLog.slice(0, offset).concat(state.log || [])
+      : (state.log || []);
+    activeBattle.value = { ...state, last_turn_summary: fullLog };
+    ensurePlayerCard(state.player1);
+    ensurePlayerCard(state.player2);
+  }
+
   // --- Actions --- 
 
-  // Fetch users (excluding self)
+  // Cursor of a directory `next` link (the link itself is absolute, built by the server)
+  function cursorFromLink(link) {
+    if (!link) return null;
+    return new URL(link, window.location.origin).searchParams.get('cursor');
+  }
+
+  // Fetch users (excluding self): first page of the paginated directory (username order),
+  // filtered by userSearch. Pages loaded with fetchMoreUsers() are kept while polling.
   async function fetchUsers(isPolling = false) {
     if (!isPolling) {
         isLoadingUsers.value = true;
         actionError.value = null;
     }
     try {
-      const response = await apiClient.get('/users/');
-      if (JSON.stringify(users.value) !== JSON.stringify(response.data)) {
-          users.value = response.data;
+      const params = userSearch.value ? { q: userSearch.value } : {};
+      const response = await apiClient.get('/users/', { params });
+      let page = response.data.results ?? response.data;
+      const nextCursor = cursorFromLink(response.data.next);
+      if (isPolling && nextCursor && users.value.length > page.length) {
+          // Keep the further pages already loaded: the players sorting after this page
+          const lastUsername = page[page.length - 1]?.username ?? '';
+          page = page.concat(users.value.filter(player => player.username > lastUsername));
+      } else {
+          usersNextCursor.value = nextCursor;
+      }
+      if (JSON.stringify(users.value) !== JSON.stringify(page)) {
+          users.value = page;
       }
     } catch (error) {
       if (!isPolling || !error.response) { 
           console.error('Failed to fetch users:', error.response?.data || error.message);
           actionError.value = 'Could not load users.';
           users.value = []; 
+          usersNextCursor.value = null;
       }
     } finally {
       if (!isPolling) {
@@ -60,6 +134,32 @@ export const useGameStore = defineStore('game', () => {
     }
   }
 
+  // Append the next directory page
+  async function fetchMoreUsers() {
+    if (!usersNextCursor.value || isLoadingMoreUsers.value) return;
+    isLoadingMoreUsers.value = true;
+    try {
+      const params = { cursor: usersNextCursor.value };
+      if (userSearch.value) params.q = userSearch.value;
+      const response = await apiClient.get('/users/', { params });
+      const knownIds = new Set(users.value.map(player => player.id));
+      users.value = users.value.concat((response.data.results || []).filter(player => !knownIds.has(player.id)));
+      usersNextCursor.value = cursorFromLink(response.data.next);
+    } catch (error) {
+      console.error('Failed to fetch more users:', error.response?.data || error.message);
+      actionError.value = 'Could not load more players.';
+    } finally {
+      isLoadingMoreUsers.value = false;
+    }
+  }
+
+  // Restart the directory from its first page with a username prefix filter
+  async function searchUsers(query) {
+    userSearch.value = (query || '').trim();
+    usersNextCursor.value = null;
+    await fetchUsers();
+  }
+
   // Fetch pending battle requests for the logged-in user
   async function fetchPendingBattles(isPolling = false) {
     if (!isPolling) {
@@ -99,7 +199,7 @@ export const useGameStore = defineStore('game', () => {
       // Check response for immediate battle start (when fighting as bot)
       if (response.data.battle && response.data.battle.status === 'active') {
         actionSuccessMessage.value = response.data.message; // e.g., "Battle with Bot started!"
-        activeBattle.value = response.data.battle; // Set active battle immediately
+        setActiveBattle(response.data.battle); // Set active battle immediately
         // Clear any potential outgoing challenge entry for this opponent
         delete outgoingPendingChallenges.value[opponentId];
         sessionStorage.setItem('outgoingPendingChallenges', JSON.stringify(outgoingPendingChallenges.value));
@@ -149,7 +249,7 @@ export const useGameStore = defineStore('game', () => {
       // If accepted, set the active battle state immediately from response
       if (responseAction === 'accept' && response.data.battle) {
          console.log('Battle accepted, setting active battle state:', response.data.battle);
-         activeBattle.value = response.data.battle; 
+         setActiveBattle(response.data.battle);
          // TODO: Need to navigate user to the battle view from the component
          return { accepted: true, battle: response.data.battle }; // Return battle data
       }
@@ -171,12 +271,12 @@ export const useGameStore = defineStore('game', () => {
           turnSummary.value = [];
       }
       try {
-          const response = await apiClient.get('/game/battles/active/');
-          const oldBattleState = JSON.stringify(activeBattle.value);
-          const newBattleState = JSON.stringify(response.data);
-          const changed = oldBattleState !== newBattleState;
+          const response = await apiClient.get('/game/battles/active/', { params: logParamsFor(activeBattle.value?.id) });
+          const changed = !activeBattle.value
+              || activeBattle.value.id !== response.data.id
+              || activeBattle.value.updated_at !== response.data.updated_at;
           if (changed) {
-              activeBattle.value = response.data;
+              setActiveBattle(response.data);
               if (activeBattle.value) {
                  const opponentId = activeBattle.value.player1.id === useAuthStore().currentUser?.id ? activeBattle.value.player2.id : activeBattle.value.player1.id;
                  if (outgoingPendingChallenges.value[opponentId] === activeBattle.value.id) {
@@ -205,12 +305,12 @@ export const useGameStore = defineStore('game', () => {
     battleError.value = null;
     battleMessage.value = 'Submitting action...';
     try {
-      const response = await apiClient.post(`/game/battles/${battleId}/action/`, { attack_id: attackId });
+      const response = await apiClient.post(`/game/battles/${battleId}/action/`, { attack_id: attackId }, { params: logParamsFor(battleId) });
       battleMessage.value = response.data.message; 
       
       // Always update the battle state from the response
       if (response.data.battle_state) {
-          activeBattle.value = response.data.battle_state;
+          setActiveBattle(response.data.battle_state);
           if (response.data.battle_state.status === 'finished') {
               battleMessage.value = "Battle Finished!";
           }
@@ -233,9 +333,9 @@ export const useGameStore = defineStore('game', () => {
      battleMessage.value = null;
      turnSummary.value = [];
      try {
-         const response = await apiClient.get(`/game/battles/${battleId}/`);
+         const response = await apiClient.get(`/game/battles/${battleId}/`, { params: logParamsFor(battleId) });
          if (!activeBattle.value || activeBattle.value.id === response.data.id) {
-            activeBattle.value = response.data; 
+            setActiveBattle(response.data);
          }
          return response.data; // Return fetched data
      } catch (error) {
@@ -257,8 +357,8 @@ export const useGameStore = defineStore('game', () => {
       battleMessage.value = 'Conceding...';
       turnSummary.value = []; 
       try {
-          const response = await apiClient.post(`/game/battles/${battleId}/concede/`);
-          activeBattle.value = response.data.final_state;
+          const response = await apiClient.post(`/game/battles/${battleId}/concede/`, null, { params: logParamsFor(battleId) });
+          setActiveBattle(response.data.final_state);
           battleMessage.value = response.data.message; // e.g., "You conceded. Opponent wins!"
           turnSummary.value = []; 
           return true;
@@ -294,12 +394,8 @@ export const useGameStore = defineStore('game', () => {
     leaderboardError.value = null;
     try {
       const response = await apiFetchLeaderboard(); // Use imported function
-      leaderboardData.value = response.data.sort((a, b) => {
-        if (b.total_wins !== a.total_wins) {
-            return b.total_wins - a.total_wins; // Higher wins first
-        }
-        return a.username.localeCompare(b.username); // Then alphabetical
-      });
+      // The backend returns a page already ordered by wins vs humans, then username
+      leaderboardData.value = response.data.results;
     } catch (error) {
       console.error('Failed to fetch player leaderboard:', error.response?.data || error.message);
       leaderboardError.value = 'Could not load player leaderboard.';
@@ -315,7 +411,7 @@ export const useGameStore = defineStore('game', () => {
       attackLeaderboardError.value = null;
       try {
           const response = await apiFetchAttackLeaderboard(sortBy, limit);
-          attackLeaderboardData.value = response.data; // Store the fetched data
+          attackLeaderboardData.value = response.data.results; // First page, ordered by usage
       } catch (error) {
           console.error('Failed to fetch attack leaderboard:', error.response?.data || error.message);
           attackLeaderboardError.value = 'Could not load attack leaderboard.';
@@ -379,8 +475,12 @@ export const useGameStore = defineStore('game', () => {
   return {
     // State
     users,
+    userSearch,
+    usersNextCursor,
+    isLoadingMoreUsers,
     pendingBattles,
     activeBattle,
+    playerCards,
     lastGeneratedAttacks, // Export new state
     isLoadingUsers,
     isLoadingPendingBattles,
@@ -407,6 +507,8 @@ export const useGameStore = defineStore('game', () => {
 
     // Actions
     fetchUsers,
+    fetchMoreUsers,
+    searchUsers,
     fetchPendingBattles,
     challengeUser,
     respondToBattle,
@@ -414,6 +516,7 @@ export const useGameStore = defineStore('game', () => {
     submitBattleAction, // Added action
     fetchBattleById, // Added action
     concedeBattle, // Export new action
+    playerWithCard,
     clearMessages,
 
     // NEW: Leaderboard Actions Exports